@@ -0,0 +1,58 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# benchmark the AccurateRip checksum implementations against each other
+# on random data, and make sure they agree
+
+# usage: benchmark-arcs.py [seconds of audio]
+
+import os
+import sys
+import time
+
+from morituri.common import accurip, common
+
+
+def run(method, data, size):
+    arcs = accurip.AccurateRipChecksum(2, 3, len(data) / 4)
+    update = getattr(arcs, method)
+
+    start = time.time()
+    for i in range(0, len(data), size):
+        update(data[i:i + size])
+    return arcs.checksum, time.time() - start
+
+
+def main(argv):
+    seconds = 10
+    if len(argv) > 1:
+        seconds = int(argv[1])
+
+    frames = seconds * common.FRAMES_PER_SECOND
+    data = os.urandom(frames * common.BYTES_PER_FRAME)
+    print 'checksumming %d seconds of audio (%d frames)' % (seconds, frames)
+
+    checksum, reference = run('_updatePython', data, common.BYTES_PER_FRAME)
+    print '%-30s %08x %8.3f s' % ('per sample, per frame', checksum,
+        reference)
+
+    if not accurip.numpy:
+        print 'numpy not installed, cannot compare'
+        return 1
+
+    for name, size in [
+        ('numpy, per frame', common.BYTES_PER_FRAME),
+        ('numpy, per second', common.BYTES_PER_FRAME * 75),
+        ('numpy, whole track', len(data)),
+        ]:
+        c, duration = run('_updateNumPy', data, size)
+        print '%-30s %08x %8.3f s (%.1fx)' % (name, c, duration,
+            reference / duration)
+        if c != checksum:
+            print 'ERROR: checksum %08x differs from %08x' % (c, checksum)
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
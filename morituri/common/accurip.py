@@ -20,13 +20,21 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 import errno
 import os
 import struct
+import sys
 import urlparse
 import urllib2
 
-from morituri.common import log
+from morituri.common import common, log
+
+# numpy is optional; without it we fall back to summing sample by sample
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 _CACHE_DIR = os.path.join(os.path.expanduser('~'), '.morituri', 'cache')
 
@@ -34,9 +42,13 @@ _CACHE_DIR = os.path.join(os.path.expanduser('~'), '.morituri', 'cache')
 class AccuCache(log.Loggable):
 
     def __init__(self):
-        if not os.path.exists(_CACHE_DIR):
-            self.debug('Creating cache directory %s', _CACHE_DIR)
+        # other rips can be creating it at the same time
+        try:
             os.makedirs(_CACHE_DIR)
+            self.debug('Created cache directory %s', _CACHE_DIR)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
 
     def _getPath(self, url):
         # split path starts with /
@@ -86,9 +98,7 @@ class AccuCache(log.Loggable):
             if e.errno != errno.EEXIST:
                 raise
 
-        handle = open(path, 'wb')
-        handle.write(data)
-        handle.close()
+        common.writeFileAtomically(path, data)
 
     def _read(self, url):
         self.debug("Reading %s from cache", url)
@@ -142,3 +152,191 @@ class AccurateRipResponse(object):
             pos += 9
             self.confidences.append(confidence)
             self.checksums.append(checksum)
+
+
+class AccurateRipChecksum(object):
+    """
+    I calculate the AccurateRip checksums of a track incrementally,
+    from consecutive buffers of decoded 16-bit stereo audio.
+
+    Each sample (both channels as one little-endian 32 bit value) is
+    multiplied by its 1-based position in the track.
+    The v1 checksum sums the products modulo 2 ** 32; the v2 checksum
+    also adds the upper 32 bits of each 64 bit product.
+    The first track skips its first five frames except for the last sample
+    of the fifth frame; the last track skips its last five frames.
+
+    @ivar checksum:   the v1 checksum of the samples seen so far
+    @type checksum:   int
+    @ivar checksumV2: the v2 checksum of the samples seen so far
+    @type checksumV2: int
+    """
+
+    checksum = 0
+    checksumV2 = 0
+
+    def __init__(self, trackNumber, trackCount, sampleLength):
+        """
+        @param sampleLength: length of the track in samples
+        @type  sampleLength: int
+        """
+        self._samples = 0 # number of samples seen so far
+
+        # first and last sample position (1-based, inclusive) to sum
+        self._first = 1
+        self._last = None
+        self._frame5 = None
+
+        if trackNumber == 1:
+            self._first = common.SAMPLES_PER_FRAME * 5
+        if trackNumber == trackCount:
+            frames = sampleLength / common.SAMPLES_PER_FRAME
+            self._last = (frames - 5) * common.SAMPLES_PER_FRAME
+            # the last sample of the 5th frame of the first track always
+            # counts, even on discs too short to have one
+            if trackNumber == 1 and self._last < self._first:
+                self._frame5 = self._first
+
+    def update(self, buf):
+        """
+        Add the given buffer to the checksums.
+
+        @param buf: a buffer of samples, two 16-bit values per sample.
+        @type  buf: C{str} or anything supporting the buffer interface
+        """
+        if numpy:
+            self._updateNumPy(buf)
+        else:
+            self._updatePython(buf)
+
+    def _getRange(self, count):
+        # return the half-inclusive range of indexes into a buffer of count
+        # samples starting at self._samples that should be summed
+        start = max(self._first - self._samples - 1, 0)
+        end = count
+        if self._last is not None:
+            end = min(end, self._last - self._samples)
+        return start, end
+
+    def _add(self, v1, v2):
+        self.checksum = (self.checksum + v1) & 0xFFFFFFFF
+        self.checksumV2 = (self.checksumV2 + v2) & 0xFFFFFFFF
+
+    def _updatePython(self, buf):
+        count = len(buf) / 4
+        values = struct.unpack("<%dI" % count, buf[:count * 4])
+        v1 = 0
+        v2 = 0
+
+        start, end = self._getRange(count)
+        for i in range(start, end):
+            product = (self._samples + i + 1) * values[i]
+            v1 += product
+            v2 += (product & 0xFFFFFFFF) + (product >> 32)
+
+        if self._frame5:
+            i = self._frame5 - self._samples - 1
+            if 0 <= i < count:
+                product = self._frame5 * values[i]
+                v1 += product
+                v2 += (product & 0xFFFFFFFF) + (product >> 32)
+
+        self._add(v1, v2)
+        self._samples += count
+
+    def _updateNumPy(self, buf):
+        values = numpy.frombuffer(buf, dtype='<u4')
+        count = len(values)
+
+        start, end = self._getRange(count)
+        if start < end:
+            # positions fit in 28 bits and values in 32, so products fit
+            # in 64 bits; sums wrap modulo 2 ** 64, which preserves them
+            # modulo 2 ** 32
+            products = numpy.arange(self._samples + start + 1,
+                self._samples + end + 1, dtype=numpy.uint64)
+            products *= values[start:end]
+            v1 = int(products.sum())
+            v2 = v1 + int((products >> numpy.uint64(32)).sum())
+            self._add(v1, v2)
+
+        if self._frame5:
+            i = self._frame5 - self._samples - 1
+            if 0 <= i < count:
+                product = self._frame5 * int(values[i])
+                self._add(product, (product & 0xFFFFFFFF) + (product >> 32))
+
+        self._samples += count
+
+
+def getOffsetChecksums(buf, trackNumber, trackCount, sampleLength, shifts):
+    """
+    Calculate the AccurateRip v1 checksums of a track for several read
+    offsets, from a single read of the track at the smallest of them.
+
+    For a shift of d samples, the track consists of the sampleLength
+    samples of the buffer starting at sample d.
+    Instead of summing every shifted track from scratch, I slide a window
+    over the buffer one sample at a time, updating both the weighted and
+    the plain sum of the samples in it.
+
+    The v2 checksum cannot be updated this way.
+
+    @param buf:          the track read at the smallest offset, followed
+                         by enough samples for the biggest shift
+    @type  buf:          C{str}
+    @param sampleLength: length of the track in samples
+    @type  sampleLength: int
+    @param shifts:       the shifts to calculate the checksum for,
+                         in samples
+    @type  shifts:       list of int >= 0
+
+    @rtype: dict of int -> int
+    """
+    values = array.array('I', buf[:len(buf) / 4 * 4])
+    assert values.itemsize == 4
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+    end = max(shifts)
+    if len(values) < sampleLength + end:
+        raise ValueError('need %d samples for a shift of %d, got %d' % (
+            sampleLength + end, end, len(values)))
+
+    arcs = AccurateRipChecksum(trackNumber, trackCount, sampleLength)
+    arcs.update(buf[:sampleLength * 4])
+
+    # the 0-based, inclusive range of samples in the window that are summed
+    first = arcs._first - 1
+    last = (arcs._last or sampleLength) - 1
+    frame5 = arcs._frame5
+
+    # weighted and plain sums of the samples in the window
+    weighted = arcs.checksum
+    if frame5:
+        weighted -= frame5 * values[frame5 - 1]
+    plain = 0
+    if first <= last:
+        plain = sum(values[first:last + 1])
+
+    wanted = set(shifts)
+    ret = {}
+    for d in range(end + 1):
+        if d in wanted:
+            checksum = weighted
+            if frame5:
+                checksum += frame5 * values[frame5 - 1 + d]
+            ret[d] = checksum & 0xFFFFFFFF
+
+        if d == end or first > last:
+            continue
+
+        # drop the first sample of the window, add the one after it,
+        # and give all others one less weight
+        head = values[first + d]
+        tail = values[last + 1 + d]
+        weighted = (weighted - plain - first * head
+            + (last + 1) * tail) & 0xFFFFFFFF
+        plain = (plain - head + tail) & 0xFFFFFFFF
+
+    return ret
@@ -0,0 +1,423 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_analysis -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Accumulators that analyze decoded audio one buffer at a time, so that
+a single decode can feed several analyses.
+"""
+
+import array
+import sys
+import zlib
+
+from morituri.common import accurip, common
+
+# numpy is optional; without it we fall back to the array module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Accumulator(object):
+    """
+    I am a base class for analyses of decoded 16-bit stereo audio.
+
+    I get fed consecutive buffers of samples through L{update}.
+    """
+
+    def setLength(self, sampleLength):
+        """
+        Called once with the number of samples to expect, before the
+        first buffer.
+
+        @type  sampleLength: int
+        """
+        pass
+
+    def update(self, buf):
+        """
+        Subclasses should implement this.
+
+        @param buf: a buffer of samples, two 16-bit values per sample.
+        @type  buf: C{str} or anything supporting the buffer interface
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Called once after the last buffer, by tasks that read audio
+        rather than decode files.
+        """
+        pass
+
+    def getCacheKey(self):
+        """
+        Subclasses that can have their results cached should implement
+        this, together with getCacheValue and setCacheValue.
+
+        @returns: what is calculated, for the checksum cache; None if
+                  the results cannot be cached
+        @rtype:   str or None
+        """
+        return None
+
+    def getCacheValue(self):
+        """
+        @returns: the results to store in the checksum cache
+        """
+        raise NotImplementedError
+
+    def setCacheValue(self, value):
+        """
+        Restore the results from a value returned by getCacheValue.
+        """
+        raise NotImplementedError
+
+
+class CRC32Accumulator(Accumulator):
+    """
+    I calculate a CRC32 checksum.
+
+    @ivar checksum: the CRC32 so far, as an unsigned 32 bit value
+    """
+
+    def __init__(self):
+        self._crc = 0
+
+    def update(self, buf):
+        self._crc = zlib.crc32(buf, self._crc)
+
+    def _getChecksum(self):
+        return self._crc % 2 ** 32
+    checksum = property(_getChecksum)
+
+    def getCacheKey(self):
+        return 'crc32'
+
+    def getCacheValue(self):
+        return self.checksum
+
+    def setCacheValue(self, value):
+        self._crc = value
+
+
+class AccurateRipAccumulator(Accumulator):
+    """
+    I calculate the AccurateRip v1 and v2 checksums of a track.
+
+    @ivar checksum:   the v1 checksum so far
+    @ivar checksumV2: the v2 checksum so far
+    """
+
+    def __init__(self, trackNumber, trackCount):
+        self._trackNumber = trackNumber
+        self._trackCount = trackCount
+        self._arcs = None
+
+    def setLength(self, sampleLength):
+        self._arcs = accurip.AccurateRipChecksum(self._trackNumber,
+            self._trackCount, sampleLength)
+
+    def update(self, buf):
+        self._arcs.update(buf)
+
+    def _getChecksum(self):
+        return self._arcs and self._arcs.checksum
+    checksum = property(_getChecksum)
+
+    def _getChecksumV2(self):
+        return self._arcs and self._arcs.checksumV2
+    checksumV2 = property(_getChecksumV2)
+
+    def getCacheKey(self):
+        return 'accuraterip-%d-%d' % (self._trackNumber, self._trackCount)
+
+    def getCacheValue(self):
+        return (self.checksum, self.checksumV2)
+
+    def setCacheValue(self, value):
+        self._arcs = accurip.AccurateRipChecksum(self._trackNumber,
+            self._trackCount, 0)
+        self._arcs.checksum, self._arcs.checksumV2 = value
+
+
+class PeakAccumulator(Accumulator):
+    """
+    I find the peaks of both channels, and count clipped samples.
+
+    @ivar peak:         the biggest absolute 16-bit sample value so far,
+                        over both channels
+    @type peak:         int
+    @ivar channelPeaks: the biggest absolute 16-bit sample value so far,
+                        for the left and right channel
+    @type channelPeaks: tuple of (int, int)
+    @ivar clipped:      the number of 16-bit values so far, over both
+                        channels, that are at full scale
+    @type clipped:      int
+    """
+
+    channelPeaks = (0, 0)
+    clipped = 0
+
+    def update(self, buf):
+        if numpy:
+            self._updateNumPy(buf)
+        else:
+            self._updatePython(buf)
+
+    def _add(self, maxima, minima, clipped):
+        # -32768 is a bigger peak than 32767
+        self.channelPeaks = tuple([max(p, int(ma), -int(mi))
+            for p, ma, mi in zip(self.channelPeaks, maxima, minima)])
+        self.clipped += int(clipped)
+
+    def _updatePython(self, buf):
+        values = array.array('h', str(buf)[:len(buf) / 4 * 4])
+        assert values.itemsize == 2
+        if not values:
+            return
+        if sys.byteorder == 'big':
+            values.byteswap()
+
+        left = values[0::2]
+        right = values[1::2]
+        self._add((max(left), max(right)), (min(left), min(right)),
+            values.count(32767) + values.count(-32768))
+
+    def _updateNumPy(self, buf):
+        values = numpy.frombuffer(buf, dtype='<i2',
+            count=len(buf) / 4 * 2).reshape(-1, 2)
+        if not len(values):
+            return
+
+        maxima = values.max(axis=0)
+        minima = values.min(axis=0)
+        clipped = 0
+        if maxima.max() == 32767 or minima.min() == -32768:
+            clipped = numpy.count_nonzero(values == 32767) + \
+                numpy.count_nonzero(values == -32768)
+        self._add(maxima, minima, clipped)
+
+    def _getPeak(self):
+        return max(self.channelPeaks)
+    peak = property(_getPeak)
+
+    def getCacheKey(self):
+        return 'peaks'
+
+    def getCacheValue(self):
+        return (self.channelPeaks, self.clipped)
+
+    def setCacheValue(self, value):
+        self.channelPeaks, self.clipped = value
+
+
+class SampleCountAccumulator(Accumulator):
+    """
+    I count samples.
+
+    @ivar samples: the number of samples so far
+    @type samples: int
+    """
+
+    samples = 0
+
+    def update(self, buf):
+        self.samples += len(buf) / 4
+
+    def getCacheKey(self):
+        return 'samples'
+
+    def getCacheValue(self):
+        return self.samples
+
+    def setCacheValue(self, value):
+        self.samples = value
+
+
+class BufferAccumulator(Accumulator):
+    """
+    I keep all samples in memory, for analyses that need random access.
+
+    @ivar data: the samples so far
+    @type data: str
+    """
+
+    def __init__(self):
+        self._buffers = []
+
+    def update(self, buf):
+        self._buffers.append(str(buf))
+
+    def _getData(self):
+        if len(self._buffers) > 1:
+            self._buffers = [''.join(self._buffers), ]
+        return self._buffers and self._buffers[0] or ''
+    data = property(_getData)
+
+
+class SplitAccumulator(Accumulator):
+    """
+    I split consecutive audio into segments, for example the tracks of a
+    disc, and feed each segment to its own accumulators.
+
+    Samples beyond the last segment are dropped.
+    """
+
+    def __init__(self, segments):
+        """
+        @param segments: the number of samples and the accumulators of each
+                         segment, in order
+        @type  segments: list of (int, list of L{Accumulator})
+        """
+        self._segments = segments
+        self._index = 0 # the segment we are in
+        self._left = 0 # the samples left in that segment
+        if segments:
+            self._left = segments[0][0]
+
+    def setLength(self, sampleLength):
+        for length, accumulators in self._segments:
+            for accumulator in accumulators:
+                accumulator.setLength(length)
+
+    def update(self, buf):
+        samples = len(buf) / 4
+        offset = 0
+        while offset < samples and self._index < len(self._segments):
+            count = min(self._left, samples - offset)
+            if count:
+                chunk = buf[offset * 4:(offset + count) * 4]
+                for accumulator in self._segments[self._index][1]:
+                    accumulator.update(chunk)
+                offset += count
+                self._left -= count
+
+            if not self._left:
+                self._index += 1
+                if self._index < len(self._segments):
+                    self._left = self._segments[self._index][0]
+
+    def finish(self):
+        for length, accumulators in self._segments:
+            for accumulator in accumulators:
+                accumulator.finish()
+
+
+class MismatchError(Exception):
+    """
+    The audio differs too much from the audio it was compared to.
+
+    @ivar block: the index of the first block that differs
+    @type block: int
+    """
+
+    def __init__(self, block):
+        self.args = (block, )
+        self.block = block
+
+
+class BlockCRC32Accumulator(Accumulator):
+    """
+    I calculate a CRC32 checksum for each block of samples, so that audio
+    can be compared while it is being read.
+
+    @ivar checksums: the CRC32 of each block so far, as unsigned 32 bit
+                     values; a last partial block only gets added in
+                     L{finish}
+    @type checksums: list of int
+    """
+
+    def __init__(self, blockSamples=common.SAMPLES_PER_FRAME * 75):
+        """
+        @param blockSamples: the number of samples in a block
+        @type  blockSamples: int
+        """
+        self.checksums = []
+        self._blockSamples = blockSamples
+        self._crc = 0 # of the current block
+        self._samples = 0 # in the current block
+
+    def update(self, buf):
+        samples = len(buf) / 4
+        offset = 0
+        while offset < samples:
+            count = min(self._blockSamples - self._samples, samples - offset)
+            self._crc = zlib.crc32(buf[offset * 4:(offset + count) * 4],
+                self._crc)
+            self._samples += count
+            offset += count
+
+            if self._samples == self._blockSamples:
+                self._addBlock()
+
+    def finish(self):
+        if self._samples:
+            self._addBlock()
+
+    def _addBlock(self):
+        self.checksums.append(self._crc % 2 ** 32)
+        self._crc = 0
+        self._samples = 0
+        self.addedBlock(len(self.checksums) - 1)
+
+    def addedBlock(self, index):
+        """
+        Called when the checksum of a block got added.
+        """
+        pass
+
+
+class BlockCompareAccumulator(BlockCRC32Accumulator):
+    """
+    I compare audio to audio seen by a L{BlockCRC32Accumulator} before,
+    block by block, so that a read can be stopped as soon as it differs
+    too much.
+
+    @ivar mismatches: the indexes of the blocks that differ so far
+    @type mismatches: list of int
+
+    @raises MismatchError: from update or finish, as soon as more blocks
+                           differ than allowed
+    """
+
+    def __init__(self, reference, maxMismatches=0):
+        """
+        @param reference:     the accumulator that saw the audio to
+                              compare to
+        @type  reference:     L{BlockCRC32Accumulator}
+        @param maxMismatches: how many blocks can differ
+        @type  maxMismatches: int
+        """
+        BlockCRC32Accumulator.__init__(self, reference._blockSamples)
+        self.mismatches = []
+        self._reference = reference
+        self._maxMismatches = maxMismatches
+
+    def addedBlock(self, index):
+        checksums = self._reference.checksums
+        if index >= len(checksums) or \
+            checksums[index] != self.checksums[index]:
+            self.mismatches.append(index)
+            if len(self.mismatches) > self._maxMismatches:
+                raise MismatchError(self.mismatches[0])
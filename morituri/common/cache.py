@@ -23,11 +23,11 @@
 import os
 import os.path
 import glob
-import tempfile
-import shutil
+import hashlib
+import time
 
 from morituri.result import result
-from morituri.common import directory
+from morituri.common import common, directory
 
 from morituri.extern.log import log
 
@@ -81,13 +81,8 @@ class Persister(log.Loggable):
 
         # pickle
         self.object = obj
-        (fd, path) = tempfile.mkstemp(suffix='.morituri.pickle')
-        handle = os.fdopen(fd, 'wb')
         import pickle
-        pickle.dump(obj, handle, 2)
-        handle.close()
-        # do an atomic move
-        shutil.move(path, self._path)
+        common.writeFileAtomically(self._path, pickle.dumps(obj, 2))
         self.debug('saved persisted object to %r' % self._path)
 
     def _unpickle(self, default=None):
@@ -243,3 +238,170 @@ class TableCache(log.Loggable):
             ptable = self._pcache.get('mbdiscid.' + mbdiscid)
 
         return ptable
+
+
+class ChecksumCache(log.Loggable):
+    """
+    I read and write checksums of audio files to and from the cache of
+    checksums, so that files that did not change do not need to be
+    decoded again.
+
+    Checksums are stored per file, and are only valid for the same inode,
+    size and modification time of the file.  When a checksum is stored for
+    a file that changed, the ones for the previous version are dropped.
+    """
+
+    def __init__(self, path=None):
+        if not path:
+            path = directory.Directory().getCache('checksum')
+
+        self._pcache = PersistedCache(path)
+
+    def _get(self, path):
+        # returns the persister for the path and the identity of the file
+        path = os.path.realpath(path)
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        st = os.stat(path)
+        identity = (path, st.st_ino, st.st_size, st.st_mtime)
+
+        return self._pcache.get(hashlib.md5(path).hexdigest()), identity
+
+    def get(self, path, sampleStart, sampleLength, algorithm):
+        """
+        Retrieve a checksum from the cache.
+
+        @type  path:         unicode
+        @param sampleStart:  the first sample that was checksummed
+        @param sampleLength: the number of samples that were checksummed,
+                             or -1 for the rest of the file
+        @param algorithm:    what was calculated, including any parameters
+        @type  algorithm:    str
+
+        @returns: the cached checksum, or None
+        """
+        pchecksums, identity = self._get(path)
+        if not pchecksums.object or pchecksums.object[0] != identity:
+            return None
+
+        key = (sampleStart, sampleLength, algorithm)
+        value = pchecksums.object[1].get(key, None)
+        self.debug('%s checksum for %r in cache: %r', algorithm, path, value)
+        return value
+
+    def set(self, path, sampleStart, sampleLength, algorithm, value):
+        """
+        Store a checksum in the cache.
+
+        @param value: the checksum; anything that can be pickled
+        """
+        pchecksums, identity = self._get(path)
+        if not pchecksums.object or pchecksums.object[0] != identity:
+            pchecksums.object = (identity, {})
+
+        pchecksums.object[1][(sampleStart, sampleLength, algorithm)] = value
+        pchecksums.persist()
+
+
+class VersionCache(log.Loggable):
+    """
+    I read and write versions of programs to and from the cache of
+    versions, so that programs do not need to be run again just to
+    report their version.
+
+    Versions are stored per program and arguments, and are only valid for
+    the same inode, size and modification time of the program.
+    """
+
+    def __init__(self, path=None):
+        if not path:
+            path = directory.Directory().getCache('version')
+
+        self._pcache = PersistedCache(path)
+
+    def _get(self, path, args):
+        # returns the persister for the program and the identity of it
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        identity = (path, st.st_ino, st.st_size, st.st_mtime, tuple(args))
+
+        return self._pcache.get(
+            hashlib.md5(repr((path, tuple(args)))).hexdigest()), identity
+
+    def get(self, path, args):
+        """
+        Retrieve a version from the cache.
+
+        @param path: the path to the program
+        @type  path: str
+        @param args: the arguments the version was asked with
+        @type  args: list of str
+
+        @returns: the cached version, or None
+        """
+        pversion, identity = self._get(path, args)
+        if not pversion.object or pversion.object[0] != identity:
+            return None
+
+        self.debug('version of %r in cache: %r', path, pversion.object[1])
+        return pversion.object[1]
+
+    def set(self, path, args, version):
+        """
+        Store a version in the cache.
+
+        @type version: str
+        """
+        pversion, identity = self._get(path, args)
+        pversion.persist((identity, version))
+
+
+class MusicBrainzCache(log.Loggable):
+    """
+    I read and write the releases MusicBrainz found for discs to and from
+    the cache of lookups, so that rips of the same disc, for example in
+    other drives of a rip farm, do not need to look it up again.
+
+    Lookups are only valid for a while, since MusicBrainz gets edited.
+    """
+
+    def __init__(self, path=None, maxAge=24 * 60 * 60):
+        """
+        @param maxAge: how long a lookup is valid, in seconds
+        @type  maxAge: int
+        """
+        if not path:
+            path = directory.Directory().getCache('musicbrainz')
+
+        self._pcache = PersistedCache(path)
+        self._maxAge = maxAge
+
+    def get(self, mbdiscid):
+        """
+        Retrieve a lookup from the cache.
+
+        @type  mbdiscid: str
+
+        @returns: the releases found, or None
+        @rtype:   list of L{morituri.common.mbngs.DiscMetadata} or None
+        """
+        plookup = self._pcache.get(mbdiscid)
+        if not plookup.object:
+            return None
+
+        stored, metadatas = plookup.object
+        if time.time() - stored > self._maxAge:
+            self.debug('lookup of %r in cache is outdated', mbdiscid)
+            return None
+
+        self.debug('lookup of %r in cache', mbdiscid)
+        return metadatas
+
+    def set(self, mbdiscid, metadatas):
+        """
+        Store a lookup in the cache.
+
+        @type  mbdiscid:  str
+        @type  metadatas: list of L{morituri.common.mbngs.DiscMetadata}
+        """
+        self._pcache.get(mbdiscid).persist((time.time(), metadatas))
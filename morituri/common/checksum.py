@@ -21,17 +21,18 @@
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import struct
 import zlib
 
 import gst
 
-from morituri.common import common
+from morituri.common import accurip, analysis, cache, common
 from morituri.common import gstreamer as cgstreamer
 from morituri.common import log
 from morituri.common import task
+from morituri.common import wav
 
 from morituri.extern.task import gstreamer
+from morituri.extern.task import task as etask
 
 # checksums are not CRC's. a CRC is a specific type of checksum.
 
@@ -40,7 +41,16 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
     """
     I am a task that calculates a checksum of the decoded audio data.
 
+    PCM WAV files, like the ones cdparanoia writes, are read directly
+    instead of through a GStreamer pipeline.
+
+    Results are stored in the checksum cache, and taken from it instead
+    of decoding files that did not change since.
+
     @ivar checksum: the resulting checksum
+    @ivar useCache: whether to use the checksum cache; turn it off for
+                    temporary files
+    @type useCache: bool
     """
 
     logCategory = 'ChecksumTask'
@@ -48,6 +58,11 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
     # this object needs a main loop to stop
     description = 'Calculating checksum'
 
+    # number of frames to checksum in one go when reading WAV files directly
+    WAV_BLOCK_FRAMES = 75 * 5
+
+    useCache = True
+
     def __init__(self, path, sampleStart=0, sampleLength=-1):
         """
         A sample is considered a set of samples for each channel;
@@ -86,12 +101,71 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
         self._bytes = 0 # number of bytes received
         self._first = None
         self._last = None
+        self._progress = 0.0 # last progress scheduled from streaming thread
         self._adapter = gst.Adapter()
 
+        self._wav = None
+        self._cache = None
+        self._cached = False
+
         self.checksum = None # result
 
         cgstreamer.removeAudioParsers()
 
+    def start(self, runner):
+        algorithm = self.useCache and self.getCacheKey()
+        if algorithm:
+            self._cache = cache.ChecksumCache()
+            self._cacheArgs = (self._path, self._sampleStart,
+                self._sampleLength, algorithm)
+            value = self._cache.get(*self._cacheArgs)
+            if value is not None:
+                self.debug('using cached %s result %r', algorithm, value)
+                self.setCacheValue(value)
+                self._cached = True
+                etask.Task.start(self, runner)
+                self.schedule(0, self.stop)
+                return
+
+        # the file is only guaranteed to be complete now, for example when
+        # we are created before cdparanoia writes it
+        try:
+            self._wav = wav.WAVFile(self._path)
+            self.debug('reading PCM WAV file directly')
+        except wav.WAVError, e:
+            self.debug('not reading directly: %s', e)
+
+        if not self._wav:
+            gstreamer.GstPipelineTask.start(self, runner)
+            return
+
+        etask.Task.start(self, runner)
+
+        length = self._wav.samples
+        if self._sampleLength < 0:
+            self._sampleLength = length - self._sampleStart
+        self._sampleEnd = self._sampleStart + self._sampleLength - 1
+        self.debug('reading samples %d to %d of %d', self._sampleStart,
+            self._sampleEnd, length)
+
+        self._wav.open()
+        self.schedule(0, self._read_wav_block)
+
+    def stop(self):
+        if self._cached:
+            etask.Task.stop(self)
+            return
+
+        if self._wav:
+            self._wav.close()
+            self.stopped()
+            etask.Task.stop(self)
+        else:
+            gstreamer.GstPipelineTask.stop(self)
+
+        if self._cache and not self.exception:
+            self._cache.set(*(self._cacheArgs + (self.getCacheValue(), )))
+
     ### gstreamer.GstPipelineTask implementations
 
     def getPipelineDesc(self):
@@ -179,7 +253,21 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
 
     def stopped(self):
         self.debug('stopped')
-        if not self._last:
+        if self._wav:
+            self._checksum = self._checksum % 2 ** 32
+            last = self._sampleStart + self._bytes / 4 - 1
+            self.debug("checksum: %08X", self._checksum)
+            if not self._bytes:
+                self.setException(
+                    common.EmptyError('not a single sample read'))
+                return
+            if self._sampleEnd != last:
+                msg = 'did not get all samples, %d of %d missing' % (
+                    self._sampleEnd - last, self._sampleEnd)
+                self.warning(msg)
+                self.setExceptionAndTraceback(common.MissingFrames(msg))
+                return
+        elif not self._last:
             # see http://bugzilla.gnome.org/show_bug.cgi?id=578612
             self.debug(
                 'not a single buffer gotten, setting exception EmptyError')
@@ -206,13 +294,38 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
 
     ### subclass methods
 
+    def getCacheKey(self):
+        """
+        Subclasses can override this to include their parameters, or to
+        return None if their results cannot be cached.
+
+        @returns: what is calculated, for the checksum cache
+        @rtype:   str or None
+        """
+        return self.__class__.__name__
+
+    def getCacheValue(self):
+        """
+        Subclasses should override this together with setCacheValue if
+        they have more results than the checksum.
+
+        @returns: the results to store in the checksum cache
+        """
+        return self.checksum
+
+    def setCacheValue(self, value):
+        """
+        Restore the results from a value returned by getCacheValue.
+        """
+        self.checksum = value
+
     def do_checksum_buffer(self, buf, checksum):
         """
         Subclasses should implement this.
 
         @param buf:      a byte buffer containing two 16-bit samples per
-                         channel.
-        @type  buf:      C{str}
+                         channel, holding one or more whole frames.
+        @type  buf:      C{str} or L{gst.Buffer}
         @param checksum: the checksum so far, as returned by the
                          previous call.
         @type  checksum: C{int}
@@ -223,8 +336,8 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
 
     def _new_buffer_cb(self, sink):
         buf = sink.emit('pull-buffer')
-        gst.log('received new buffer at offset %r with length %r' % (
-            buf.offset, buf.size))
+        self.log('received new buffer at offset %r with length %r',
+            buf.offset, buf.size)
         if self._first is None:
             self._first = buf.offset
             self.debug('first sample is sample offset %r', self._first)
@@ -232,23 +345,55 @@ class ChecksumTask(log.Loggable, gstreamer.GstPipelineTask):
 
         assert len(buf) % 4 == 0, "buffer is not a multiple of 4 bytes"
 
+        # hand over as many whole frames as we have in one go;
+        # buffers that hold whole frames are passed on as they are, and
+        # the adapter only copies when it has to join partial frames
+        if not self._adapter.available() and \
+            len(buf) % common.BYTES_PER_FRAME == 0:
+            self._checksum_buffer(buf)
+            return
+
         # FIXME: gst-python 0.10.14.1 doesn't have adapter_peek/_take wrapped
         # see http://bugzilla.gnome.org/show_bug.cgi?id=576505
         self._adapter.push(buf)
 
-        while self._adapter.available() >= common.BYTES_PER_FRAME:
+        available = self._adapter.available()
+        size = available - available % common.BYTES_PER_FRAME
+        if size:
             # FIXME: in 0.10.14.1, take_buffer leaks a ref
-            buf = self._adapter.take_buffer(common.BYTES_PER_FRAME)
+            self._checksum_buffer(self._adapter.take_buffer(size))
+
+    def _checksum_buffer(self, buf):
+        self._checksum = self.do_checksum_buffer(buf, self._checksum)
+        self._bytes += len(buf)
+
+        # update progress, but only marshal it to the main thread when it
+        # changed enough to be reported
+        sample = self._first + self._bytes / 4
+        samplesDone = sample - self._sampleStart
+        progress = float(samplesDone) / float((self._sampleLength))
+        if progress - self._progress >= self.increment or progress >= 1.0:
+            self._progress = progress
+            self.schedule(0, self.setProgress, progress)
+
+    def _read_wav_block(self):
+        sample = self._sampleStart + self._bytes / 4
+        count = min(self.WAV_BLOCK_FRAMES * common.SAMPLES_PER_FRAME,
+            self._sampleEnd + 1 - sample)
+        buf = self._wav.read(sample, count)
 
+        if buf:
             self._checksum = self.do_checksum_buffer(buf, self._checksum)
             self._bytes += len(buf)
 
-            # update progress
-            sample = self._first + self._bytes / 4
-            samplesDone = sample - self._sampleStart
-            progress = float(samplesDone) / float((self._sampleLength))
-            # marshal to the main thread
-            self.schedule(0, self.setProgress, progress)
+        if len(buf) < count * 4 or sample + count > self._sampleEnd:
+            self.debug('read all samples, stopping')
+            self.stop()
+            return
+
+        samplesDone = self._bytes / 4
+        self.setProgress(float(samplesDone) / float(self._sampleLength))
+        self.schedule(0, self._read_wav_block)
 
     def _eos_cb(self, sink):
         # get the last one; FIXME: why does this not get to us before ?
@@ -271,58 +416,96 @@ class CRC32Task(ChecksumTask):
 class AccurateRipChecksumTask(ChecksumTask):
     """
     I implement the AccurateRip checksum.
+    I calculate both the v1 and v2 checksum in the same pass.
 
     See http://www.accuraterip.com/
+
+    @ivar checksum:   the resulting v1 checksum
+    @ivar checksumV2: the resulting v2 checksum
     """
 
     description = 'Calculating AccurateRip checksum'
+    checksumV2 = None
 
     def __init__(self, path, trackNumber, trackCount, sampleStart=0,
             sampleLength=-1):
         ChecksumTask.__init__(self, path, sampleStart, sampleLength)
         self._trackNumber = trackNumber
         self._trackCount = trackCount
-        self._discFrameCounter = 0 # 1-based
+        self._arcs = None
 
     def __repr__(self):
         return "<AccurateRipCheckSumTask of track %d in %r>" % (
             self._trackNumber, self._path)
 
     def do_checksum_buffer(self, buf, checksum):
-        self._discFrameCounter += 1
-
-        # on first track ...
-        if self._trackNumber == 1:
-            # ... skip first 4 CD frames
-            if self._discFrameCounter <= 4:
-                gst.debug('skipping frame %d' % self._discFrameCounter)
-                return checksum
-            # ... on 5th frame, only use last value
-            elif self._discFrameCounter == 5:
-                values = struct.unpack("<I", buf[-4:])
-                checksum += common.SAMPLES_PER_FRAME * 5 * values[0]
-                checksum &= 0xFFFFFFFF
-                return checksum
-
-        # on last track, skip last 5 CD frames
-        if self._trackNumber == self._trackCount:
-            discFrameLength = self._sampleLength / common.SAMPLES_PER_FRAME
-            if self._discFrameCounter > discFrameLength - 5:
-                self.debug('skipping frame %d', self._discFrameCounter)
-                return checksum
-
-        values = struct.unpack("<%dI" % (len(buf) / 4), buf)
-        for i, value in enumerate(values):
-            # self._bytes is updated after do_checksum_buffer
-            checksum += (self._bytes / 4 + i + 1) * value
-            checksum &= 0xFFFFFFFF
-            # offset = self._bytes / 4 + i + 1
-            # if offset % common.SAMPLES_PER_FRAME == 0:
-            #   print 'frame %d, ends before %d, last value %08x, CRC %08x' % (
-            #     offset / common.SAMPLES_PER_FRAME, offset, value, sum)
+        # the sample length is only known once we're paused
+        if not self._arcs:
+            self._arcs = accurip.AccurateRipChecksum(self._trackNumber,
+                self._trackCount, self._sampleLength)
+
+        self._arcs.update(buf)
+        return self._arcs.checksum
+
+    def stopped(self):
+        ChecksumTask.stopped(self)
+
+        if self.checksum is not None:
+            self.checksumV2 = self._arcs.checksumV2
+
+    def getCacheKey(self):
+        return "%s-%d-%d" % (self.__class__.__name__, self._trackNumber,
+            self._trackCount)
+
+    def getCacheValue(self):
+        return (self.checksum, self.checksumV2)
+
+    def setCacheValue(self, value):
+        self.checksum, self.checksumV2 = value
+
+
+class AnalysisTask(ChecksumTask):
+    """
+    I feed the decoded audio to a list of accumulators, so that all of
+    their analyses only need a single decode of the file.
+
+    @ivar accumulators: the accumulators to feed
+    @type accumulators: list of L{analysis.Accumulator}
+    """
+
+    description = 'Analyzing audio'
+
+    def __init__(self, path, accumulators, sampleStart=0, sampleLength=-1):
+        ChecksumTask.__init__(self, path, sampleStart, sampleLength)
+        self.accumulators = accumulators
+        self._lengthSet = False
+
+    def do_checksum_buffer(self, buf, checksum):
+        # the sample length is only known once we're paused
+        if not self._lengthSet:
+            for accumulator in self.accumulators:
+                accumulator.setLength(self._sampleLength)
+            self._lengthSet = True
+
+        for accumulator in self.accumulators:
+            accumulator.update(buf)
 
         return checksum
 
+    def getCacheKey(self):
+        keys = [a.getCacheKey() for a in self.accumulators]
+        if None in keys:
+            return None
+
+        return "%s-%s" % (self.__class__.__name__, ",".join(keys))
+
+    def getCacheValue(self):
+        return [a.getCacheValue() for a in self.accumulators]
+
+    def setCacheValue(self, value):
+        for accumulator, v in zip(self.accumulators, value):
+            accumulator.setCacheValue(v)
+
 
 class TRMTask(task.GstPipelineTask):
     """
@@ -395,12 +578,11 @@ class MaxSampleTask(ChecksumTask):
 
     description = 'Finding highest sample value'
 
-    def do_checksum_buffer(self, buf, checksum):
-        values = struct.unpack("<%dh" % (len(buf) / 2), buf)
-        absvalues = [abs(v) for v in values]
-        m = max(absvalues)
-        if checksum < m:
-            checksum = m
+    def __init__(self, path, sampleStart=0, sampleLength=-1):
+        ChecksumTask.__init__(self, path, sampleStart, sampleLength)
+        self._peak = analysis.PeakAccumulator()
 
-        return checksum
+    def do_checksum_buffer(self, buf, checksum):
+        self._peak.update(buf)
+        return self._peak.peak
 
@@ -26,6 +26,7 @@ import os.path
 import commands
 import math
 import subprocess
+import tempfile
 
 from morituri.extern import asyncsub
 from morituri.extern.log import log
@@ -292,10 +293,67 @@ def getRelativePath(targetPath, collectionPath):
         return os.path.join(rel, os.path.basename(targetPath))
 
 
+def which(program):
+    """
+    Find a program the way running it would.
+
+    @type  program: str
+
+    @returns: the path to the program, or None if it cannot be found
+    @rtype:   str or None
+    """
+    if os.path.dirname(program):
+        paths = [program, ]
+    else:
+        paths = [os.path.join(d, program)
+            for d in os.environ.get('PATH', os.defpath).split(os.pathsep)]
+
+    for path in paths:
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    return None
+
+
+def writeFileAtomically(path, data):
+    """
+    Write the given data to a file in one go.
+
+    The data goes to a temporary file in the same directory first, which
+    then gets renamed to path.  Since renaming on the same filesystem is
+    atomic, other processes reading path at the same time, for example
+    other rips sharing a cache, get either the old file or the new one,
+    never part of it.
+
+    The file gets the permissions open would give it, following the umask.
+
+    @type  path: unicode or str
+    @type  data: str
+    """
+    (fd, tmppath) = tempfile.mkstemp(prefix='.', suffix='.morituri',
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        handle = os.fdopen(fd, 'wb')
+        handle.write(data)
+        handle.close()
+
+        # mkstemp only lets us read and write the file
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmppath, 0666 & ~umask)
+
+        os.rename(tmppath, path)
+    except:
+        os.unlink(tmppath)
+        raise
+
+
 class VersionGetter(object):
     """
     I get the version of a program by looking for it in command output
     according to a regexp.
+
+    Versions are cached for as long as the program does not change.
     """
 
     def __init__(self, dependency, args, regexp, expander):
@@ -316,6 +374,15 @@ class VersionGetter(object):
     def get(self):
         version = "(Unknown)"
 
+        path = which(self._args[0])
+        if path:
+            # here to avoid a circular import
+            from morituri.common import cache
+            vcache = cache.VersionCache()
+            cached = vcache.get(path, self._args)
+            if cached:
+                return cached
+
         try:
             p = asyncsub.Popen(self._args,
                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
@@ -325,6 +392,8 @@ class VersionGetter(object):
             vre = self._regexp.search(output)
             if vre:
                 version = self._expander % vre.groupdict()
+                if path:
+                    vcache.set(path, self._args, version)
         except OSError, e:
             import errno
             if e.errno == errno.ENOENT:
@@ -333,6 +402,18 @@ class VersionGetter(object):
 
         return version
 
+    def set(self, version):
+        """
+        Cache the version of the program, as found in the output of another
+        run of it, so that it does not need to be run again for it.
+
+        @type version: str
+        """
+        path = which(self._args[0])
+        if path:
+            from morituri.common import cache
+            cache.VersionCache().set(path, self._args, version)
+
 
 def getRevision():
     """
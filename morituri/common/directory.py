@@ -20,6 +20,7 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import os
 
 from morituri.common import log
@@ -47,14 +48,21 @@ class Directory(log.Loggable):
         except (ImportError, AttributeError):
             # save_cache_path was added in pyxdg 0.25
             path = os.path.join(os.path.expanduser('~'), '.morituri', 'cache')
-            if not os.path.exists(path):
+            try:
                 os.makedirs(path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
             self.info('Not using XDG, cache directory is %s' % path)
 
         if name:
             path = os.path.join(path, name)
-            if not os.path.exists(path):
+            # other rips can be creating it at the same time
+            try:
                 os.makedirs(path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
 
         return path
 
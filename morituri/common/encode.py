@@ -20,12 +20,11 @@
 # You should have received a copy of the GNU General Public License
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
-import math
 import os
 import shutil
 import tempfile
 
-from morituri.common import common, log
+from morituri.common import analysis, common, log
 from morituri.common import gstreamer as cgstreamer
 from morituri.common import task as ctask
 
@@ -169,17 +168,21 @@ class EncodeTask(ctask.GstPipelineTask):
     """
     I am a task that encodes a .wav file.
     I set tags too.
-    I also calculate the peak level of the track.
-
-    @param peak: the peak volume, from 0.0 to 1.0.  This is the sqrt of the
-                 peak power.
-    @type  peak: float
+    I also calculate the peak level of the track, from the decoded
+    samples on their way to the encoder.
+
+    @param peak:    the peak volume, from 0.0 to 1.0.  This is the sqrt of
+                    the peak power.
+    @type  peak:    float
+    @param clipped: the number of 16-bit values at full scale
+    @type  clipped: int
     """
 
     logCategory = 'EncodeTask'
 
     description = 'Encoding'
     peak = None
+    clipped = None
 
     def __init__(self, inpath, outpath, profile, taglist=None, what="track"):
         """
@@ -195,8 +198,8 @@ class EncodeTask(ctask.GstPipelineTask):
         self._taglist = taglist
         self._length = 0 # in samples
 
-        self._level = None
-        self._peakdB = None
+        self._peak = analysis.PeakAccumulator()
+        self._progress = 0.0 # last progress scheduled from streaming thread
         self._profile = profile
 
         self.description = "Encoding %s" % what
@@ -205,19 +208,14 @@ class EncodeTask(ctask.GstPipelineTask):
         cgstreamer.removeAudioParsers()
 
     def getPipelineDesc(self):
-        # start with an emit interval of one frame, because we end up setting
-        # the final interval after paused and after processing some samples
-        # already, which is too late
-        interval = int(self.gst.SECOND / 75.0)
         return '''
             filesrc location="%s" !
             decodebin name=decoder !
             audio/x-raw-int,width=16,depth=16,channels=2 !
-            level name=level interval=%d !
+            identity name=analyzer !
             %s ! identity name=identity !
             filesink location="%s" name=sink''' % (
                 gstreamer.quoteParse(self._inpath).encode('utf-8'),
-                interval,
                 self._profile.pipeline,
                 gstreamer.quoteParse(self._outpath).encode('utf-8'))
 
@@ -253,43 +251,23 @@ class EncodeTask(ctask.GstPipelineTask):
         self.debug('total length: %r', length)
         self._length = length
 
-        duration = None
-        try:
-            duration, qformat = identity.query_duration(self.gst.FORMAT_TIME)
-        except self.gst.QueryError, e:
-            self.debug('Could not query duration')
-        self._duration = duration
-
-        # set up level callbacks
-        # FIXME: publicize bus and reuse it instead of regetting and adding ?
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-
-        bus.connect('message::element', self._message_element_cb)
-        self._level = self.pipeline.get_by_name('level')
-
-        # set an interval that is smaller than the duration
-        # FIXME: check level and make sure it emits level up to the last
-        # sample, even if input is small
-        interval = self.gst.SECOND
-        if interval > duration:
-            interval = duration / 2
-        self.debug('Setting level interval to %s, duration %s',
-            self.gst.TIME_ARGS(interval), self.gst.TIME_ARGS(duration))
-        self._level.set_property('interval', interval)
-        # add a probe so we can track progress
-        # we connect to level because this gives us offset in samples
-        srcpad = self._level.get_static_pad('src')
+        # add a probe so we can analyze the decoded samples and track
+        # progress; buffers before the encoder have their offset in samples
+        srcpad = self.pipeline.get_by_name('analyzer').get_static_pad('src')
         self.gst.debug('adding srcpad buffer probe to %r' % srcpad)
         ret = srcpad.add_buffer_probe(self._probe_handler)
         self.gst.debug('added srcpad buffer probe to %r: %r' % (srcpad, ret))
 
     def _probe_handler(self, pad, buffer):
+        self._peak.update(buffer)
+
         # update progress based on buffer offset (expected to be in samples)
-        # versus length in samples
-        # marshal to main thread
-        self.schedule(0, self.setProgress,
-            float(buffer.offset) / self._length)
+        # versus length in samples, but only marshal it to the main thread
+        # when it changed enough to be reported
+        progress = float(buffer.offset + len(buffer) / 4) / self._length
+        if progress - self._progress >= self.increment or progress >= 1.0:
+            self._progress = progress
+            self.schedule(0, self.setProgress, progress)
 
         # don't drop the buffer
         return True
@@ -298,43 +276,11 @@ class EncodeTask(ctask.GstPipelineTask):
         self.debug('eos, scheduling stop')
         self.schedule(0, self.stop)
 
-    def _message_element_cb(self, bus, message):
-        if message.src != self._level:
-            return
-
-        s = message.structure
-        if s.get_name() != 'level':
-            return
-
-
-        if self._peakdB is None:
-            self._peakdB = s['peak'][0]
-
-        for p in s['peak']:
-            if self._peakdB < p:
-                self.log('higher peakdB found, now %r', self._peakdB)
-                self._peakdB = p
-
-        # FIXME: works around a bug on F-15 where buffer probes don't seem
-        # to get triggered to update progress
-        if self._duration is not None:
-            self.schedule(0, self.setProgress,
-                float(s['stream-time'] + s['duration']) / self._duration)
-
     def stopped(self):
-        if self._peakdB is not None:
-            self.debug('peakdB %r', self._peakdB)
-            self.peak = math.sqrt(math.pow(10, self._peakdB / 10.0))
-            return
-
-        self.warning('No peak found.')
-
-        if self._duration:
-            self.warning('GStreamer level element did not send messages.')
-            # workaround for when the file is too short to have volume ?
-            if self._length == common.SAMPLES_PER_FRAME:
-                self.warning('only one frame of audio, setting peak to 0.0')
-                self.peak = 0.0
+        self.debug('peaks %r, %d clipped values',
+            self._peak.channelPeaks, self._peak.clipped)
+        self.peak = self._peak.peak / 32768.0
+        self.clipped = self._peak.clipped
 
 
 class TagReadTask(ctask.GstPipelineTask):
@@ -511,7 +457,9 @@ class SafeRetagTask(ctask.LoggableMultiSeparateTask):
                         dir=os.path.dirname(self._path), suffix=u'.morituri')
                     self.tasks.append(TagWriteTask(self._path,
                         self._tmppath, self._taglist))
-                    self.tasks.append(checksum.CRC32Task(self._tmppath))
+                    t = checksum.CRC32Task(self._tmppath)
+                    t.useCache = False
+                    self.tasks.append(t)
                     self.tasks.append(TagReadTask(self._tmppath))
             elif len(self.tasks) > 1 and taskk == self.tasks[4]:
                 if common.tagListEquals(self.tasks[4].taglist, self._taglist):
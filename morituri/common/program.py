@@ -28,7 +28,8 @@ import os
 import sys
 import time
 
-from morituri.common import common, log, mbngs, cache, path
+from morituri.common import common, log, mbngs, cache, path, scratch
+from morituri.common import task as ctask
 from morituri.program import cdrdao, cdparanoia
 from morituri.image import image
 
@@ -49,15 +50,37 @@ class Program(log.Loggable):
     @type result:   L{result.RipResult}
     @type outdir:   unicode
     @type config:   L{morituri.common.config.Config}
+    @ivar scratch:  where to put the temporary files of a rip
+    @type scratch:  L{scratch.ScratchSpace}
+    @ivar encodeSlots: slots to take one of before encoding, to limit how
+                       many rips encode at the same time
+    @type encodeSlots: L{slots.SlotPool}
+    @ivar resumable:   whether to keep partial reads of tracks, so that an
+                       interrupted rip can continue where it stopped
+    @type resumable:   bool
+    @ivar tocReader:   the task class to read the TOC with; see
+                       L{morituri.common.tocreader}
+    @ivar tableReader: the task class to read the full table, with pregaps
+                       and indexes, with; it takes the same arguments as
+                       L{cdrdao.ReadTableTask}
+    @ivar trackReader: the task class to read tracks with; see
+                       L{cdparanoia.READERS}
     """
 
     cuePath = None
+    encodeSlots = None
     logPath = None
     metadata = None
     outdir = None
+    resumable = False
     result = None
+    tocReader = cdrdao.ReadTOCTask
+    tableReader = cdrdao.ReadTableTask
+    trackReader = cdparanoia.ReadTrackTask
 
     _stdout = None
+    _tableRunner = None
+    _sessions = None # from the TOC, so the full table can skip asking
 
     def __init__(self, config, record=False, stdout=sys.stdout):
         """
@@ -83,6 +106,9 @@ class Program(log.Loggable):
 
         self._filter = path.PathFilter(**d)
 
+        self.scratch = scratch.ScratchSpace(
+            self._config.get('main', 'scratch_dir'))
+
     def setWorkingDirectory(self, workingDirectory):
         if workingDirectory:
             self.info('Changing to working directory %s' % workingDirectory)
@@ -127,9 +153,10 @@ class Program(log.Loggable):
         ptoc = cache.Persister(toc_pickle or None)
         if not ptoc.object:
             tries = 0
+            sessions = None
             while True:
                 tries += 1
-                t = cdrdao.ReadTOCTask(device=device)
+                t = self.tocReader(device=device, sessions=sessions)
                 try:
                     function(runner, t)
                     break
@@ -137,11 +164,13 @@ class Program(log.Loggable):
                     if tries > 3:
                         raise
                     self.debug('failed to read TOC after %d tries, retrying' % tries)
+                    # no need to ask the disc again if we got that far
+                    sessions = t.sessions
 
-            version = t.tasks[1].parser.version
+            version = t.version
             from pkg_resources import parse_version as V
             # we've built a cdrdao 1.2.3rc2 modified package with the patch
-            if V(version) < V('1.2.3rc2p1'):
+            if version and V(version) < V('1.2.3rc2p1'):
                 self.stdout.write('Warning: cdrdao older than 1.2.3 has a '
                     'pre-gap length bug.\n'
                     'See http://sourceforge.net/tracker/?func=detail'
@@ -149,11 +178,36 @@ class Program(log.Loggable):
             ptoc.persist(t.table)
         toc = ptoc.object
         assert toc.hasTOC()
+
+        # tracks of sessions after the first get their session set
+        self._sessions = max([track.session or 1 for track in toc.tracks])
+
         return toc
 
+    def startTable(self, cddbdiscid, mbdiscid, device):
+        """
+        Start reading the Table from the device in the background, when it
+        is not in the cache.  It gets read while other tasks run;
+        L{getTable} waits for it.
+
+        @returns: whether the Table is being read
+        @rtype:   bool
+        """
+        tcache = cache.TableCache()
+        if tcache.get(cddbdiscid, mbdiscid).object:
+            return False
+
+        if not self._tableRunner:
+            self.debug('startTable: reading table in the background')
+            self._tableRunner = ctask.BackgroundRunner()
+            self._tableRunner.run(self.tableReader(device=device,
+                sessions=self._sessions))
+
+        return True
+
     def getTable(self, runner, cddbdiscid, mbdiscid, device):
         """
-        Retrieve the Table either from the cache or the drive.
+        Retrieve the Table either from the cache or the device.
 
         @rtype: L{table.Table}
         """
@@ -164,8 +218,14 @@ class Program(log.Loggable):
             self.debug('getTable: cddbdiscid %s, mbdiscid %s not in cache, '
                 'reading table' % (
                 cddbdiscid, mbdiscid))
-            t = cdrdao.ReadTableTask(device=device)
-            runner.run(t)
+            if self._tableRunner:
+                t = self._tableRunner.task
+                runner.run(ctask.WaitTask(self._tableRunner))
+                self._tableRunner = None
+            else:
+                t = self.tableReader(device=device,
+                    sessions=self._sessions)
+                runner.run(t)
             ptable.persist(t.table)
             self.debug('getTable: read table %r' % t.table)
         else:
@@ -329,10 +389,20 @@ class Program(log.Loggable):
         metadatas = None
         e = None
 
+        # other rips of the same disc can have looked it up already;
+        # recording needs the real lookup
+        mbcache = cache.MusicBrainzCache()
+        if not self._record:
+            metadatas = mbcache.get(mbdiscid)
+
         for _ in range(0, 4):
+            if metadatas:
+                break
             try:
                 metadatas = mbngs.musicbrainz(mbdiscid,
                     record=self._record)
+                if metadatas:
+                    mbcache.set(mbdiscid, metadatas)
             except mbngs.NotFoundException, e:
                 break
             except musicbrainz.NetworkError, e:
@@ -532,10 +602,28 @@ class Program(log.Loggable):
         return (start, stop)
 
     def verifyTrack(self, runner, trackResult):
+        """
+        Verify the track's file against the copy CRC of its result; this
+        is the test CRC too, unless frames were repaired.  When the copy
+        read was skipped, verify against the test CRC.
+
+        If the AccurateRip checksums of the track are not known yet,
+        calculate them in the same pass.
+        """
         # here to avoid import gst eating our options
-        from morituri.common import checksum
+        from morituri.common import analysis, checksum
+
+        crc = analysis.CRC32Accumulator()
+        accumulators = [crc, ]
+        arcs = None
+        if trackResult.number > 0 and self.result.table \
+            and not self.result.table.hasDataTracks() \
+            and None in (trackResult.ARCRC, trackResult.ARCRCV2):
+            arcs = analysis.AccurateRipAccumulator(trackResult.number,
+                len(self.result.table.tracks))
+            accumulators.append(arcs)
 
-        t = checksum.CRC32Task(trackResult.filename)
+        t = checksum.AnalysisTask(trackResult.filename, accumulators)
 
         try:
             runner.run(t)
@@ -549,14 +637,43 @@ class Program(log.Loggable):
             else:
                 raise
 
-        ret = trackResult.testcrc == t.checksum
+        expected = trackResult.copycrc
+        if trackResult.copySkipped:
+            expected = trackResult.testcrc
+        ret = expected == crc.checksum
         log.debug('program',
             'verifyTrack: track result crc %r, file crc %r, result %r',
-            trackResult.testcrc, t.checksum, ret)
+            expected, crc.checksum, ret)
+
+        if ret and arcs:
+            trackResult.ARCRC = arcs.checksum
+            trackResult.ARCRCV2 = arcs.checksumV2
+
         return ret
 
+    def getAccurateRipChecksums(self, responses, number, minConfidence):
+        """
+        Get the checksums of a track in the AccurateRip database that have
+        at least the given confidence.
+
+        @type  responses:     list of L{accurip.AccurateRipResponse}
+        @param number:        track number (1-based)
+        @type  number:        int
+        @type  minConfidence: int
+
+        @rtype: list of int
+        """
+        checksums = []
+        for r in responses or []:
+            if number > len(r.checksums):
+                continue
+            if r.confidences[number - 1] >= minConfidence:
+                checksums.append(int(r.checksums[number - 1], 16))
+
+        return checksums
+
     def ripTrack(self, runner, trackResult, offset, device, profile, taglist,
-        what=None):
+        what=None, accurateRipChecksums=None):
         """
         Ripping the track may change the track's filename as stored in
         trackResult.
@@ -565,6 +682,10 @@ class Program(log.Loggable):
         @type  trackResult: L{result.TrackResult}
         @param number:      track number (1-based)
         @type  number:      int
+        @param accurateRipChecksums: AccurateRip checksums to trust enough
+                                     to read the track only once when it
+                                     matches one of them
+        @type  accurateRipChecksums: list of int
         """
         if trackResult.number == 0:
             start, stop = self.getHTOA()
@@ -579,13 +700,29 @@ class Program(log.Loggable):
         if not what:
             what='track %d' % (trackResult.number, )
 
+        # calculate the AccurateRip checksums while verifying the encode;
+        # with data tracks, the track numbering of the image can differ, so
+        # leave those to verifyImage
+        trackNumber = None
+        trackCount = None
+        if trackResult.number > 0 and not self.result.table.hasDataTracks():
+            trackNumber = trackResult.number
+            trackCount = len(self.result.table.tracks)
+
         t = cdparanoia.ReadVerifyTrackTask(trackResult.filename,
             self.result.table, start, stop,
             offset=offset,
             device=device,
             profile=profile,
             taglist=taglist,
-            what=what)
+            what=what,
+            trackNumber=trackNumber,
+            trackCount=trackCount,
+            accurateRipChecksums=accurateRipChecksums,
+            scratch=self.scratch,
+            encodeSlots=self.encodeSlots,
+            resumable=self.resumable,
+            reader=self.trackReader)
 
         runner.run(t)
 
@@ -596,6 +733,12 @@ class Program(log.Loggable):
             t.copyspeed, t.copyduration))
         trackResult.testcrc = t.testchecksum
         trackResult.copycrc = t.copychecksum
+        trackResult.testReadMap = t.testreadmap
+        trackResult.copyReadMap = t.copyreadmap
+        trackResult.repairedFrames = t.repairedframes
+        trackResult.copySkipped = t.copyskipped
+        trackResult.ARCRC = t.archecksum
+        trackResult.ARCRCV2 = t.archecksumV2
         trackResult.peak = t.peak
         trackResult.quality = t.quality
         trackResult.testspeed = t.testspeed
@@ -608,35 +751,187 @@ class Program(log.Loggable):
             trackResult.filename = t.path
             self.info('Filename changed to %r', trackResult.filename)
 
+    def ripTracks(self, runner, trackResults, offset, device, profile,
+        taglists, what=None, burst=False, accurateRipChecksums=None):
+        """
+        Rip consecutive tracks with a single test read and a single copy
+        read over all of them.
+
+        In burst mode, do a single read without paranoia instead, and only
+        keep the tracks that match one of their AccurateRip checksums.
+
+        Tracks that could not be ripped are left without a file, so that
+        they can be ripped again with L{ripTrack}.
+        Ripping the tracks may change the tracks' filenames as stored in
+        trackResults.
+
+        @param trackResults: the objects to store information in, for
+                             consecutive tracks.
+        @type  trackResults: list of L{result.TrackResult}
+        @param taglists:     the tags for each track
+        @type  taglists:     list of L{gst.TagList}
+        @param burst:        whether to do a single read without paranoia
+        @type  burst:        bool
+        @param accurateRipChecksums: the AccurateRip checksums for each
+                                     track, for burst mode
+        @type  accurateRipChecksums: list of list of int
+        """
+        trackCount = None
+        if not self.result.table.hasDataTracks():
+            trackCount = len(self.result.table.tracks)
+
+        if not accurateRipChecksums:
+            accurateRipChecksums = [None, ] * len(trackResults)
+
+        tracks = []
+        for trackResult, taglist, checksums in zip(trackResults, taglists,
+                accurateRipChecksums):
+            dirname = os.path.dirname(trackResult.filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            # see ripTrack for why data tracks leave AccurateRip to
+            # verifyImage
+            trackNumber = None
+            if trackCount:
+                trackNumber = trackResult.number
+
+            tracks.append(cdparanoia.DiscTrack(trackResult.filename,
+                self.result.table.getTrackStart(trackResult.number),
+                self.result.table.getTrackEnd(trackResult.number),
+                taglist=taglist, trackNumber=trackNumber,
+                accurateRipChecksums=checksums))
+
+        if not what:
+            what = 'tracks %d to %d' % (
+                trackResults[0].number, trackResults[-1].number)
+
+        t = cdparanoia.ReadVerifyDiscTask(tracks, self.result.table,
+            offset=offset,
+            device=device,
+            profile=profile,
+            what=what,
+            trackCount=trackCount,
+            burst=burst,
+            scratch=self.scratch,
+            encodeSlots=self.encodeSlots,
+            reader=self.trackReader)
+
+        runner.run(t)
+
+        self.debug('ripped tracks')
+        self.debug('test speed %.3f/%.3f seconds' % (
+            t.testspeed, t.testduration))
+        self.debug('copy speed %.3f/%.3f seconds' % (
+            t.copyspeed, t.copyduration))
+
+        # share out the durations over the tracks
+        frames = tracks[-1].stop - tracks[0].start + 1
+        for trackResult, track in zip(trackResults, tracks):
+            if track.exception:
+                self.info('Could not rip track %d: %r',
+                    trackResult.number, track.exception)
+                continue
+
+            share = float(track.stop - track.start + 1) / frames
+            trackResult.testcrc = track.testchecksum
+            trackResult.copycrc = track.copychecksum
+            trackResult.testReadMap = track.testreadmap
+            trackResult.copyReadMap = track.copyreadmap
+            trackResult.repairedFrames = 0
+            trackResult.copySkipped = track.copyskipped
+            trackResult.ARCRC = track.archecksum
+            trackResult.ARCRCV2 = track.archecksumV2
+            trackResult.peak = track.peak
+            trackResult.quality = track.quality
+            trackResult.testspeed = t.testspeed
+            trackResult.copyspeed = t.copyspeed
+            trackResult.testduration += t.testduration * share
+            trackResult.copyduration += t.copyduration * share
+
+            if trackResult.filename != track.path:
+                trackResult.filename = track.path
+                self.info('Filename changed to %r', trackResult.filename)
+
     def retagImage(self, runner, taglists):
         cueImage = image.Image(self.cuePath)
         t = image.ImageRetagTask(cueImage, taglists)
         runner.run(t)
 
-    def verifyImage(self, runner, responses):
+    def verifyImage(self, runner, responses, window=0):
         """
         Verify our image against the given AccurateRip responses.
 
         Needs an initialized self.result.
         Will set accurip and friends on each TrackResult.
+
+        @param window: also match tracks as if they were ripped with a read
+                       offset up to this many samples off
+        @type  window: int
         """
 
         self.debug('verifying Image against %d AccurateRip responses',
             len(responses or []))
 
         cueImage = image.Image(self.cuePath)
-        verifytask = image.ImageVerifyTask(cueImage)
-        cuetask = image.AccurateRipChecksumTask(cueImage)
-        runner.run(verifytask)
-        runner.run(cuetask)
 
-        self._verifyImageWithChecksums(responses, cuetask.checksums)
+        # the checksums are calculated while ripping, so only decode the
+        # image again if we don't have all of them
+        trackResults = [self.result.getTrackResult(i + 1)
+            for i in range(len(cueImage.cue.table.tracks))]
+        verifytask = None
+        if None not in trackResults and \
+            None not in [t.ARCRC for t in trackResults] and \
+            None not in [t.ARCRCV2 for t in trackResults]:
+            self.debug('using AccurateRip checksums calculated while ripping')
+            checksums = [t.ARCRC for t in trackResults]
+            checksumsV2 = [t.ARCRCV2 for t in trackResults]
+        else:
+            verifytask = image.ImageVerifyTask(cueImage)
+            cuetask = image.AccurateRipChecksumTask(cueImage)
+            runner.run(verifytask)
+            runner.run(cuetask)
+            checksums = cuetask.checksums
+            checksumsV2 = cuetask.checksumsV2
+
+        self._verifyImageWithChecksums(responses, checksums, checksumsV2)
+
+        # only shift the tracks that did not match as they are
+        tracks = [t.number for t in trackResults
+            if t and not t.accurip and t.number > 0]
+        if not window or not responses or not tracks:
+            return
+
+        self.debug('trying tracks %r with read offset corrections up to %d',
+            tracks, window)
+        if not verifytask:
+            verifytask = image.ImageVerifyTask(cueImage)
+            runner.run(verifytask)
+        offsettask = image.AccurateRipChecksumTask(cueImage, window=window,
+            lengths=verifytask.lengths, tracks=tracks)
+        runner.run(offsettask)
+
+        self._verifyImageWithChecksums(responses, checksums, checksumsV2,
+            offsettask.offsetChecksums)
+
+    def _verifyImageWithChecksums(self, responses, checksums,
+            checksumsV2=None, offsetChecksums=None):
+        """
+        @param checksums:       the v1 AccurateRip checksums of all tracks
+        @param checksumsV2:     the v2 AccurateRip checksums of all tracks
+        @param offsetChecksums: for all tracks, the v1 AccurateRip checksums
+                                by read offset correction, to try for
+                                tracks that do not match as they are
+        @type  offsetChecksums: list of dict of int -> int
+        """
+        if checksumsV2 is None:
+            checksumsV2 = [None] * len(checksums)
 
-    def _verifyImageWithChecksums(self, responses, checksums):
         # loop over tracks to set our calculated AccurateRip CRC's
         for i, csum in enumerate(checksums):
             trackResult = self.result.getTrackResult(i + 1)
             trackResult.ARCRC = csum
+            trackResult.ARCRCV2 = checksumsV2[i]
 
 
         if not responses:
@@ -650,21 +945,35 @@ class Program(log.Loggable):
             confidence = None
             response = None
 
-            # match against each response's checksum for this track
+            # match against each response's checksum for this track;
+            # the database can have either a v1 or a v2 checksum
             for j, r in enumerate(responses):
+                version = None
                 if "%08x" % csum == r.checksums[i]:
+                    version = 1
+                elif checksumsV2[i] is not None and \
+                        "%08x" % checksumsV2[i] == r.checksums[i]:
+                    version = 2
+
+                if version:
                     response = r
                     self.debug(
                         "Track %02d matched response %d of %d in "
-                        "AccurateRip database",
-                        i + 1, j + 1, len(responses))
+                        "AccurateRip database (v%d)",
+                        i + 1, j + 1, len(responses), version)
                     trackResult.accurip = True
+                    trackResult.ARDBVersion = version
                     # FIXME: maybe checksums should be ints
                     trackResult.ARDBCRC = int(r.checksums[i], 16)
                     # arsum = csum
                     confidence = r.confidences[i]
                     trackResult.ARDBConfidence = confidence
 
+            if not trackResult.accurip and offsetChecksums and \
+                    offsetChecksums[i]:
+                response = self._matchOffset(trackResult, responses,
+                    offsetChecksums[i])
+
             if not trackResult.accurip:
                 self.warning("Track %02d: not matched in AccurateRip database",
                     i + 1)
@@ -689,6 +998,33 @@ class Program(log.Loggable):
             else:
                 trackResult.ARDBCRC = int(response.checksums[i], 16)
 
+    def _matchOffset(self, trackResult, responses, checksums):
+        # match the checksums of a shifted track against the responses,
+        # preferring the highest confidence and then the smallest shift;
+        # returns the matching response, if any
+        i = trackResult.number - 1
+        best = None
+        for offset, csum in checksums.items():
+            for r in responses:
+                if "%08x" % csum != r.checksums[i]:
+                    continue
+                key = (-r.confidences[i], abs(offset))
+                if best is None or key < best[0]:
+                    best = (key, offset, r)
+
+        if not best:
+            return None
+
+        key, offset, r = best
+        self.debug("Track %02d matched AccurateRip database with read "
+            "offset correction %+d", i + 1, offset)
+        trackResult.accurip = True
+        trackResult.ARDBVersion = 1
+        trackResult.ARDBOffset = offset
+        trackResult.ARDBCRC = int(r.checksums[i], 16)
+        trackResult.ARDBConfidence = r.confidences[i]
+        return r
+
     def getAccurateRipResults(self):
         """
         @rtype: list of str
@@ -702,6 +1038,16 @@ class Program(log.Loggable):
             if trackResult.accurip:
                     status = 'rip accurate    '
 
+            # show the checksum that matched
+            arcrc = trackResult.ARCRC
+            version = ""
+            if trackResult.ARDBVersion == 2:
+                arcrc = trackResult.ARCRCV2
+                version = " (v2)"
+            if trackResult.ARDBOffset:
+                arcrc = trackResult.ARDBCRC
+                version += " (offset %+d)" % trackResult.ARDBOffset
+
             c = "(not found)            "
             ar = ", DB [notfound]"
             if trackResult.ARDBMaxConfidence:
@@ -721,8 +1067,8 @@ class Program(log.Loggable):
                         trackResult.number
                 res.append("Track  0: unknown          (not tracked)")
             else:
-                res.append("Track %2d: %s %s [%08x]%s" % (
-                    trackResult.number, status, c, trackResult.ARCRC, ar))
+                res.append("Track %2d: %s %s [%08x]%s%s" % (
+                    trackResult.number, status, c, arcrc, ar, version))
 
         return res
 
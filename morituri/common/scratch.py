@@ -0,0 +1,158 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_scratch -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Decide where the temporary files of a rip go.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from morituri.common import log
+
+
+_MAX_NAME_LENGTH = 255 # bytes, on most filesystems
+
+
+class ScratchSpace(log.Loggable):
+    """
+    I hand out paths for the temporary files of a rip.
+
+    Intermediate .wav files go to a scratch directory, which can be on a
+    fast device like a tmpfs, as long as it has room for them; otherwise
+    they go next to the final file.
+
+    Encoded files are staged next to their final file, so that storing
+    them is a rename on the same filesystem instead of a copy.
+
+    The partial reads of a rip that can be continued also go next to the
+    final file, where they survive a reboot.
+
+    @ivar directory: the scratch directory for .wav files
+    @type directory: unicode
+    """
+
+    logCategory = 'ScratchSpace'
+
+    def __init__(self, directory=None):
+        """
+        @param directory: the scratch directory for .wav files; the
+                          system's temporary directory if not given
+        @type  directory: unicode
+        """
+        if not directory:
+            directory = tempfile.gettempdir()
+        self.directory = unicode(directory)
+        self._pending = {} # path -> size, for files still being written
+
+    def getFreeBytes(self, directory):
+        """
+        @returns: the number of bytes that can still be written to the
+                  given directory, not counting the files I handed out
+                  there that are still growing; None if unknown
+        @rtype:   int or None
+        """
+        try:
+            stat = os.statvfs(directory)
+        except (OSError, AttributeError), e:
+            self.debug('Could not stat %r: %r', directory, e)
+            return None
+
+        free = stat.f_bavail * stat.f_frsize
+        directory = os.path.abspath(directory)
+        for path, size in self._pending.items():
+            if not os.path.exists(path):
+                del self._pending[path]
+                continue
+            if os.path.dirname(path) == directory:
+                free -= max(0, size - os.path.getsize(path))
+
+        return free
+
+    def getWAVPath(self, size, path=None):
+        """
+        Create a temporary .wav file.
+
+        @param size: how many bytes the file will take
+        @type  size: int
+        @param path: the final path of what the file will be encoded to,
+                     to fall back to its directory when the scratch
+                     directory is full
+        @type  path: unicode
+
+        @rtype: unicode
+        """
+        directory = self.directory
+        free = self.getFreeBytes(directory)
+        if free is not None and free < size and path:
+            self.info('%r has %d bytes free, need %d; using %r',
+                directory, free, size, os.path.dirname(path))
+            directory = os.path.dirname(path) or os.curdir
+
+        tmppath = self._mkstemp(directory, suffix=u'.morituri.wav')
+        self._pending[tmppath] = size
+
+        return tmppath
+
+    def getStagingPath(self, path, extension):
+        """
+        Create a temporary file next to the given final path, to encode to
+        before moving it into place.
+
+        @param path:      the final path; its directory must exist
+        @type  path:      unicode
+        @param extension: the extension of the encoded file
+        @type  extension: str
+
+        @rtype: unicode
+        """
+        return self._mkstemp(os.path.dirname(path) or os.curdir,
+            prefix=u'.', suffix=u'.morituri.%s' % extension)
+
+    def getPartialPath(self, path, suffix):
+        """
+        Get the path of a file next to the given final path, that outlives
+        an interrupted rip so that it can be continued.  The same final
+        path always gets the same path.
+
+        @param path:   the final path
+        @type  path:   unicode
+        @param suffix: what the file is for
+        @type  suffix: unicode
+
+        @rtype: unicode
+        """
+        dirname, basename = os.path.split(path)
+        name = u'.%s.morituri.partial.%s' % (basename, suffix)
+        if len(name.encode('utf-8')) > _MAX_NAME_LENGTH:
+            name = u'.%s.morituri.partial.%s' % (
+                hashlib.md5(basename.encode('utf-8')).hexdigest(), suffix)
+
+        return os.path.join(dirname, name)
+
+    def _mkstemp(self, directory, prefix=u'tmp', suffix=u''):
+        fd, tmppath = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+            dir=os.path.abspath(directory))
+        os.close(fd)
+
+        return unicode(tmppath)
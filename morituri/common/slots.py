@@ -0,0 +1,130 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_slots -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Limit how many processes do something at the same time, for example
+encode while several drives are being ripped.
+"""
+
+import errno
+import fcntl
+import os
+
+from morituri.common import log
+
+from morituri.extern.task import task
+
+
+class Slot(object):
+    """
+    I am a slot taken from a L{SlotPool}, until I am released.
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    def release(self):
+        if self._handle:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+
+
+class SlotPool(log.Loggable):
+    """
+    I hand out a limited number of slots, shared between all processes
+    using the same directory.
+
+    A slot is a locked file in the directory, so the slots of a process
+    that dies get freed along with it.
+
+    @ivar count: the number of slots
+    @type count: int
+    """
+
+    logCategory = 'SlotPool'
+
+    def __init__(self, path, count):
+        """
+        @param path:  the directory to keep the lock files in
+        @type  path:  str
+        @param count: the number of slots
+        @type  count: int
+        """
+        self._path = path
+        self.count = count
+
+    def acquire(self):
+        """
+        Take a free slot, without waiting for one.
+
+        @rtype: L{Slot} or None if all slots are taken
+        """
+        for i in range(self.count):
+            handle = open(os.path.join(self._path, 'slot-%d' % i), 'a')
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                handle.close()
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    continue
+                raise
+
+            self.debug('took slot %d of %d in %r', i + 1, self.count,
+                self._path)
+            return Slot(handle)
+
+        return None
+
+
+class AcquireSlotTask(log.Loggable, task.Task):
+    """
+    I am a task that waits for a free slot in a L{SlotPool} and takes it.
+
+    @ivar slot: the slot taken, which the caller should release
+    @type slot: L{Slot}
+    """
+
+    description = 'Waiting for a free slot'
+    slot = None
+
+    _INTERVAL = 0.5 # seconds between tries
+
+    def __init__(self, pool, description=None):
+        """
+        @type pool: L{SlotPool}
+        """
+        self._pool = pool
+        if description:
+            self.description = description
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self._acquire()
+
+    def _acquire(self):
+        self.slot = self._pool.acquire()
+        if self.slot:
+            self.stop()
+            return
+
+        self.schedule(self._INTERVAL, self._acquire)
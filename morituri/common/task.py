@@ -16,9 +16,86 @@ class SyncRunner(log.Loggable, task.SyncRunner):
     pass
 
 
+class BackgroundRunner(SyncRunner):
+    """
+    I start a task without waiting for it to stop.
+
+    The task shares the gobject main loop with the tasks run by a
+    L{SyncRunner}, so it only makes progress while one of those runs;
+    run a L{WaitTask} to wait for it to stop.
+
+    @ivar task: the task I run
+    @type task: L{task.Task}
+    @ivar done: whether the task stopped
+    @type done: bool
+    """
+
+    logCategory = 'BackgroundRunner'
+
+    task = None
+    done = False
+
+    def __init__(self):
+        SyncRunner.__init__(self, verbose=False)
+
+    def run(self, taskk):
+        self.debug('run task %r in the background', taskk)
+        self.task = taskk
+        taskk.addListener(self)
+        self._startWrap(taskk)
+
+    ### ITaskListener methods
+    def progressed(self, taskk, value):
+        pass
+
+    def described(self, taskk, description):
+        pass
+
+    def stopped(self, taskk):
+        # also called when a scheduled call raised
+        self.debug('stopped task %r', taskk)
+        self.done = True
+
+
 class LoggableTask(log.Loggable, task.Task):
     pass
 
+
+class WaitTask(LoggableTask):
+    """
+    I wait for the task of a L{BackgroundRunner} to stop, and take over
+    its progress and exception.
+    """
+
+    logCategory = 'WaitTask'
+
+    _INTERVAL = 0.1 # seconds between checks
+
+    def __init__(self, runner):
+        """
+        @type runner: L{BackgroundRunner}
+        """
+        self._runner = runner
+        self.description = runner.task.description
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self._check()
+
+    def _check(self):
+        taskk = self._runner.task
+        self.setProgress(taskk.progress)
+        if not self._runner.done:
+            self.schedule(self._INTERVAL, self._check)
+            return
+
+        if taskk.exception:
+            self.exception = taskk.exception
+            self.exceptionMessage = taskk.exceptionMessage
+            self.exceptionTraceback = taskk.exceptionTraceback
+        self.stop()
+
+
 class LoggableMultiSeparateTask(log.Loggable, task.MultiSeparateTask):
     pass
 
@@ -26,6 +103,68 @@ class GstPipelineTask(log.Loggable, gstreamer.GstPipelineTask):
     pass
 
 
+class MultiParallelTask(log.Loggable, task.Task, task.ITaskListener):
+    """
+    I perform multiple tasks at the same time, and stop when all of them
+    stopped.
+
+    Unlike the other multi tasks, I keep going when one of my tasks fails;
+    check the exception of each task afterwards.
+    I track progress as the average progress of all tasks.
+
+    @ivar tasks: the tasks to run
+    @type tasks: list of L{task.Task}
+    """
+
+    description = 'Doing various tasks at the same time'
+
+    def __init__(self):
+        self.tasks = []
+        self._stopped = 0
+
+    def addTask(self, taskk):
+        """
+        Add a task.
+
+        @type taskk: L{task.Task}
+        """
+        self.tasks.append(taskk)
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        if not self.tasks:
+            self.warning('no tasks')
+            self.stop()
+            return
+
+        for taskk in self.tasks:
+            taskk.addListener(self)
+            try:
+                taskk.start(runner)
+            except Exception, e:
+                taskk.setException(e)
+                self.debug('exception during start of %r: %r',
+                    taskk, taskk.exceptionMessage)
+                self.stopped(taskk)
+
+    ### ITaskListener methods
+    def started(self, taskk):
+        pass
+
+    def progressed(self, taskk, value):
+        self.setProgress(
+            sum([t.progress for t in self.tasks]) / len(self.tasks))
+
+    def described(self, taskk, description):
+        pass
+
+    def stopped(self, taskk):
+        self._stopped += 1
+        if self._stopped == len(self.tasks):
+            self.stop()
+
+
 class PopenTask(log.Loggable, task.Task):
     """
     I am a task that runs a command using Popen.
@@ -54,7 +193,56 @@ class PopenTask(log.Loggable, task.Task):
         self.debug('Started %r with pid %d', self.command,
             self._popen.pid)
 
-        self.schedule(1.0, self._read, runner)
+        # get woken up when there is output, if the runner can do that
+        self._open = 2
+        try:
+            self.watch(self._popen.stdout, self._readStream, 'stdout', runner)
+            self.watch(self._popen.stderr, self._readStream, 'stderr', runner)
+        except NotImplementedError:
+            self.schedule(1.0, self._read, runner)
+
+    def _readStream(self, which, runner):
+        # called when stdout or stderr can be read from or got closed;
+        # returns whether to keep watching it
+        if not self.runner:
+            return False
+
+        try:
+            if which == 'stdout':
+                ret = self._popen.recv()
+            else:
+                ret = self._popen.recv_err()
+
+            if ret:
+                self.log("read from %s: %s", which, ret)
+                if which == 'stdout':
+                    self.readbytesout(ret)
+                else:
+                    self.readbyteserr(ret)
+                return True
+
+            if ret is not None:
+                return True
+
+            self.debug('%s closed', which)
+            self._open -= 1
+            if not self._open:
+                self._wait(runner)
+            return False
+        except Exception, e:
+            self.debug('exception during _readStream()')
+            self.debug(log.getExceptionMessage(e))
+            self.setException(e)
+            self.stop()
+            return False
+
+    def _wait(self, runner):
+        # the command closed its output; wait for it to exit
+        if self._popen.poll() is None:
+            self.schedule(0.01, self._wait, runner)
+            return
+
+        self._done()
 
     def _read(self, runner):
         try:
@@ -0,0 +1,220 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_tocreader -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Read the TOC of a disc, without pregaps, in other ways than running cdrdao.
+
+Each way is a task class that takes the same arguments as
+L{cdrdao.ReadTOCTask}, and sets the same ivars.
+"""
+
+import os
+
+from morituri.common import common, wav
+from morituri.common import task as ctask
+from morituri.image import table, toc, cue
+from morituri.program import cdrdao
+
+from morituri.extern.task import task
+
+
+class ReadTOCTask(ctask.LoggableTask):
+    """
+    I am a base class for tasks that read the TOC in-process.
+
+    Subclasses implement L{read}.
+
+    @ivar table:    the index table that matches the TOC
+    @type table:    L{table.Table}
+    @ivar sessions: the number of sessions, if known
+    @type sessions: int
+    @ivar version:  the cdrdao version; always None
+    """
+
+    description = "Reading TOC..."
+    table = None
+    sessions = None
+    version = None
+
+    def __init__(self, device=None, sessions=None):
+        """
+        @param device:   what to read the TOC from
+        @type  device:   str
+        @param sessions: ignored; I do not need to know the sessions
+        """
+        self.device = device
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        try:
+            self.table = self.read()
+            assert self.table.hasTOC(), "This Table Index should be a TOC"
+        except Exception, e:
+            self.debug('could not read TOC from %r: %r', self.device, e)
+            self.setException(e)
+
+        self.stop()
+
+    def read(self):
+        """
+        Read the TOC.
+
+        @rtype: L{table.Table}
+        """
+        raise NotImplementedError
+
+
+class CdioReadTOCTask(ReadTOCTask):
+    """
+    I read the TOC of a drive through libcdio, without starting a program.
+    """
+
+    logCategory = 'CdioReadTOCTask'
+
+    def read(self):
+        try:
+            import cdio
+        except ImportError:
+            raise common.MissingDependencyException('pycdio')
+
+        device = cdio.Device(self.device)
+        try:
+            try:
+                lastSession = device.get_last_session()
+            except cdio.DriverError:
+                lastSession = 0
+
+            t = table.Table()
+            first = device.get_first_track().track
+            for number in range(first, first + device.get_num_tracks()):
+                cdtrack = device.get_track(number)
+                lsn = cdtrack.get_lsn()
+                track = table.Track(number - first + 1,
+                    audio=cdtrack.get_format() == 'audio')
+                track.index(1, absolute=lsn)
+                # like the tracks cdrdao reads from the last session
+                if lastSession and lsn >= lastSession:
+                    track.session = 2
+                    self.sessions = 2
+                t.tracks.append(track)
+
+            t.leadout = device.get_disc_last_lsn()
+        finally:
+            device.close()
+
+        if t.tracks and not self.sessions:
+            self.sessions = 1
+
+        return t
+
+
+class FileReadTOCTask(ReadTOCTask):
+    """
+    I read the TOC from a .toc file, as written by cdrdao, or from a .cue
+    file with the .wav or raw audio files it refers to, instead of from a
+    drive.  Any indexes in the file are kept.
+
+    Compressed files, like .flac, are not supported.
+    """
+
+    logCategory = 'FileReadTOCTask'
+
+    _RAW_EXTENSIONS = ('.bin', '.raw', '.img', '.pcm')
+
+    def read(self):
+        path = self.device
+        if not isinstance(path, unicode):
+            path = path.decode('utf-8')
+
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.toc':
+            return self._readToc(path)
+        elif extension == '.cue':
+            return self._readCue(path)
+
+        raise ValueError('Cannot read a TOC from %r' % path)
+
+    def _readToc(self, path):
+        # the same as a TOC read by cdrdao
+        tocfile = toc.TocFile(path)
+        tocfile.parse()
+        t = tocfile.table
+        t.absolutize()
+        for track in t.tracks:
+            for index in track.indexes.values():
+                index.relative = None
+
+        return t
+
+    def _readCue(self, path):
+        cuefile = cue.CueFile(path)
+        cuefile.parse()
+        t = cuefile.table
+
+        # each file follows the previous one on the disc
+        starts = {}
+        offset = 0
+        for track in t.tracks:
+            for number in sorted(track.indexes.keys()):
+                index = track.indexes[number]
+                if index.counter not in starts:
+                    starts[index.counter] = offset
+                    offset += self._getFrames(
+                        self._getRealPath(cuefile, path, index.path))
+                index.absolute = starts[index.counter] + index.relative
+                index.relative = None
+
+        t.leadout = offset
+
+        return t
+
+    def _getRealPath(self, cuefile, cuePath, path):
+        # getRealPath only looks for .wav and .flac files, not raw ones
+        candidate = os.path.join(os.path.dirname(cuePath), path)
+        if os.path.exists(candidate):
+            return candidate
+
+        return cuefile.getRealPath(path)
+
+    def _getFrames(self, path):
+        # returns the number of CD frames in a .wav or raw audio file;
+        # compressed files would need decoding to know their length
+        extension = os.path.splitext(path)[1].lower()
+        if extension in self._RAW_EXTENSIONS:
+            return os.path.getsize(path) / common.BYTES_PER_FRAME
+        elif extension != '.wav':
+            raise ValueError('Cannot read audio from %r: only .wav files '
+                'and raw %s files are supported' % (
+                    path, '/'.join(self._RAW_EXTENSIONS)))
+
+        try:
+            return wav.WAVFile(path).samples / common.SAMPLES_PER_FRAME
+        except wav.WAVError, e:
+            raise ValueError('Cannot read audio from %r: %s' % (path, e))
+
+
+READERS = {
+    'cdrdao': cdrdao.ReadTOCTask,
+    'cdio': CdioReadTOCTask,
+    'file': FileReadTOCTask,
+}
@@ -0,0 +1,218 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_wav -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Direct access to the samples of PCM WAV files like the ones cdparanoia
+writes, without going through GStreamer.
+"""
+
+import mmap
+import os
+import struct
+import wave
+
+from morituri.common import log, analysis
+
+
+WAVE_FORMAT_PCM = 1
+
+
+class WAVError(Exception):
+    """
+    The file is not a CD audio PCM WAV file.
+    """
+    pass
+
+
+class WAVFile(log.Loggable):
+    """
+    I give access to the samples of a 16 bit stereo 44.1 kHz PCM WAV file,
+    by memory-mapping it.
+
+    @ivar dataOffset: the byte offset of the first sample in the file
+    @type dataOffset: int
+    @ivar samples:    the number of samples in the file; a sample is
+                      4 bytes, one 16 bit value for each channel
+    @type samples:    int
+    """
+
+    logCategory = 'WAVFile'
+
+    dataOffset = None
+    samples = None
+
+    _handle = None
+    _mmap = None
+
+    def __init__(self, path):
+        """
+        @type path: unicode
+
+        @raises WAVError: if the file is not a CD audio PCM WAV file
+        """
+        self._path = path
+
+        handle = open(path, 'rb')
+        try:
+            self._parse(handle, os.fstat(handle.fileno()).st_size)
+        finally:
+            handle.close()
+
+    def _parse(self, handle, size):
+        header = handle.read(12)
+        if len(header) < 12:
+            raise WAVError('file is too short')
+        riff, _, wave = struct.unpack('<4sI4s', header)
+        if riff != 'RIFF' or wave != 'WAVE':
+            raise WAVError('not a RIFF WAVE file')
+
+        fmt = None
+        while True:
+            header = handle.read(8)
+            if len(header) < 8:
+                raise WAVError('no data chunk')
+            chunk, length = struct.unpack('<4sI', header)
+
+            if chunk == 'fmt ':
+                if length < 16:
+                    raise WAVError('fmt chunk is too short')
+                fmt = struct.unpack('<HHIIHH', handle.read(16))
+                handle.seek(length - 16 + length % 2, 1)
+            elif chunk == 'data':
+                break
+            else:
+                handle.seek(length + length % 2, 1)
+
+        if fmt is None:
+            raise WAVError('no fmt chunk before data chunk')
+        audioFormat, channels, rate, _, blockAlign, depth = fmt
+        if (audioFormat, channels, rate, blockAlign, depth) != \
+            (WAVE_FORMAT_PCM, 2, 44100, 4, 16):
+            raise WAVError('not 16 bit stereo 44.1 kHz PCM')
+
+        self.dataOffset = handle.tell()
+
+        # cdparanoia writing to a pipe cannot fill in the data length,
+        # so trust the file size over the header
+        available = size - self.dataOffset
+        if length > available:
+            self.debug('data chunk claims %d bytes, file only has %d',
+                length, available)
+            length = available
+        self.samples = length / 4
+
+    def open(self):
+        """
+        Map the file into memory.  Call me before L{read}.
+        """
+        self._handle = open(self._path, 'rb')
+        if self.samples:
+            self._mmap = mmap.mmap(self._handle.fileno(), 0,
+                access=mmap.ACCESS_READ)
+
+    def read(self, sampleStart, sampleCount):
+        """
+        Read samples from the file.
+
+        @param sampleStart: the first sample to read, counting from 0
+        @type  sampleStart: int
+        @param sampleCount: the number of samples to read
+        @type  sampleCount: int
+
+        @returns: the samples; fewer than asked for at the end of the file
+        @rtype:   str
+        """
+        sampleCount = max(0, min(sampleCount, self.samples - sampleStart))
+        if not sampleCount:
+            return ''
+
+        start = self.dataOffset + sampleStart * 4
+        return self._mmap[start:start + sampleCount * 4]
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+
+class WAVWriter(log.Loggable, analysis.Accumulator):
+    """
+    I write the samples I get fed to a 16 bit stereo 44.1 kHz PCM WAV file,
+    like the ones cdparanoia writes.
+
+    I can also continue an existing file, keeping the samples at its start.
+    """
+
+    logCategory = 'WAVWriter'
+
+    _wave = None
+    _handle = None
+
+    def __init__(self, path, keepSamples=0):
+        """
+        @type  path:        unicode
+        @param keepSamples: the number of samples at the start of the
+                            existing file to keep and write after
+        @type  keepSamples: int
+        """
+        self._path = path
+        self._keepSamples = keepSamples
+
+    def setLength(self, sampleLength):
+        if self._keepSamples:
+            self.debug('writing samples after the first %d of %r',
+                self._keepSamples, self._path)
+            self._dataOffset = WAVFile(self._path).dataOffset
+            self._handle = open(self._path, 'r+b')
+            self._handle.seek(self._dataOffset + self._keepSamples * 4)
+            self._handle.truncate()
+            return
+
+        self.debug('writing %d samples to %r', sampleLength, self._path)
+        self._wave = wave.open(self._path.encode('utf-8'), 'wb')
+        self._wave.setparams((2, 2, 44100, sampleLength, 'NONE',
+            'not compressed'))
+
+    def update(self, buf):
+        if self._handle:
+            self._handle.write(buf)
+        else:
+            self._wave.writeframesraw(buf)
+
+    def finish(self):
+        # fixes up the header if we got a different number of samples
+        if self._wave:
+            self._wave.close()
+            self._wave = None
+
+        if self._handle:
+            # the data chunk is the last one, like wave writes it
+            size = self._handle.tell()
+            self._handle.seek(4)
+            self._handle.write(struct.pack('<I', size - 8))
+            self._handle.seek(self._dataOffset - 4)
+            self._handle.write(struct.pack('<I', size - self._dataOffset))
+            self._handle.close()
+            self._handle = None
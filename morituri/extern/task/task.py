@@ -217,6 +217,18 @@ class Task(LogStub):
             return
         self.runner.schedule(self, delta, callable, *args, **kwargs)
 
+    def watch(self, handle, callable, *args, **kwargs):
+        """
+        Have callable called whenever the given file can be read from
+        or got closed, for as long as it returns True.
+
+        @raises NotImplementedError: if the runner cannot watch files;
+                                     poll through schedule instead
+        """
+        if not self.runner:
+            self.warning('not watching %r, task already stopped', handle)
+            return
+        self.runner.watch(self, handle, callable, *args, **kwargs)
 
     def addListener(self, listener):
         """
@@ -453,6 +465,18 @@ class TaskRunner(LogStub):
         """
         raise NotImplementedError
 
+    def watch(self, task, handle, callable, *args, **kwargs):
+        """
+        Call callable whenever the given file can be read from or got
+        closed, until it returns False.
+
+        Subclasses can implement this; tasks fall back to polling through
+        schedule when they do not.
+
+        @param handle: a file object or file descriptor
+        """
+        raise NotImplementedError
+
 
 class SyncRunner(TaskRunner, ITaskListener):
     """
@@ -521,6 +545,25 @@ class SyncRunner(TaskRunner, ITaskListener):
 
         gobject.timeout_add(int(delta * 1000L), c)
 
+    def watch(self, task, handle, callable, *args, **kwargs):
+        def c(source, condition):
+            try:
+                self.log('watch: calling %r(*args=%r, **kwargs=%r)',
+                    callable, args, kwargs)
+                return callable(*args, **kwargs)
+            except Exception, e:
+                self.debug('exception when calling watching callable %r',
+                    callable)
+                task.setException(e)
+                self.stopped(task)
+                raise
+        self.log('watch: watching %r for %r(*args=%r, **kwargs=%r)',
+            handle, callable, args, kwargs)
+
+        gobject.io_add_watch(handle,
+            gobject.IO_IN | gobject.IO_PRI | gobject.IO_ERR | gobject.IO_HUP,
+            c)
+
     ### ITaskListener methods
     def progressed(self, task, value):
         if not self._verboseRun:
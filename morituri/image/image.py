@@ -26,7 +26,7 @@ Wrap on-disk CD images based on the .cue file.
 
 import os
 
-from morituri.common import log, common
+from morituri.common import log, common, accurip
 from morituri.image import cue, table
 
 from morituri.extern.task import task, gstreamer
@@ -105,40 +105,149 @@ class Image(object, log.Loggable):
 class AccurateRipChecksumTask(log.Loggable, task.MultiSeparateTask):
     """
     I calculate the AccurateRip checksums of all tracks.
+
+    Given a window, I also calculate the v1 checksums of each track as if
+    the image had been ripped with a read offset up to that many samples
+    smaller or bigger, from the same decode of the track and a short read
+    of the tracks next to it.
+
+    @ivar checksums:       the v1 checksums of all tracks
+    @ivar checksumsV2:     the v2 checksums of all tracks
+    @ivar offsetChecksums: for all tracks, a dict of read offset correction
+                           in samples to v1 checksum; only set with a
+                           window, and None for tracks that were not
+                           shifted
+    @type offsetChecksums: list of dict of int -> int
     """
 
     description = "Checksumming tracks"
 
-    def __init__(self, image):
+    def __init__(self, image, window=0, lengths=None, tracks=None):
+        """
+        @param window:  how many samples to shift each track in both
+                        directions to calculate offsetChecksums
+        @type  window:  int
+        @param tracks:  with a window, the numbers of the tracks to
+                        checksum; all of them if not given
+        @type  tracks:  list of int
+        @param lengths: lengths in frames of the tracks, by track number,
+                        for tracks whose length cannot be determined from
+                        the .cue file; see L{ImageVerifyTask}.
+                        Needed to read the end of those tracks with a
+                        window.
+        @type  lengths: dict of int -> int
+        """
         task.MultiSeparateTask.__init__(self)
 
         self._image = image
+        self._window = window
         cue = image.cue
         self.checksums = []
+        self.checksumsV2 = []
+        self.offsetChecksums = None
+        self._accumulators = {} # last task for a track -> its buffers
+
+        # here to avoid import gst eating our options
+        from morituri.common import checksum
 
+        # path, first sample and length in samples of each track
+        ranges = []
         self.debug('Checksumming %d tracks' % len(cue.table.tracks))
         for trackIndex, track in enumerate(cue.table.tracks):
             index = track.indexes[1]
             length = cue.getTrackLength(track)
             if length < 0:
                 self.debug('track %d has unknown length' % (trackIndex + 1, ))
+                length = (lengths or {}).get(trackIndex + 1, -1)
             else:
                 self.debug('track %d is %d samples long' % (
                     trackIndex + 1, length))
 
-            path = image.getRealPath(index.path)
-
-            # here to avoid import gst eating our options
-            from morituri.common import checksum
-
-            checksumTask = checksum.AccurateRipChecksumTask(path,
-                trackNumber=trackIndex + 1, trackCount=len(cue.table.tracks),
-                sampleStart=index.relative * common.SAMPLES_PER_FRAME,
-                sampleLength=length * common.SAMPLES_PER_FRAME)
-            self.addTask(checksumTask)
+            ranges.append((image.getRealPath(index.path),
+                index.relative * common.SAMPLES_PER_FRAME,
+                length * common.SAMPLES_PER_FRAME))
+
+        if not window:
+            for trackIndex, (path, start, length) in enumerate(ranges):
+                checksumTask = checksum.AccurateRipChecksumTask(path,
+                    trackNumber=trackIndex + 1, trackCount=len(ranges),
+                    sampleStart=start, sampleLength=length)
+                self.addTask(checksumTask)
+            return
+
+        from morituri.common import analysis
+
+        # for each track, decode it and read window samples on each side,
+        # keeping them until the shifted checksums are calculated
+        self.offsetChecksums = [None, ] * len(ranges)
+        self._arcs = []
+        for trackIndex, (path, start, length) in enumerate(ranges):
+            if tracks and trackIndex + 1 not in tracks:
+                self._arcs.append(None)
+                continue
+
+            arcs = analysis.AccurateRipAccumulator(trackIndex + 1,
+                len(ranges))
+            buffers = [analysis.BufferAccumulator() for i in range(3)]
+
+            before = None
+            if trackIndex > 0:
+                p, s, l = ranges[trackIndex - 1]
+                if l < 0:
+                    self.warning('Cannot shift track %d to before its '
+                        'start, length of track %d unknown',
+                        trackIndex + 1, trackIndex)
+                else:
+                    before = checksum.AnalysisTask(p, [buffers[0], ],
+                        sampleStart=s + max(l - window, 0),
+                        sampleLength=min(l, window))
+                    self.addTask(before)
+
+            self.addTask(checksum.AnalysisTask(path, [arcs, buffers[1]],
+                sampleStart=start, sampleLength=length))
+            self._arcs.append(arcs)
+
+            if trackIndex < len(ranges) - 1:
+                p, s, l = ranges[trackIndex + 1]
+                if l < 0:
+                    l = window
+                self.addTask(checksum.AnalysisTask(p, [buffers[2], ],
+                    sampleStart=s, sampleLength=min(l, window)))
+
+            self._accumulators[self.tasks[-1]] = (trackIndex, buffers)
+
+    def stopped(self, taskk):
+        if not taskk.exception and taskk in self._accumulators:
+            trackIndex, buffers = self._accumulators.pop(taskk)
+            self._shift(trackIndex, *[b.data for b in buffers])
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+    def _shift(self, trackIndex, before, data, after):
+        window = self._window
+        sampleLength = len(data) / 4
+
+        # pad with silence before the start or after the end of the disc,
+        # and when a neighbouring track could not be read or is too short
+        before = '\0' * (window * 4 - len(before)) + before
+        after = after[:window * 4]
+        after = after + '\0' * (window * 4 - len(after))
+
+        self.debug('calculating checksums of track %d for offsets %d to %d',
+            trackIndex + 1, -window, window)
+        checksums = accurip.getOffsetChecksums(before + data + after,
+            trackIndex + 1, len(self.offsetChecksums), sampleLength,
+            range(2 * window + 1))
+        self.offsetChecksums[trackIndex] = dict([(d - window, c)
+            for d, c in checksums.items()])
 
     def stop(self):
-        self.checksums = [t.checksum for t in self.tasks]
+        if self._window:
+            self.checksums = [a and a.checksum for a in self._arcs]
+            self.checksumsV2 = [a and a.checksumV2 for a in self._arcs]
+        else:
+            self.checksums = [t.checksum for t in self.tasks]
+            self.checksumsV2 = [t.checksumV2 for t in self.tasks]
         task.MultiSeparateTask.stop(self)
 
 
@@ -28,8 +28,11 @@ import stat
 import shutil
 import subprocess
 import tempfile
+import zlib
 
-from morituri.common import log, common
+from morituri.common import log, common, analysis, cache, wav
+from morituri.common import scratch as cscratch
+from morituri.common import slots
 from morituri.common import task as ctask
 
 from morituri.extern import asyncsub
@@ -99,7 +102,9 @@ class ProgressParser(log.Loggable):
         # FIXME: privatize
         self.read = start
 
-        self._reads = {} # read count for each sector
+        # changes in read count at the frames where a read starts or ends;
+        # this is much cheaper to keep up to date than a count per frame
+        self._marks = {}
 
     def parse(self, line):
         """
@@ -160,12 +165,10 @@ class ProgressParser(log.Loggable):
             markStart = frameOffset # - self._firstFrames
             markEnd = frameOffset
 
-        # FIXME: doing this is way too slow even for a testcase, so disable
-        if False:
-            for frame in range(markStart, markEnd):
-                if not frame in self._reads.keys():
-                    self._reads[frame] = 0
-                self._reads[frame] += 1
+        # update our read map
+        if markStart < markEnd:
+            self._marks[markStart] = self._marks.get(markStart, 0) + 1
+            self._marks[markEnd] = self._marks.get(markEnd, 0) - 1
 
         # cdparanoia reads quite a bit beyond the current track before it
         # goes back to verify; don't count those
@@ -185,6 +188,37 @@ class ProgressParser(log.Loggable):
         frameOffset = (wordOffset + 1) / common.WORDS_PER_FRAME
         self.wrote = frameOffset
 
+    def getReadMap(self):
+        """
+        Get how many times each frame of the track was read, as runs of
+        consecutive frames with the same read count.
+
+        @returns: list of (first frame, last frame (inclusive), reads)
+        @rtype:   list of (int, int, int)
+        """
+        runs = []
+
+        reads = 0
+        first = self.start
+        for frame in sorted(self._marks.keys()):
+            if frame > self.stop:
+                break
+            if frame > first:
+                runs.append([first, frame - 1, reads])
+                first = frame
+            reads += self._marks[frame]
+        runs.append([first, self.stop, reads])
+
+        # merge runs that ended up with the same count
+        merged = []
+        for run in runs:
+            if merged and merged[-1][2] == run[2]:
+                merged[-1][1] = run[1]
+            else:
+                merged.append(run)
+
+        return [tuple(run) for run in merged]
+
     def getTrackQuality(self):
         """
         Each frame gets read twice.
@@ -206,22 +240,40 @@ class ReadTrackTask(log.Loggable, task.Task):
     """
     I am a task that reads a track using cdparanoia.
 
-    @ivar reads: how many reads were done to rip the track
+    Given accumulators, I have cdparanoia write the audio to a pipe
+    instead, and feed it to them as it arrives.  In that case I write the
+    .wav file myself, if a path is given.  An accumulator that raises an
+    exception stops the read, with that exception.
+
+    Without paranoia, cdparanoia reads the frames once as fast as the drive
+    can, without checking or correcting them; the audio then has to be
+    verified some other way, for example against AccurateRip.
+
+    When resuming, the first frames come from the .wav file a previous,
+    interrupted read left at path, and cdparanoia only reads the rest.
+
+    @ivar reads:   how many reads were done to rip the track
+    @ivar readMap: how many times each frame was read, as runs of frames;
+                   see L{ProgressParser.getReadMap}
     """
 
     description = "Reading track"
     quality = None # set at end of reading
+    readMap = None # set at end of reading
     speed = None
     duration = None # in seconds
 
     _MAXERROR = 100 # number of errors detected by parser
+    _AUDIO_READ_SIZE = 1024 * 1024
 
     def __init__(self, path, table, start, stop, offset=0, device=None,
-        action="Reading", what="track"):
+        action="Reading", what="track", accumulators=None, paranoia=True,
+        resumeFrames=0):
         """
         Read the given track.
 
-        @param path:   where to store the ripped track
+        @param path:   where to store the ripped track; can be None when
+                       streaming to accumulators
         @type  path:   unicode
         @param table:  table of contents of CD
         @type  table:  L{table.Table}
@@ -237,16 +289,42 @@ class ReadTrackTask(log.Loggable, task.Task):
         @type  action: str
         @param what:   a string representing what's being read; e.g. Track
         @type  what:   str
+        @param accumulators: what to feed the audio to while reading
+        @type  accumulators: list of L{analysis.Accumulator}
+        @param paranoia: whether cdparanoia should check what it reads
+        @type  paranoia: bool
+        @param resumeFrames: the number of frames at the start of the .wav
+                             file at path to keep, instead of reading them;
+                             needs accumulators, and less than all frames
+        @type  resumeFrames: int
         """
-        assert type(path) is unicode, "%r is not unicode" % path
+        assert type(path) is unicode or (path is None and accumulators), \
+            "%r is not unicode" % path
+        assert not resumeFrames or (path and accumulators), \
+            "can only resume streaming to a file"
+        assert start + resumeFrames <= stop, \
+            "cannot resume after the last frame"
 
         self.path = path
+        self._accumulators = accumulators
+        self._writer = None
+        if accumulators and path:
+            # first, so that the audio is written before the others see it
+            self._writer = wav.WAVWriter(path,
+                keepSamples=resumeFrames * common.SAMPLES_PER_FRAME)
+            self._accumulators = [self._writer, ] + accumulators
+        self._audio = "" # audio that is not a whole number of samples yet
+        self._bytes = 0 # number of bytes of audio streamed
+        self._streaming = False # whether we are still getting audio
         self._table = table
         self._start = start
         self._stop = stop
+        self._resumeFrames = resumeFrames
+        self._readStart = start + resumeFrames # first frame cdparanoia reads
         self._offset = offset
-        self._parser = ProgressParser(start, stop)
+        self._parser = ProgressParser(self._readStart, stop)
         self._device = device
+        self._paranoia = paranoia
         self._start_time = None
 
         self._buffer = "" # accumulate characters
@@ -256,6 +334,43 @@ class ReadTrackTask(log.Loggable, task.Task):
     def start(self, runner):
         task.Task.start(self, runner)
 
+        bufsize = 1024
+        argv = self._getArguments()
+        self.debug('Running %s' % (" ".join(argv), ))
+        try:
+            self._popen = asyncsub.Popen(argv,
+                bufsize=bufsize,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, close_fds=True)
+        except OSError, e:
+            import errno
+            if e.errno == errno.ENOENT:
+                raise common.MissingDependencyException('cdparanoia')
+
+            raise
+
+        if self._accumulators:
+            self._streaming = True
+            for accumulator in self._accumulators:
+                accumulator.setLength(
+                    (self._stop - self._start + 1) * common.SAMPLES_PER_FRAME)
+            if self._resumeFrames:
+                self._resume()
+
+        self._start_time = time.time()
+
+        # get woken up when there is output, if the runner can do that
+        self._open = 1
+        try:
+            self.watch(self._popen.stderr, self._readProgress, runner)
+            if self._streaming:
+                self._open += 1
+                self.watch(self._popen.stdout, self._readStream, runner)
+        except NotImplementedError:
+            self.schedule(1.0, self._read, runner)
+
+    def _getArguments(self):
+        # returns the cdparanoia command line for the frames to read
         # find on which track the range starts and stops
         startTrack = 0
         startOffset = 0
@@ -263,54 +378,156 @@ class ReadTrackTask(log.Loggable, task.Task):
         stopOffset = self._stop
 
         for i, t in enumerate(self._table.tracks):
-            if self._table.getTrackStart(i + 1) <= self._start:
+            if self._table.getTrackStart(i + 1) <= self._readStart:
                 startTrack = i + 1
-                startOffset = self._start - self._table.getTrackStart(i + 1)
+                startOffset = self._readStart - \
+                    self._table.getTrackStart(i + 1)
             if self._table.getTrackEnd(i + 1) <= self._stop:
                 stopTrack = i + 1
                 stopOffset = self._stop - self._table.getTrackStart(i + 1)
 
         self.debug('Ripping from %d to %d (inclusive)',
-            self._start, self._stop)
+            self._readStart, self._stop)
         self.debug('Starting at track %d, offset %d',
             startTrack, startOffset)
         self.debug('Stopping at track %d, offset %d',
             stopTrack, stopOffset)
 
-        bufsize = 1024
         argv = ["cdparanoia", "--stderr-progress",
             "--sample-offset=%d" % self._offset, ]
         if self._device:
             argv.extend(["--force-cdrom-device", self._device, ])
+        if not self._paranoia:
+            argv.append("--disable-paranoia")
+        if self._accumulators:
+            argv.append("--output-raw-little-endian")
         argv.extend(["%d[%s]-%d[%s]" % (
                 startTrack, common.framesToHMSF(startOffset),
                 stopTrack, common.framesToHMSF(stopOffset)),
-            self.path])
-        self.debug('Running %s' % (" ".join(argv), ))
+            self._accumulators and "-" or self.path])
+
+        return argv
+
+    def _resume(self):
+        # feed what the interrupted read left to the other accumulators
+        self.debug('Resuming after %d frames of %r', self._resumeFrames,
+            self.path)
+        w = wav.WAVFile(self.path)
+        w.open()
         try:
-            self._popen = asyncsub.Popen(argv,
-                bufsize=bufsize,
-                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, close_fds=True)
-        except OSError, e:
-            import errno
-            if e.errno == errno.ENOENT:
-                raise common.MissingDependencyException('cdparanoia')
+            frames = 0
+            while frames < self._resumeFrames:
+                count = min(common.FRAMES_PER_SECOND * 10,
+                    self._resumeFrames - frames)
+                audio = w.read(frames * common.SAMPLES_PER_FRAME,
+                    count * common.SAMPLES_PER_FRAME)
+                for accumulator in self._accumulators:
+                    if accumulator is not self._writer:
+                        accumulator.update(audio)
+                self._bytes += len(audio)
+                frames += count
+        except Exception, e:
+            self.debug('stopping read: %r', e)
+            self.setException(e)
+            self._terminate()
+        finally:
+            w.close()
+
+    def _readProgress(self, runner):
+        # called when stderr can be read from or got closed;
+        # returns whether to keep watching it
+        if not self.runner:
+            return False
 
-            raise
+        ret = self._popen.recv_err()
+        if ret:
+            self._parseProgress(ret)
+            return True
+        if ret is not None:
+            return True
+
+        self._closed(runner)
+        return False
+
+    def _readStream(self, runner):
+        # called when stdout can be read from or got closed;
+        # returns whether to keep watching it
+        if not self.runner:
+            return False
+
+        self._readAudio()
+        if self._streaming:
+            return True
+
+        self._closed(runner)
+        return False
+
+    def _closed(self, runner):
+        self._open -= 1
+        if not self._open:
+            self._poll(runner)
+
+    def _readAudio(self):
+        # get all the audio that is waiting in the pipe, and pass on all
+        # whole samples
+        chunks = [self._audio, ]
+        while True:
+            ret = self._popen.recv(self._AUDIO_READ_SIZE)
+            if not ret:
+                if ret is None:
+                    self.debug('audio pipe closed')
+                    self._streaming = False
+                break
+            chunks.append(ret)
+
+        audio = "".join(chunks)
+        size = len(audio) - len(audio) % 4
+        self._audio = audio[size:]
+        if not size:
+            return
 
-        self._start_time = time.time()
-        self.schedule(1.0, self._read, runner)
+        audio = audio[:size]
+        self._bytes += size
+        if self.exception:
+            # we are stopping the read; drop what is left
+            return
+
+        try:
+            for accumulator in self._accumulators:
+                accumulator.update(audio)
+        except Exception, e:
+            # an accumulator can stop the read, for example when the
+            # audio is different from a previous read
+            self.debug('stopping read: %r', e)
+            self.setException(e)
+            self._terminate()
+
+    def _terminate(self):
+        # stop reading early
+        self._popen.terminate()
 
     def _read(self, runner):
+        if self._streaming:
+            self._readAudio()
+
         ret = self._popen.recv_err()
         if not ret:
             if self._popen.poll() is not None:
+                # get what is left in the audio pipe
+                while self._streaming:
+                    self._readAudio()
                 self._done()
                 return
             self.schedule(0.01, self._read, runner)
             return
 
+        self._parseProgress(ret)
+
+        # 0 does not give us output before we complete, 1.0 gives us output
+        # too late
+        self.schedule(0.01, self._read, runner)
+
+    def _parseProgress(self, ret):
         self._buffer += ret
 
         # parse buffer into lines if possible, and parse them
@@ -331,21 +548,18 @@ class ReadTrackTask(log.Loggable, task.Task):
                 self.debug('%d errors, terminating', self._parser.errors)
                 self._popen.terminate()
 
-            num = self._parser.wrote - self._start + 1
-            den = self._stop - self._start + 1
+            num = self._parser.wrote - self._readStart + 1
+            den = self._stop - self._readStart + 1
             assert den != 0, "stop %d should be >= start %d" % (
-                self._stop, self._start)
+                self._stop, self._readStart)
             progress = float(num) / float(den)
             if progress < 1.0:
                 self.setProgress(progress)
 
-        # 0 does not give us output before we complete, 1.0 gives us output
-        # too late
-        self.schedule(0.01, self._read, runner)
-
     def _poll(self, runner):
+        # cdparanoia closed its output; wait for it to exit
         if self._popen.poll() is None:
-            self.schedule(1.0, self._poll, runner)
+            self.schedule(0.01, self._poll, runner)
             return
 
         self._done()
@@ -355,10 +569,20 @@ class ReadTrackTask(log.Loggable, task.Task):
         self.setProgress(1.0)
 
         # check if the length matches
-        size = os.stat(self.path)[stat.ST_SIZE]
-        # wav header is 44 bytes
         offsetLength = self._stop - self._start + 1
-        expected = offsetLength * common.BYTES_PER_FRAME + 44
+        if self._accumulators:
+            self._finishAccumulators()
+            if self.exception:
+                self.debug('read stopped: %r', self.exception)
+                self.stop()
+                return
+
+            size = self._bytes
+            expected = offsetLength * common.BYTES_PER_FRAME
+        else:
+            size = os.stat(self.path)[stat.ST_SIZE]
+            # wav header is 44 bytes
+            expected = offsetLength * common.BYTES_PER_FRAME + 44
         if size != expected:
             # FIXME: handle errors better
             self.warning('file size %d did not match expected size %d',
@@ -381,18 +605,506 @@ class ReadTrackTask(log.Loggable, task.Task):
                 self.exception = ReturnCodeError(self._popen.returncode)
 
         self.quality = self._parser.getTrackQuality()
+        self.readMap = self._parser.getReadMap()
         self.duration = end_time - self._start_time
-        self.speed = (offsetLength / 75.0) / self.duration
+        self.speed = ((self._stop - self._readStart + 1) / 75.0) / \
+            self.duration
 
         self.stop()
         return
 
+    def _finishAccumulators(self):
+        for accumulator in self._accumulators:
+            try:
+                accumulator.finish()
+            except Exception, e:
+                if not self.exception:
+                    self.setException(e)
+
+
+class CdioReadTrackTask(ReadTrackTask):
+    """
+    I am a task that reads a track in-process through libcdio, instead of
+    running cdparanoia, and feed the sectors straight to the accumulators.
+
+    libcdio can also open BIN/CUE and .toc images as a device, so a track
+    can be read from an image the same way every time.
+
+    I do not check and correct what I read like paranoia does; a chunk of
+    sectors that fails to read gets read again sector by sector, and each
+    sector is retried until it reads.  The read map counts every read of
+    a sector.
+
+    I take the same arguments as L{ReadTrackTask}; paranoia is ignored.
+
+    @ivar retries: how many sector reads failed and were retried
+    @type retries: int
+    """
+
+    logCategory = 'CdioReadTrackTask'
+
+    retries = 0
+
+    _SECTORS = 27 # sectors to read at once, as many as cdparanoia does
+    _MAXRETRIES = 20 # times to retry a sector before giving up
+
+    _cd = None
+
+    def __init__(self, *args, **kwargs):
+        ReadTrackTask.__init__(self, *args, **kwargs)
+
+        if not self._accumulators:
+            # there is no cdparanoia to write the file
+            self._writer = wav.WAVWriter(self.path)
+            self._accumulators = [self._writer, ]
+
+        # the audio of a frame starts this many samples into the sector
+        # this many sectors further on
+        self._shift, samples = divmod(self._offset,
+            common.SAMPLES_PER_FRAME)
+        self._skip = samples * 4 # bytes of the first sector to drop
+        self._next = self._readStart + self._shift # next sector to read
+        self._last = self._stop + self._shift # last sector to read
+        if samples:
+            self._last += 1
+        self._runs = [] # [first frame, last frame, reads] so far
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        self.debug('Reading sectors %d to %d (inclusive) of %r',
+            self._next, self._last, self._device)
+        self._open()
+
+        self._streaming = True
+        for accumulator in self._accumulators:
+            accumulator.setLength(
+                (self._stop - self._start + 1) * common.SAMPLES_PER_FRAME)
+        self._start_time = time.time()
+        if self._resumeFrames:
+            self._resume()
+            if self.exception:
+                self._finish()
+                return
+
+        self.schedule(0, self._readChunk)
+
+    def _open(self):
+        try:
+            import cdio
+            import pycdio
+        except ImportError:
+            raise common.MissingDependencyException('pycdio')
+
+        self._cdio = cdio
+        self._pycdio = pycdio
+        self._cd = cdio.Device(self._device)
+
+    def _close(self):
+        self._cd.close()
+
+    def _readDevice(self, lsn, count):
+        """
+        Read audio sectors from the device.
+
+        @raises IOError: when the sectors could not be read
+
+        @returns: the audio of count sectors from lsn on
+        @rtype:   str
+        """
+        try:
+            blocks, data = self._cd.read_sectors(lsn,
+                self._pycdio.READ_MODE_AUDIO, count)
+        except self._cdio.DeviceException, e:
+            raise IOError('could not read sector %d: %s' % (lsn, e))
+
+        if len(data) != count * common.BYTES_PER_FRAME:
+            raise IOError('read %d bytes from sector %d instead of %d' % (
+                len(data), lsn, count * common.BYTES_PER_FRAME))
+
+        return data
+
+    def _terminate(self):
+        self._streaming = False
+
+    def _readChunk(self):
+        count = min(self._SECTORS, self._last - self._next + 1)
+        try:
+            audio = self._readSectors(self._next, count)
+        except Exception, e:
+            self.debug('stopping read: %r', e)
+            self.setException(e)
+            self._finish()
+            return
+        self._next += count
+
+        if self._skip:
+            audio = audio[self._skip:]
+            self._skip = 0
+        # the last sector can go beyond the last frame
+        expected = (self._stop - self._start + 1) * common.BYTES_PER_FRAME
+        audio = audio[:expected - self._bytes]
+        self._bytes += len(audio)
+
+        try:
+            for accumulator in self._accumulators:
+                accumulator.update(audio)
+        except Exception, e:
+            # an accumulator can stop the read, for example when the
+            # audio is different from a previous read
+            self.debug('stopping read: %r', e)
+            self.setException(e)
+            self._terminate()
+
+        if not self._streaming or self._next > self._last:
+            self._finish()
+            return
+
+        self.setProgress(float(self._bytes) / expected)
+        self.schedule(0, self._readChunk)
+
+    def _readSectors(self, first, count):
+        # sectors outside of the disc read as silence, like with cdparanoia
+        chunks = []
+        lsn = first
+        end = first + count
+        if lsn < 0:
+            silent = min(-lsn, count)
+            chunks.append('\0' * (silent * common.BYTES_PER_FRAME))
+            self._addReads(lsn, lsn + silent - 1, 1)
+            lsn += silent
+
+        inside = min(end, self._table.leadout) - lsn
+        if inside > 0:
+            try:
+                chunks.append(self._readDevice(lsn, inside))
+                self._addReads(lsn, lsn + inside - 1, 1)
+            except IOError, e:
+                self.debug('could not read %d sectors from %d: %r; '
+                    'reading them one by one', inside, lsn, e)
+                for sector in range(lsn, lsn + inside):
+                    chunks.append(self._readSector(sector))
+            lsn += inside
+
+        if lsn < end:
+            chunks.append('\0' * ((end - lsn) * common.BYTES_PER_FRAME))
+            self._addReads(lsn, end - 1, 1)
+
+        return "".join(chunks)
+
+    def _readSector(self, lsn):
+        reads = 0
+        while True:
+            reads += 1
+            try:
+                data = self._readDevice(lsn, 1)
+                break
+            except IOError, e:
+                if reads > self._MAXRETRIES:
+                    raise
+                self.retries += 1
+                self.debug('read %d of sector %d failed: %r, retrying',
+                    reads, lsn, e)
+
+        self._addReads(lsn, lsn, reads)
+        return data
+
+    def _addReads(self, first, last, reads):
+        # count the reads of the sectors for the frames of the track whose
+        # audio starts in them
+        first = max(first - self._shift, self._readStart)
+        last = min(last - self._shift, self._stop)
+        if first > last:
+            return
+
+        if self._runs and self._runs[-1][2] == reads:
+            self._runs[-1][1] = last
+        else:
+            self._runs.append([first, last, reads])
+
+    def _finish(self):
+        end_time = time.time()
+        self._streaming = False
+        if self._cd:
+            self._close()
+            self._cd = None
+
+        self.setProgress(1.0)
+        self._finishAccumulators()
+        if self.exception:
+            self.debug('read stopped: %r', self.exception)
+            self.stop()
+            return
+
+        self.readMap = [tuple(run) for run in self._runs]
+        self.quality = getReadMapQuality(self.readMap)
+        self.duration = end_time - self._start_time
+        self.speed = ((self._stop - self._readStart + 1) / 75.0) / \
+            self.duration
+
+        self.stop()
+
+
+READERS = {
+    'cdparanoia': ReadTrackTask,
+    'cdio': CdioReadTrackTask,
+}
+
+
+def getFrameRanges(frames, gap=0):
+    """
+    Group frames into ranges of consecutive frames.
+
+    @param frames: the frames, in order
+    @type  frames: list of int
+    @param gap:    how many frames can be between two frames of a range
+    @type  gap:    int
+
+    @returns: the first and last frame (inclusive) of each range
+    @rtype:   list of (int, int)
+    """
+    ranges = []
+    for frame in frames:
+        if ranges and frame - ranges[-1][1] - 1 <= gap:
+            ranges[-1][1] = frame
+        else:
+            ranges.append([frame, frame])
+
+    return [tuple(r) for r in ranges]
+
+
+class RepairTask(log.Loggable, task.Task):
+    """
+    I settle frames on which the test and copy reads of a track disagree
+    by majority vote over the test read, the copy read and re-reads of
+    those frames, and write the winners into the copy's .wav file.
+
+    @ivar frames:   the frames that were settled, counting from the start
+                    of the track
+    @type frames:   list of int
+    @ivar repaired: the frames of the copy that were replaced
+    @type repaired: list of int
+    """
+
+    logCategory = 'RepairTask'
+    description = 'Repairing track'
+
+    def __init__(self, path, start, testChecksums, copyChecksums, frames,
+            reads, accumulators):
+        """
+        @param path:          the .wav file of the copy read
+        @type  path:          unicode
+        @param start:         the first frame of the track
+        @type  start:         int
+        @param testChecksums: the CRC32 of each frame of the test read
+        @type  testChecksums: list of int
+        @param copyChecksums: the CRC32 of each frame of the copy read
+        @type  copyChecksums: list of int
+        @param frames:        the frames to settle, counting from the start
+                              of the track
+        @type  frames:        list of int
+        @param reads:         the first frame of each re-read, and what
+                              it read
+        @type  reads:         list of (int, L{analysis.BufferAccumulator})
+        @param accumulators:  what to feed the repaired track to
+        @type  accumulators:  list of L{analysis.Accumulator}
+        """
+        self._path = path
+        self._start = start
+        self._testChecksums = testChecksums
+        self._copyChecksums = copyChecksums
+        self._reads = reads
+        self._accumulators = accumulators
+        self.frames = frames
+        self.repaired = []
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+
+        try:
+            self._repair()
+            self._analyze()
+        except Exception, e:
+            self.debug('could not repair: %r', e)
+            self.setException(e)
+
+        self.stop()
+
+    def _repair(self):
+        wavFile = wav.WAVFile(self._path)
+        wavFile.open()
+        patches = []
+        try:
+            for frame in self.frames:
+                data = self._vote(frame, wavFile)
+                if data is not None:
+                    patches.append((frame, data))
+        finally:
+            wavFile.close()
+
+        handle = open(self._path, 'r+b')
+        try:
+            for frame, data in patches:
+                self.debug('replacing frame %d', self._start + frame)
+                handle.seek(wavFile.dataOffset +
+                    frame * common.BYTES_PER_FRAME)
+                handle.write(data)
+                self.repaired.append(frame)
+        finally:
+            handle.close()
+
+    def _vote(self, frame, wavFile):
+        # returns the frame to write, or None if the copy won
+        copy = self._copyChecksums[frame]
+        votes = {} # checksum -> frames read with it, or None for the test
+        votes[self._testChecksums[frame]] = [None, ]
+        votes.setdefault(copy, []).append(wavFile.read(
+            frame * common.SAMPLES_PER_FRAME, common.SAMPLES_PER_FRAME))
+
+        absolute = self._start + frame
+        count = 2
+        for first, buf in self._reads:
+            offset = (absolute - first) * common.BYTES_PER_FRAME
+            if offset < 0 or offset >= len(buf.data):
+                continue
+            data = buf.data[offset:offset + common.BYTES_PER_FRAME]
+            votes.setdefault(zlib.crc32(data) % 2 ** 32, []).append(data)
+            count += 1
+
+        winner = max(votes.keys(), key=lambda c: len(votes[c]))
+        self.debug('frame %d: %d of %d reads agree', absolute,
+            len(votes[winner]), count)
+        if len(votes[winner]) * 2 <= count:
+            raise ChecksumException(
+                'could not settle frame %d: %d of %d reads agree' % (
+                    absolute, len(votes[winner]), count))
+
+        if winner == copy:
+            return None
+
+        return [d for d in votes[winner] if d is not None][0]
+
+    def _analyze(self):
+        wavFile = wav.WAVFile(self._path)
+        wavFile.open()
+        try:
+            for accumulator in self._accumulators:
+                accumulator.setLength(wavFile.samples)
+            for sample in range(0, wavFile.samples, common.SAMPLES_PER_FRAME
+                    * common.FRAMES_PER_SECOND):
+                buf = wavFile.read(sample,
+                    common.SAMPLES_PER_FRAME * common.FRAMES_PER_SECOND)
+                for accumulator in self._accumulators:
+                    accumulator.update(buf)
+            for accumulator in self._accumulators:
+                accumulator.finish()
+        finally:
+            wavFile.close()
+
+
+class ReadJournal(log.Loggable):
+    """
+    I keep track of how many frames the reads of a track fed to their
+    partial .wav files, so that a rip that got interrupted can continue
+    where it stopped instead of reading the track again.
+
+    I forget everything when the track gets read differently.
+    """
+
+    logCategory = 'ReadJournal'
+
+    _INTERVAL = 5.0 # seconds between saves
+
+    def __init__(self, path, start, stop, offset):
+        """
+        @param path:   where to keep the journal
+        @type  path:   unicode
+        @param start:  first frame of the track
+        @type  start:  int
+        @param stop:   last frame of the track (inclusive)
+        @type  stop:   int
+        @param offset: read offset, in samples
+        @type  offset: int
+        """
+        self._persister = cache.Persister(path)
+        self._saved = time.time()
+
+        key = (start, stop, offset)
+        # a copy, so that the persister sees when it changed
+        self._frames = dict(self._persister.object or {})
+        if self._frames.get('key') != key:
+            self._frames = {'key': key}
+
+    def getFrames(self, name, path):
+        """
+        @param name: the read, for example 'test' or 'copy'
+        @param path: the partial .wav file of the read
+
+        @returns: how many frames at the start of the file can be kept
+        @rtype:   int
+        """
+        frames = self._frames.get(name, 0)
+        if not frames or not os.path.exists(path):
+            return 0
+
+        try:
+            samples = wav.WAVFile(path).samples
+        except wav.WAVError, e:
+            self.debug('Cannot resume from %r: %r', path, e)
+            return 0
+
+        return min(frames, samples / common.SAMPLES_PER_FRAME)
+
+    def setFrames(self, name, frames):
+        """
+        Note how many frames the given read fed to its partial file.
+        """
+        self._frames[name] = frames
+        if time.time() - self._saved >= self._INTERVAL:
+            self.save()
+
+    def save(self):
+        self._persister.persist(dict(self._frames))
+        self._saved = time.time()
+
+    def delete(self):
+        if self._persister.object:
+            self._persister.delete()
+
+
+class _JournalAccumulator(analysis.Accumulator):
+    # notes the frames fed to a read's partial file in a ReadJournal
+
+    def __init__(self, journal, name):
+        self._journal = journal
+        self._name = name
+        self._samples = 0
+
+    def update(self, buf):
+        self._samples += len(buf) / 4
+        self._journal.setFrames(self._name,
+            self._samples / common.SAMPLES_PER_FRAME)
+
+    def finish(self):
+        self._journal.save()
+
 
 class ReadVerifyTrackTask(log.Loggable, task.MultiSeparateTask):
     """
     I am a task that reads and verifies a track using cdparanoia.
     I also encode the track.
 
+    When only a few frames of the test and copy reads differ, I re-read
+    just those frames and settle them by majority vote instead of failing.
+
+    Given AccurateRip checksums to trust, I skip the copy read when the
+    test read matches one of them.
+
+    When resumable, I keep the test and copy reads in partial .wav files
+    next to the path, with a L{ReadJournal}, until the track is done; if
+    the rip gets interrupted, the next one only reads the frames that are
+    missing.
+
     The path where the file is stored can be changed if necessary, for
     example if the file name is too long.
 
@@ -406,24 +1118,48 @@ class ReadVerifyTrackTask(log.Loggable, task.MultiSeparateTask):
                         track duration.
     @ivar testduration: the test duration of the track, in seconds.
     @ivar copyduration: the copy duration of the track, in seconds.
+    @ivar testreadmap:  how many times each frame was read for the test.
+    @ivar copyreadmap:  how many times each frame was read for the copy.
+    @ivar repairedframes: how many frames had to be settled by re-reading
     @ivar peak:         the peak level of the track
+    @ivar archecksum:   the AccurateRip v1 checksum of the track;
+                        only set when the track number is given.
+    @ivar archecksumV2: the AccurateRip v2 checksum of the track;
+                        only set when the track number is given.
+    @ivar copyskipped:  whether the copy read was skipped because the test
+                        read matched AccurateRip
     """
 
     checksum = None
     testchecksum = None
     copychecksum = None
+    archecksum = None
+    archecksumV2 = None
     peak = None
     quality = None
     testspeed = None
     copyspeed = None
     testduration = None
     copyduration = None
+    testreadmap = None
+    copyreadmap = None
+    repairedframes = 0
+    copyskipped = False
 
     _tmpwavpath = None
+    _testwavpath = None
     _tmppath = None
+    _journal = None
+    _repairtask = None
+
+    REPAIR_FRAMES = common.FRAMES_PER_SECOND * 10 # how many we can repair
+    REPAIR_READS = 3 # how many times to re-read frames to repair
+    REPAIR_GAP = common.FRAMES_PER_SECOND # good frames to re-read in between
 
     def __init__(self, path, table, start, stop, offset=0, device=None,
-                 profile=None, taglist=None, what="track"):
+                 profile=None, taglist=None, what="track", trackNumber=None,
+                 trackCount=None, accurateRipChecksums=None, scratch=None,
+                 encodeSlots=None, resumable=False, reader=None):
         """
         @param path:    where to store the ripped track
         @type  path:    str
@@ -441,46 +1177,134 @@ class ReadVerifyTrackTask(log.Loggable, task.MultiSeparateTask):
         @type  profile: L{encode.Profile}
         @param taglist: a list of tags
         @param taglist: L{gst.TagList}
+        @param trackNumber: the track number, to also calculate the
+                            AccurateRip checksums of the track
+        @type  trackNumber: int
+        @param trackCount:  the number of tracks, for AccurateRip
+        @type  trackCount:  int
+        @param accurateRipChecksums: AccurateRip checksums that make the
+                                     copy read unnecessary when the test
+                                     read matches one of them; needs the
+                                     track number
+        @type  accurateRipChecksums: list of int
+        @param scratch: where to put the temporary files
+        @type  scratch: L{cscratch.ScratchSpace}
+        @param encodeSlots: slots to take one of before encoding
+        @type  encodeSlots: L{slots.SlotPool}
+        @param resumable: whether to keep partial reads, to continue an
+                          interrupted rip
+        @type  resumable: bool
+        @param reader:  the task class to read with, L{ReadTrackTask} if
+                        not given; see L{READERS}
+        @type  reader:  type
         """
         task.MultiSeparateTask.__init__(self)
 
         self.debug('Creating read and verify task on %r', path)
         self.path = path
+        self._table = table
+        self._start = start
+        self._offset = offset
+        self._device = device
+        self._what = what
+        self._trackNumber = trackNumber
+        self._trackCount = trackCount
+        self._reader = reader or ReadTrackTask
 
         if taglist:
             self.debug('read and verify with taglist %r', taglist)
-        # FIXME: choose a dir on the same disk/dir as the final path
-        fd, tmppath = tempfile.mkstemp(suffix='.morituri.wav')
-        tmppath = unicode(tmppath)
-        os.close(fd)
+        if not scratch:
+            scratch = cscratch.ScratchSpace()
+        frames = stop - start + 1
+        testresume = 0
+        copyresume = 0
+        if resumable:
+            tmppath = scratch.getPartialPath(path, u'copy.wav')
+            self._testwavpath = scratch.getPartialPath(path, u'test.wav')
+            self._journal = ReadJournal(
+                scratch.getPartialPath(path, u'journal'), start, stop, offset)
+            testresume = self._journal.getFrames('test', self._testwavpath)
+            # the copy read is compared to all of the test read
+            if testresume == frames:
+                copyresume = self._journal.getFrames('copy', tmppath)
+            # always read the last frame, so the reads end as usual
+            testresume = min(testresume, frames - 1)
+            copyresume = min(copyresume, frames - 1)
+            if testresume or copyresume:
+                self.info('Resuming test read after %d frames, copy read '
+                    'after %d frames', testresume, copyresume)
+        else:
+            tmppath = scratch.getWAVPath(frames * common.BYTES_PER_FRAME,
+                path)
         self._tmpwavpath = tmppath
 
         # here to avoid import gst eating our options
         from morituri.common import checksum
 
-        self.tasks = []
-        self.tasks.append(
-            ReadTrackTask(tmppath, table, start, stop,
-                offset=offset, device=device, what=what))
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        t = ReadTrackTask(tmppath, table, start, stop,
-            offset=offset, device=device, action="Verifying", what=what)
-        self.tasks.append(t)
-        self.tasks.append(checksum.CRC32Task(tmppath))
-
-        fd, tmpoutpath = tempfile.mkstemp(suffix='.morituri.%s' %
-            profile.extension)
-        tmpoutpath = unicode(tmpoutpath)
-        os.close(fd)
+        # checksum the audio while cdparanoia reads it; the test read
+        # does not need to be stored at all, unless it can turn out to be
+        # accurate enough to skip the copy read
+        self._testcrc = analysis.CRC32Accumulator()
+        self._testframes = analysis.BlockCRC32Accumulator(
+            common.SAMPLES_PER_FRAME)
+        accumulators = [self._testcrc, self._testframes]
+        testpath = None
+        self._accurateRipChecksums = None
+        self._testarcs = None
+        if accurateRipChecksums and trackNumber:
+            self._accurateRipChecksums = accurateRipChecksums
+            self._testarcs = analysis.AccurateRipAccumulator(trackNumber,
+                trackCount)
+            accumulators.append(self._testarcs)
+            testpath = tmppath
+        if self._journal:
+            testpath = self._testwavpath
+            accumulators.append(_JournalAccumulator(self._journal, 'test'))
+        self._readtask = self._reader(testpath, table, start, stop,
+            offset=offset, device=device, what=what,
+            accumulators=accumulators, resumeFrames=testresume)
+        self.tasks = [self._readtask, ]
+
+        # stop the copy read as soon as it differs from the test read in
+        # more frames than we can repair, so we never encode a track whose
+        # reads disagree; and calculate the AccurateRip checksums from it
+        self._compare = analysis.BlockCompareAccumulator(self._testframes,
+            maxMismatches=self.REPAIR_FRAMES)
+        self._copycrc = analysis.CRC32Accumulator()
+        accumulators = [self._compare, self._copycrc]
+        self._arcs = None
+        if trackNumber:
+            self._arcs = analysis.AccurateRipAccumulator(trackNumber,
+                trackCount)
+            accumulators.append(self._arcs)
+        if self._journal:
+            accumulators.append(_JournalAccumulator(self._journal, 'copy'))
+        self._verifytask = self._reader(tmppath, table, start, stop,
+            offset=offset, device=device, action="Verifying", what=what,
+            accumulators=accumulators, resumeFrames=copyresume)
+        self.tasks.append(self._verifytask)
+
+        # encode next to the final path, so that storing it is a rename
+        tmpoutpath = scratch.getStagingPath(path, profile.extension)
         self._tmppath = tmpoutpath
 
         # here to avoid import gst eating our options
         from morituri.common import encode
 
-        self.tasks.append(encode.EncodeTask(tmppath, tmpoutpath, profile,
-            taglist=taglist, what=what))
+        self._slottask = None
+        if encodeSlots:
+            self._slottask = slots.AcquireSlotTask(encodeSlots,
+                'Waiting to encode %s' % what)
+            self.tasks.append(self._slottask)
+
+        self._encodetask = encode.EncodeTask(tmppath, tmpoutpath, profile,
+            taglist=taglist, what=what)
+        self.tasks.append(self._encodetask)
         # make sure our encoding is accurate
-        self.tasks.append(checksum.CRC32Task(tmpoutpath))
+        self._crc = analysis.CRC32Accumulator()
+        t = checksum.AnalysisTask(tmpoutpath, [self._crc, ])
+        t.useCache = False
+        self.tasks.append(t)
 
         self.checksum = None
 
@@ -488,33 +1312,117 @@ class ReadVerifyTrackTask(log.Loggable, task.MultiSeparateTask):
         os.umask(umask)
         self.file_mode = 0666 - umask
 
+    def stopped(self, taskk):
+        if taskk is self._readtask and not taskk.exception and \
+            self._testarcs:
+            for c in [self._testarcs.checksum, self._testarcs.checksumV2]:
+                if c in self._accurateRipChecksums:
+                    self.info('Test read matches AccurateRip checksum %08x, '
+                        'skipping copy read', c)
+                    self.tasks.remove(self._verifytask)
+                    self.copyskipped = True
+                    if self._testwavpath:
+                        shutil.move(self._testwavpath, self._tmpwavpath)
+                    break
+
+        if taskk is self._verifytask and not taskk.exception and \
+            self._compare.mismatches:
+            self._addRepairTasks()
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+    def _addRepairTasks(self):
+        # re-read the frames that differ, and settle them before encoding
+        frames = self._compare.mismatches
+        ranges = getFrameRanges([self._start + f for f in frames],
+            gap=self.REPAIR_GAP)
+        self.info('Reads differ in %d frames, re-reading %r',
+            len(frames), ranges)
+
+        tasks = []
+        reads = []
+        for i in range(self.REPAIR_READS):
+            for first, last in ranges:
+                buf = analysis.BufferAccumulator()
+                reads.append((first, buf))
+                tasks.append(self._reader(None, self._table, first, last,
+                    offset=self._offset, device=self._device,
+                    action="Re-reading", what=self._what,
+                    accumulators=[buf, ]))
+
+        # the checksums of the copy read change with the repair
+        self._copycrc = analysis.CRC32Accumulator()
+        accumulators = [self._copycrc, ]
+        if self._arcs:
+            self._arcs = analysis.AccurateRipAccumulator(self._trackNumber,
+                self._trackCount)
+            accumulators.append(self._arcs)
+
+        self._repairtask = RepairTask(self._tmpwavpath, self._start,
+            self._testframes.checksums, self._compare.checksums, frames,
+            reads, accumulators)
+        tasks.append(self._repairtask)
+
+        # insert them right after the copy read
+        self.tasks[self._task:self._task] = tasks
+
+    def _stopCopy(self):
+        self.quality = max(self._readtask.quality,
+            self._verifytask.quality)
+        self.copyspeed = self._verifytask.speed
+        self.copyduration = self._verifytask.duration
+        self.copyreadmap = self._verifytask.readMap
+
+        self.copychecksum = c2 = self._copycrc.checksum
+        c1 = self.testchecksum
+        if self._repairtask:
+            self.repairedframes = len(self._repairtask.frames)
+        if c1 == c2:
+            self.info('Checksums match, %08x' % c1)
+            self.checksum = self.testchecksum
+        elif self._repairtask:
+            self.info('Checksums do not match, %08x %08x, but '
+                'settled %d frames by re-reading, replacing %d' % (
+                c1, c2, self.repairedframes,
+                len(self._repairtask.repaired)))
+            self.checksum = self.copychecksum
+        else:
+            self.info('Checksums do not match, %08x %08x' % (
+                c1, c2))
+            self.exception = ChecksumException(
+                'read and verify failed: test checksum')
+
+        if self._arcs:
+            self.archecksum = self._arcs.checksum
+            self.archecksumV2 = self._arcs.checksumV2
+
     def stop(self):
+        if self._slottask and self._slottask.slot:
+            self._slottask.slot.release()
+
         # FIXME: maybe this kind of try-wrapping to make sure
         # we chain up should be handled by a parent class function ?
         try:
             if not self.exception:
-                self.quality = max(self.tasks[0].quality,
-                    self.tasks[2].quality)
-                self.peak = self.tasks[4].peak
+                self.peak = self._encodetask.peak
                 self.debug('peak: %r', self.peak)
-                self.testspeed = self.tasks[0].speed
-                self.copyspeed = self.tasks[2].speed
-                self.testduration = self.tasks[0].duration
-                self.copyduration = self.tasks[2].duration
-
-                self.testchecksum = c1 = self.tasks[1].checksum
-                self.copychecksum = c2 = self.tasks[3].checksum
-                if c1 == c2:
-                    self.info('Checksums match, %08x' % c1)
+                self.testspeed = self._readtask.speed
+                self.testduration = self._readtask.duration
+                self.testreadmap = self._readtask.readMap
+                self.testchecksum = self._testcrc.checksum
+
+                if self.copyskipped:
+                    # the test read got stored instead
+                    self.quality = self._readtask.quality
+                    self.copyspeed = 0.0
+                    self.copyduration = 0.0
                     self.checksum = self.testchecksum
+                    self.archecksum = self._testarcs.checksum
+                    self.archecksumV2 = self._testarcs.checksumV2
                 else:
-                    # FIXME: detect this before encoding
-                    self.info('Checksums do not match, %08x %08x' % (
-                        c1, c2))
-                    self.exception = ChecksumException(
-                        'read and verify failed: test checksum')
+                    self._stopCopy()
 
-                if self.tasks[5].checksum != self.checksum:
+                if self._crc.checksum != self.checksum:
                     self.exception = ChecksumException(
                         'Encoding failed, checksum does not match')
 
@@ -540,11 +1448,398 @@ class ReadVerifyTrackTask(log.Loggable, task.MultiSeparateTask):
                     os.unlink(self._tmppath)
             else:
                 self.debug('stop: exception %r', self.exception)
+                if isinstance(self.exception, analysis.MismatchError):
+                    self.testchecksum = self._testcrc.checksum
+                    self.info('Copy read differs from test read in too '
+                        'many frames, from frame %d',
+                        self._start + self.exception.block)
+                    self.exception = ChecksumException(
+                        'read and verify failed: test checksum')
+
+                for path in [self._tmpwavpath, self._tmppath]:
+                    if os.path.exists(path):
+                        os.unlink(path)
+        except Exception, e:
+            print 'WARNING: unhandled exception %r' % (e, )
+
+        # the track is done with, so there is nothing left to resume
+        if self._testwavpath and os.path.exists(self._testwavpath):
+            os.unlink(self._testwavpath)
+        if self._journal:
+            self._journal.delete()
+
+        task.MultiSeparateTask.stop(self)
+
+
+def getReadMapSlice(readMap, start, stop):
+    """
+    Get the part of a read map for the given frames.
+
+    @param readMap: runs of (first frame, last frame (inclusive), reads)
+    @type  readMap: list of (int, int, int)
+    @param start:   first frame to get
+    @type  start:   int
+    @param stop:    last frame to get (inclusive)
+    @type  stop:    int
+
+    @rtype: list of (int, int, int)
+    """
+    return [(max(first, start), min(last, stop), reads)
+        for first, last, reads in readMap
+            if last >= start and first <= stop]
+
+
+def getReadMapQuality(readMap):
+    """
+    Get the rip quality of the frames in a read map, the way
+    L{ProgressParser.getTrackQuality} does.
+
+    @type  readMap: list of (int, int, int)
+
+    @rtype: float
+    """
+    frames = 0
+    total = 0
+    for first, last, reads in readMap:
+        frames += last - first + 1
+        total += (last - first + 1) * reads
+
+    if not total:
+        return 0.0
+
+    return min(frames * 2.0 / total, 1.0)
+
+
+class DiscTrack:
+    """
+    I am a track to read with L{ReadVerifyDiscTask}, and I hold what was
+    read for it.
+
+    @ivar path:         the path where the file is to be stored; can be
+                        changed if the file name is too long.
+    @ivar start:        first frame of the track
+    @ivar stop:         last frame of the track (inclusive)
+    @ivar taglist:      the tags for the encoded file
+    @ivar trackNumber:  the track number, to also calculate the AccurateRip
+                        checksums of the track; or None
+    @ivar exception:    set if the track could not be read, verified or
+                        encoded
+    @ivar checksum:     the checksum of the track; set if they match.
+    @ivar testchecksum: the test checksum of the track.
+    @ivar copychecksum: the copy checksum of the track.
+    @ivar archecksum:   the AccurateRip v1 checksum of the track
+    @ivar archecksumV2: the AccurateRip v2 checksum of the track
+    @ivar peak:         the peak level of the track
+    @ivar quality:      the rip quality of the track
+    @ivar testreadmap:  how many times each frame was read for the test.
+    @ivar copyreadmap:  how many times each frame was read for the copy.
+    @ivar accurateRipChecksums: AccurateRip checksums the track has to
+                                match when burst reading
+    @ivar copyskipped:  whether the track was stored from a burst read that
+                        matched AccurateRip
+    """
+
+    exception = None
+    checksum = None
+    testchecksum = None
+    copychecksum = None
+    archecksum = None
+    archecksumV2 = None
+    peak = None
+    quality = None
+    testreadmap = None
+    copyreadmap = None
+    copyskipped = False
+
+    def __init__(self, path, start, stop, taglist=None, trackNumber=None,
+            accurateRipChecksums=None):
+        assert type(path) is unicode, "%r is not unicode" % path
+
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.taglist = taglist
+        self.trackNumber = trackNumber
+        self.accurateRipChecksums = accurateRipChecksums
+
+
+class ReadVerifyDiscTask(log.Loggable, task.MultiSeparateTask):
+    """
+    I am a task that reads and verifies consecutive tracks, like
+    L{ReadVerifyTrackTask}, but with one cdparanoia read over all of them
+    for the test and one for the copy, so that the drive does not have to
+    seek and spin up again for each track.
+    I split the audio on track boundaries while reading, and encode the
+    tracks afterwards.
+
+    A track that fails to verify or encode gets its exception set; the
+    other tracks are still stored.
+
+    In burst mode I only do one read, without paranoia, and only store the
+    tracks that match one of their AccurateRip checksums; the others are
+    left to be ripped again securely.
+
+    @ivar tracks:       the tracks to read
+    @type tracks:       list of L{DiscTrack}
+    @ivar testspeed:    the test speed, as a multiple of the duration.
+    @ivar copyspeed:    the copy speed, as a multiple of the duration.
+    @ivar testduration: the test duration of all tracks, in seconds.
+    @ivar copyduration: the copy duration of all tracks, in seconds.
+    """
+
+    testspeed = None
+    copyspeed = None
+    testduration = None
+    copyduration = None
+
+    def __init__(self, tracks, table, offset=0, device=None, profile=None,
+            what="tracks", trackCount=None, burst=False, scratch=None,
+            encodeSlots=None, reader=None):
+        """
+        @param tracks:  the consecutive tracks to read
+        @type  tracks:  list of L{DiscTrack}
+        @param table:   table of contents of CD
+        @type  table:   L{table.Table}
+        @param offset:  read offset, in samples
+        @type  offset:  int
+        @param device:  the device to rip from
+        @type  device:  str
+        @param profile: the encoding profile
+        @type  profile: L{encode.Profile}
+        @param what:    a string representing what's being read
+        @type  what:    str
+        @param trackCount: the number of tracks, for AccurateRip
+        @type  trackCount: int
+        @param burst:   whether to do a single read without paranoia, and
+                        verify it against the tracks' AccurateRip checksums
+        @type  burst:   bool
+        @param scratch: where to put the temporary files
+        @type  scratch: L{cscratch.ScratchSpace}
+        @param encodeSlots: slots to take one of before encoding
+        @type  encodeSlots: L{slots.SlotPool}
+        @param reader:  the task class to read with, L{ReadTrackTask} if
+                        not given; see L{READERS}
+        @type  reader:  type
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        for previous, track in zip(tracks[:-1], tracks[1:]):
+            assert track.start == previous.stop + 1, \
+                "tracks %r and %r are not consecutive" % (previous, track)
+
+        self.tracks = tracks
+        self._burst = burst
+        if not scratch:
+            scratch = cscratch.ScratchSpace()
+        self._tmpwavpaths = []
+        self._tmppaths = []
+
+        # here to avoid import gst eating our options
+        from morituri.common import checksum, encode
+
+        testsegments = []
+        copysegments = []
+        self._testcrcs = []
+        self._copycrcs = []
+        self._arcs = []
+        for track in tracks:
+            length = (track.stop - track.start + 1) * common.SAMPLES_PER_FRAME
+
+            crc = analysis.CRC32Accumulator()
+            self._testcrcs.append(crc)
+            testsegments.append((length, [crc, ]))
+
+            tmppath = scratch.getWAVPath(length * 4, track.path)
+            self._tmpwavpaths.append(tmppath)
+
+            crc = analysis.CRC32Accumulator()
+            self._copycrcs.append(crc)
+            accumulators = [crc, wav.WAVWriter(tmppath)]
+            arcs = None
+            if track.trackNumber:
+                arcs = analysis.AccurateRipAccumulator(track.trackNumber,
+                    trackCount)
+                accumulators.append(arcs)
+            self._arcs.append(arcs)
+            copysegments.append((length, accumulators))
+
+        start = tracks[0].start
+        stop = tracks[-1].stop
+        reader = reader or ReadTrackTask
+        if burst:
+            # the one read is the copy
+            self._readtask = reader(None, table, start, stop,
+                offset=offset, device=device, action="Burst reading",
+                what=what, paranoia=False,
+                accumulators=[analysis.SplitAccumulator(copysegments), ])
+            self._verifytask = None
+            self.tasks = [self._readtask, ]
+        else:
+            self._readtask = reader(None, table, start, stop,
+                offset=offset, device=device, what=what,
+                accumulators=[analysis.SplitAccumulator(testsegments), ])
+            self._verifytask = reader(None, table, start, stop,
+                offset=offset, device=device, action="Verifying", what=what,
+                accumulators=[analysis.SplitAccumulator(copysegments), ])
+            self.tasks = [self._readtask, self._verifytask]
+
+        self._slottask = None
+        if encodeSlots:
+            self._slottask = slots.AcquireSlotTask(encodeSlots,
+                'Waiting to encode %s' % what)
+            self.tasks.append(self._slottask)
+
+        # make sure our encodings are accurate
+        self._encodetasks = []
+        self._analysistasks = []
+        self._crcs = []
+        for track, tmppath in zip(tracks, self._tmpwavpaths):
+            tmpoutpath = scratch.getStagingPath(track.path,
+                profile.extension)
+            self._tmppaths.append(tmpoutpath)
+
+            t = encode.EncodeTask(tmppath, tmpoutpath, profile,
+                taglist=track.taglist, what=what)
+            self._encodetasks.append(t)
+            self.tasks.append(t)
+
+            crc = analysis.CRC32Accumulator()
+            self._crcs.append(crc)
+            t = checksum.AnalysisTask(tmpoutpath, [crc, ])
+            t.useCache = False
+            self._analysistasks.append(t)
+            self.tasks.append(t)
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self.file_mode = 0666 - umask
+
+    def stopped(self, taskk):
+        # never encode tracks whose reads disagree, or whose burst read
+        # does not match AccurateRip
+        if self._burst and taskk is self._readtask and not taskk.exception:
+            for i, track in enumerate(self.tracks):
+                if not self._matchesAccurateRip(i, track):
+                    self.debug('No AccurateRip match, not encoding %r',
+                        track.path)
+                    self.tasks.remove(self._encodetasks[i])
+                    self.tasks.remove(self._analysistasks[i])
+        elif taskk is self._verifytask and not taskk.exception:
+            for i, track in enumerate(self.tracks):
+                if self._testcrcs[i].checksum != self._copycrcs[i].checksum:
+                    self.debug('Reads differ, not encoding %r', track.path)
+                    self.tasks.remove(self._encodetasks[i])
+                    self.tasks.remove(self._analysistasks[i])
+
+        task.MultiSeparateTask.stopped(self, taskk)
+
+    def _matchesAccurateRip(self, i, track):
+        arcs = self._arcs[i]
+        if not arcs or not track.accurateRipChecksums:
+            return False
+
+        for c in [arcs.checksum, arcs.checksumV2]:
+            if c in track.accurateRipChecksums:
+                return True
+
+        return False
+
+    def stop(self):
+        if self._slottask and self._slottask.slot:
+            self._slottask.slot.release()
+
+        try:
+            if not self.exception:
+                self.testspeed = self._readtask.speed
+                self.testduration = self._readtask.duration
+                if self._verifytask:
+                    self.copyspeed = self._verifytask.speed
+                    self.copyduration = self._verifytask.duration
+                else:
+                    self.copyspeed = 0.0
+                    self.copyduration = 0.0
+
+                for i, track in enumerate(self.tracks):
+                    self._stopTrack(i, track)
+            else:
+                self.debug('stop: exception %r', self.exception)
         except Exception, e:
             print 'WARNING: unhandled exception %r' % (e, )
 
+        for path in self._tmpwavpaths + self._tmppaths:
+            if os.path.exists(path):
+                os.unlink(path)
+
         task.MultiSeparateTask.stop(self)
 
+    def _stopTrack(self, i, track):
+        track.testreadmap = getReadMapSlice(self._readtask.readMap,
+            track.start, track.stop)
+        track.peak = self._encodetasks[i].peak
+
+        if self._burst:
+            self._stopBurstTrack(i, track)
+        else:
+            self._stopVerifiedTrack(i, track)
+
+        if self._arcs[i]:
+            track.archecksum = self._arcs[i].checksum
+            track.archecksumV2 = self._arcs[i].checksumV2
+
+        if track.exception:
+            return
+
+        if self._crcs[i].checksum != track.checksum:
+            track.exception = ChecksumException(
+                'Encoding failed, checksum does not match')
+            return
+
+        tmppath = self._tmppaths[i]
+        os.chmod(tmppath, self.file_mode)
+        try:
+            self.debug('Moving to final path %r', track.path)
+            shutil.move(tmppath, track.path)
+        except IOError, e:
+            if e.errno != errno.ENAMETOOLONG:
+                track.exception = e
+                return
+            track.path = common.shrinkPath(track.path)
+            shutil.move(tmppath, track.path)
+
+    def _stopBurstTrack(self, i, track):
+        # the burst read got stored as if it were the test read
+        track.quality = getReadMapQuality(track.testreadmap)
+        track.testchecksum = self._copycrcs[i].checksum
+        if self._matchesAccurateRip(i, track):
+            self.info('Burst read matches AccurateRip for %r, %08x',
+                track.path, track.testchecksum)
+            track.checksum = track.testchecksum
+            track.copyskipped = True
+        else:
+            self.info('Burst read does not match AccurateRip for %r',
+                track.path)
+            track.exception = ChecksumException(
+                'burst read did not match AccurateRip')
+
+    def _stopVerifiedTrack(self, i, track):
+        track.copyreadmap = getReadMapSlice(self._verifytask.readMap,
+            track.start, track.stop)
+        track.quality = max(
+            getReadMapQuality(track.testreadmap),
+            getReadMapQuality(track.copyreadmap))
+
+        track.testchecksum = c1 = self._testcrcs[i].checksum
+        track.copychecksum = c2 = self._copycrcs[i].checksum
+        if c1 == c2:
+            self.info('Checksums match for %r, %08x', track.path, c1)
+            track.checksum = c1
+        else:
+            self.info('Checksums do not match for %r, %08x %08x',
+                track.path, c1, c2)
+            track.exception = ChecksumException(
+                'read and verify failed: test checksum')
+
+
 _VERSION_RE = re.compile(
     "^cdparanoia (?P<version>.+) release (?P<release>.+) \(.*\)")
 
@@ -393,6 +393,10 @@ class ReadSessionTask(CDRDAOTask):
         # we should have parsed it from the initial output
         assert self.table.leadout is not None
 
+        # so that asking for the version does not run cdrdao again
+        if self.parser.version:
+            _getVersionGetter().set(self.parser.version)
+
 
 class ReadTableSessionTask(ReadSessionTask):
     """
@@ -430,39 +434,54 @@ class ReadAllSessionsTask(task.MultiSeparateTask):
     """
     I am a base class for tasks that need to read all sessions.
 
-    @ivar table: the index table
-    @type table: L{table.Table}
+    @ivar table:    the index table
+    @type table:    L{table.Table}
+    @ivar sessions: the number of sessions
+    @type sessions: int
+    @ivar version:  the cdrdao version
+    @type version:  str
     """
 
     logCategory = 'ReadAllSessionsTask'
     table = None
+    version = None
     _readClass = None
 
-    def __init__(self, device=None):
+    def __init__(self, device=None, sessions=None):
         """
-        @param device:  the device to rip from
-        @type  device:  str
+        @param device:   the device to rip from
+        @type  device:   str
+        @param sessions: the number of sessions, if already known from an
+                         earlier read of the disc
+        @type  sessions: int
         """
         task.MultiSeparateTask.__init__(self)
 
         self._device = device
+        self.sessions = sessions
 
         self.debug('Starting ReadAllSessionsTask')
-        self.tasks = [DiscInfoTask(device=device), ]
+        if sessions:
+            self.tasks = [self._readClass(session=i + 1, device=device)
+                for i in range(sessions)]
+        else:
+            self.tasks = [DiscInfoTask(device=device), ]
 
     def stopped(self, taskk):
         if not taskk.exception:
-            # After first task, schedule additional ones
-            if taskk == self.tasks[0]:
+            # After disc info, schedule reading the sessions
+            if isinstance(taskk, DiscInfoTask):
+                self.sessions = taskk.sessions
                 for i in range(taskk.sessions):
                     self.tasks.append(self._readClass(session=i + 1,
                         device=self._device))
 
             if self._task == len(self.tasks):
-                self.table = self.tasks[1].table
-                if len(self.tasks) > 2:
-                    for i, t in enumerate(self.tasks[2:]):
-                        self.table.merge(t.table, i + 2)
+                tasks = self.tasks[-self.sessions:]
+                self.version = tasks[0].parser.version
+                self.table = tasks[0].table
+                for i, t in enumerate(tasks[1:]):
+                    self.table.merge(t.table, i + 2)
 
                 assert self.table.leadout is not None
 
@@ -513,10 +532,12 @@ _VERSION_RE = re.compile(
     "^Cdrdao version (?P<version>.+) -")
 
 
-def getCDRDAOVersion():
-    getter = common.VersionGetter('cdrdao',
+def _getVersionGetter():
+    return common.VersionGetter('cdrdao',
         ["cdrdao"],
         _VERSION_RE,
         "%(version)s")
 
-    return getter.get()
+
+def getCDRDAOVersion():
+    return _getVersionGetter().get()
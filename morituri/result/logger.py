@@ -125,8 +125,14 @@ class MorituriLogger(result.Logger):
             lines.append('  Copy CRC %08X' % trackResult.copycrc)
         if trackResult.testcrc is not None:
             lines.append('  Test CRC %08X' % trackResult.testcrc)
-            if trackResult.testcrc == trackResult.copycrc:
+            if trackResult.copySkipped:
+                lines.append('  Copy skipped, test read matched '
+                    'AccurateRip')
+            elif trackResult.testcrc == trackResult.copycrc:
                 lines.append('  Copy OK')
+            elif trackResult.repairedFrames:
+                lines.append('  Copy repaired, %d frames settled by '
+                    're-reading' % trackResult.repairedFrames)
             else:
                 lines.append("  WARNING: CRCs don't match!")
         else:
@@ -134,8 +140,18 @@ class MorituriLogger(result.Logger):
 
 
         if trackResult.accurip:
-            lines.append('  Accurately ripped (confidence %d) [%08X]' % (
-                trackResult.ARDBConfidence, trackResult.ARCRC))
+            if trackResult.ARDBOffset:
+                lines.append('  Accurately ripped (confidence %d) [%08X] '
+                    'with read offset correction %+d' % (
+                        trackResult.ARDBConfidence, trackResult.ARDBCRC,
+                        trackResult.ARDBOffset))
+            elif trackResult.ARDBVersion == 2:
+                lines.append('  Accurately ripped (confidence %d) '
+                    '[%08X] (AccurateRip v2)' % (
+                        trackResult.ARDBConfidence, trackResult.ARCRCV2))
+            else:
+                lines.append('  Accurately ripped (confidence %d) [%08X]' % (
+                    trackResult.ARDBConfidence, trackResult.ARCRC))
         else:
             if trackResult.ARDBCRC:
                 lines.append('  Cannot be verified as accurate '
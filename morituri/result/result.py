@@ -31,6 +31,18 @@ class TrackResult:
     @type testcrc:           int
     @ivar copycrc:           4-byte CRC for the copy read
     @type copycrc:           int
+    @ivar testReadMap:       how many times each frame was read for the
+                             test read, as (first frame, last frame, reads)
+                             runs
+    @type testReadMap:       list of (int, int, int)
+    @ivar copyReadMap:       same for the copy read
+    @type copyReadMap:       list of (int, int, int)
+    @ivar repairedFrames:    how many frames on which the test and copy
+                             read differed were settled by re-reading them
+    @type repairedFrames:    int
+    @ivar copySkipped:       whether the copy read was skipped because the
+                             test read matched AccurateRip
+    @type copySkipped:       bool
 
     @var  accurip:           whether this track's AR CRC was found in the
                              database, and thus whether the track is considered
@@ -42,6 +54,9 @@ class TrackResult:
     @var  ARCRC:             our calculated 4 byte AccurateRip CRC for this
                              track.
     @type ARCRC:             int
+    @var  ARCRCV2:           our calculated 4 byte AccurateRip v2 CRC for
+                             this track.
+    @type ARCRCV2:           int
 
     @var  ARDBCRC:           the 4-byte AccurateRip CRC this
                              track did or should have matched in the database.
@@ -53,6 +68,13 @@ class TrackResult:
     @var  ARDBMaxConfidence: maximum confidence in the AccurateRip database for
                              this track; can still be 0.
                              If None, the track is not in the database.
+    @var  ARDBVersion:       the version (1 or 2) of the AccurateRip CRC
+                             that matched the database.
+                             If None, the track did not match.
+    @var  ARDBOffset:        the read offset correction in samples with
+                             which the track matched the database, when it
+                             only matched shifted.
+                             If None, the track was not shifted.
     """
     number = None
     filename = None
@@ -66,13 +88,20 @@ class TrackResult:
     copyduration = 0.0
     testcrc = None
     copycrc = None
+    testReadMap = None
+    copyReadMap = None
+    repairedFrames = 0
+    copySkipped = False
     accurip = False # whether it's in the database
     ARCRC = None
+    ARCRCV2 = None
     ARDBCRC = None
     ARDBConfidence = None
     ARDBMaxConfidence = None
+    ARDBVersion = None
+    ARDBOffset = None
 
-    classVersion = 3
+    classVersion = 8
 
 
 class RipResult:
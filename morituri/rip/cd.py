@@ -21,7 +21,9 @@
 # along with morituri.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import math
+import time
 import glob
 import urllib2
 import socket
@@ -30,7 +32,8 @@ import gobject
 gobject.threads_init()
 
 from morituri.common import logcommand, common, accurip, gstreamer
-from morituri.common import drive, program, task
+from morituri.common import directory, drive, program, scratch, slots, task
+from morituri.common import tocreader
 from morituri.result import result
 from morituri.program import cdrdao, cdparanoia
 from morituri.rip import common as rcommon
@@ -40,15 +43,23 @@ from morituri.extern.command import command
 
 MAX_TRIES = 5
 
+# written at the end of rip cd rip, and read back by rip farm
+_RIPPED_TEMPLATE = 'Ripped %d seconds of audio in %d seconds\n'
+RIPPED_RE = re.compile(
+    r'^Ripped (?P<audio>\d+) seconds of audio in (?P<duration>\d+) seconds$')
+
 
 class _CD(logcommand.LogCommand):
 
     """
     @type program: L{program.Program}
     @ivar eject:   whether to eject the drive after completing
+    @ivar itable:  the complete index table, read on first use
+    @type itable:  L{table.Table}
     """
 
     eject = True
+    _itable = None
 
     def addOptions(self):
         # FIXME: have a cache of these pickles somewhere
@@ -58,6 +69,12 @@ class _CD(logcommand.LogCommand):
         self.parser.add_option('-R', '--release-id',
             action="store", dest="release_id",
             help="MusicBrainz release id to match to (if there are multiple)")
+        self.parser.add_option('', '--toc-reader',
+            action="store", dest="toc_reader",
+            type="choice", choices=sorted(tocreader.READERS.keys()),
+            help="how to read the TOC, one of '%s' (default: 'file' when "
+                "the device is a .toc or .cue file, 'cdrdao' otherwise)" %
+                "', '".join(sorted(tocreader.READERS.keys())))
 
 
     def do(self, args):
@@ -70,8 +87,17 @@ class _CD(logcommand.LogCommand):
         self.device = self.parentCommand.options.device
         self.stdout.write('Checking device %s\n' % self.device)
 
-        self.program.loadDevice(self.device)
-        self.program.unmountDevice(self.device)
+        # a .toc or .cue file can stand in for the disc in a drive, and
+        # already has the pregaps and indexes cdrdao would scan for
+        reader = self.options.toc_reader
+        if os.path.isfile(self.device):
+            reader = reader or 'file'
+            self.program.tableReader = tocreader.FileReadTOCTask
+            self.eject = False
+        else:
+            self.program.loadDevice(self.device)
+            self.program.unmountDevice(self.device)
+        self.program.tocReader = tocreader.READERS[reader or 'cdrdao']
 
         # first, read the normal TOC, which is fast
         self.ittoc = self.program.getFastToc(self.runner,
@@ -104,31 +130,16 @@ class _CD(logcommand.LogCommand):
                     self.program.ejectDevice(self.device)
                 return -1
 
-        # now, read the complete index table, which is slower
-
-        self.itable = self.program.getTable(self.runner,
-            self.ittoc.getCDDBDiscId(),
-            self.ittoc.getMusicBrainzDiscId(), self.device)
-
-        assert self.itable.getCDDBDiscId() == self.ittoc.getCDDBDiscId(), \
-            "full table's id %s differs from toc id %s" % (
-                self.itable.getCDDBDiscId(), self.ittoc.getCDDBDiscId())
-        assert self.itable.getMusicBrainzDiscId() == \
-            self.ittoc.getMusicBrainzDiscId(), \
-            "full table's mb id %s differs from toc id mb %s" % (
-            self.itable.getMusicBrainzDiscId(),
-            self.ittoc.getMusicBrainzDiscId())
-        assert self.itable.getAccurateRipURL() == \
-            self.ittoc.getAccurateRipURL(), \
-            "full table's AR URL %s differs from toc AR URL %s" % (
-            self.itable.getAccurateRipURL(), self.ittoc.getAccurateRipURL())
-
         # result
 
         self.program.result.cdrdaoVersion = cdrdao.getCDRDAOVersion()
         self.program.result.cdparanoiaVersion = \
             cdparanoia.getCdParanoiaVersion()
-        info = drive.getDeviceInfo(self.parentCommand.options.device)
+        # a .toc or .cue file is not a drive that libcdio can open
+        image = os.path.isfile(self.device)
+        info = None
+        if not image:
+            info = drive.getDeviceInfo(self.parentCommand.options.device)
         if info:
             try:
                 self.program.result.cdparanoiaDefeatsCache = \
@@ -141,18 +152,19 @@ class _CD(logcommand.LogCommand):
         self.program.result.title = self.program.metadata \
             and self.program.metadata.title \
             or 'Unknown Title'
+        self.program.result.vendor = 'Unknown'
+        self.program.result.model = 'Unknown'
+        self.program.result.release = 'Unknown'
         # cdio is optional for now
-        try:
-            import cdio
-            _, self.program.result.vendor, self.program.result.model, \
-                self.program.result.release = \
-                cdio.Device(self.device).get_hwinfo()
-        except ImportError:
-            self.stdout.write(
-                'WARNING: pycdio not installed, cannot identify drive\n')
-            self.program.result.vendor = 'Unknown'
-            self.program.result.model = 'Unknown'
-            self.program.result.release = 'Unknown'
+        if not image:
+            try:
+                import cdio
+                _, self.program.result.vendor, self.program.result.model, \
+                    self.program.result.release = \
+                    cdio.Device(self.device).get_hwinfo()
+            except ImportError:
+                self.stdout.write(
+                    'WARNING: pycdio not installed, cannot identify drive\n')
 
         self.doCommand()
 
@@ -162,6 +174,33 @@ class _CD(logcommand.LogCommand):
     def doCommand(self):
         pass
 
+    def _getTable(self):
+        # reading the complete index table, with pregaps and indexes, takes
+        # a pass over the whole disc, so only do it for commands that need it
+        if self._itable:
+            return self._itable
+
+        self._itable = self.program.getTable(self.runner,
+            self.ittoc.getCDDBDiscId(),
+            self.ittoc.getMusicBrainzDiscId(), self.device)
+        itable = self._itable
+
+        assert itable.getCDDBDiscId() == self.ittoc.getCDDBDiscId(), \
+            "full table's id %s differs from toc id %s" % (
+                itable.getCDDBDiscId(), self.ittoc.getCDDBDiscId())
+        assert itable.getMusicBrainzDiscId() == \
+            self.ittoc.getMusicBrainzDiscId(), \
+            "full table's mb id %s differs from toc id mb %s" % (
+            itable.getMusicBrainzDiscId(),
+            self.ittoc.getMusicBrainzDiscId())
+        assert itable.getAccurateRipURL() == \
+            self.ittoc.getAccurateRipURL(), \
+            "full table's AR URL %s differs from toc AR URL %s" % (
+            itable.getAccurateRipURL(), self.ittoc.getAccurateRipURL())
+
+        return itable
+    itable = property(_getTable)
+
 
 class Info(_CD):
     summary = "retrieve information about the currently inserted CD"
@@ -227,13 +266,68 @@ Log files will log the path to tracks relative to this directory.
             action="store_true", dest="unknown",
             help="whether to continue ripping if the CD is unknown (%default)",
             default=False)
+        self.parser.add_option('', '--single-read',
+            action="store_true", dest="single_read",
+            help="look up the disc in AccurateRip first, and skip the copy "
+                "read of tracks that match it (%default)",
+            default=False)
+        self.parser.add_option('', '--single-read-confidence',
+            action="store", dest="single_read_confidence", type="int",
+            help="AccurateRip confidence a track needs to skip the copy "
+                "read (%default)",
+            default=2)
+        self.parser.add_option('', '--whole-disc',
+            action="store_true", dest="whole_disc",
+            help="read consecutive tracks in one go instead of one by one, "
+                "to save on seeking (%default)",
+            default=False)
+        self.parser.add_option('', '--burst',
+            action="store_true", dest="burst",
+            help="first read the disc once without paranoia, and only rip "
+                "the tracks that do not match AccurateRip securely "
+                "(%default)",
+            default=False)
+        self.parser.add_option('', '--burst-confidence',
+            action="store", dest="burst_confidence", type="int",
+            help="AccurateRip confidence a burst read track needs to be "
+                "kept (%default)",
+            default=2)
+        self.parser.add_option('', '--scratch-dir',
+            action="store", dest="scratch_dir",
+            help="directory for the unencoded audio while ripping, "
+                "for example on a tmpfs; falls back to the output "
+                "directory when full (default: the scratch_dir setting, "
+                "or the system's temporary directory)")
+        self.parser.add_option('', '--resumable',
+            action="store_true", dest="resumable",
+            help="keep partial reads next to the output, so that a rip "
+                "that gets interrupted continues where it stopped "
+                "(%default)",
+            default=False)
+        self.parser.add_option('', '--max-encodes',
+            action="store", dest="max_encodes", type="int",
+            help="how many rips on this computer can encode at the same "
+                "time; 0 for no limit (%default)",
+            default=0)
+        self.parser.add_option('', '--overlap-scan',
+            action="store_true", dest="overlap_scan",
+            help="scan the disc for pregaps and indexes while ripping, "
+                "for drives that can do both at the same time (%default)",
+            default=False)
+        self.parser.add_option('', '--track-reader',
+            action="store", dest="track_reader",
+            type="choice", choices=sorted(cdparanoia.READERS.keys()),
+            help="how to read the tracks, one of '%s' (default: 'cdio' "
+                "when the device is a BIN/CUE or .toc image, 'cdparanoia' "
+                "otherwise)" % "', '".join(sorted(cdparanoia.READERS.keys())))
 
     def handleOptions(self, options):
         options.track_template = options.track_template.decode('utf-8')
         options.disc_template = options.disc_template.decode('utf-8')
 
-        if options.offset is None:
-            info = drive.getDeviceInfo(self.parentCommand.options.device)
+        device = self.parentCommand.options.device
+        if options.offset is None and not os.path.isfile(device):
+            info = drive.getDeviceInfo(device)
             if info:
                 try:
                     options.offset = self.getRootCommand(
@@ -269,6 +363,20 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
         profile = encode.PROFILES[self.options.profile]()
         self.program.result.profileName = profile.name
         self.program.result.profilePipeline = profile.pipeline
+        if self.options.scratch_dir:
+            self.program.scratch = scratch.ScratchSpace(
+                self.options.scratch_dir.decode('utf-8'))
+        self.program.resumable = self.options.resumable
+        # cdparanoia can only read drives, libcdio also reads images
+        reader = self.options.track_reader
+        if not reader:
+            reader = os.path.isfile(self.device) and 'cdio' or 'cdparanoia'
+        self.program.trackReader = cdparanoia.READERS[reader]
+        if self.options.max_encodes:
+            self.program.encodeSlots = slots.SlotPool(
+                directory.Directory().getCache('encode-slots'),
+                self.options.max_encodes)
+        startTime = time.time()
         elementFactory = profile.pipeline.split(' ')[0]
         self.program.result.gstreamerVersion = gstreamer.gstreamerVersion()
         self.program.result.gstPythonVersion = gstreamer.gstPythonVersion()
@@ -310,18 +418,38 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
         # FIXME: say when we're continuing a rip
         # FIXME: disambiguate if the pre-existing rip is different
 
+        responses = None
+        if self.options.single_read or self.options.burst:
+            responses = self._getAccurateRipResponses()
+
+        # the tracks start at their index 1, which the fast TOC already
+        # has, so they can be ripped while the drive gets scanned for
+        # the pregaps and indexes
+        overlap = self.options.overlap_scan and self.program.startTable(
+            self.ittoc.getCDDBDiscId(), self.ittoc.getMusicBrainzDiscId(),
+            self.device)
+        if overlap:
+            self.stdout.write('Scanning for pregaps and indexes while '
+                'ripping\n')
+            self.program.result.table = self.ittoc
+            table = self.ittoc
+        else:
+            table = self.itable
 
         # FIXME: turn this into a method
 
-        def ripIfNotRipped(number):
-            self.debug('ripIfNotRipped for track %d' % number)
+        def getTrackResult(number):
             # we can have a previous result
             trackResult = self.program.result.getTrackResult(number)
             if not trackResult:
                 trackResult = result.TrackResult()
-                self.program.result.tracks.append(trackResult)
+                if number == 0:
+                    # the HTOA comes first, even when ripped last
+                    self.program.result.tracks.insert(0, trackResult)
+                else:
+                    self.program.result.tracks.append(trackResult)
             else:
-                self.debug('ripIfNotRipped have trackresult, path %r' %
+                self.debug('getTrackResult have trackresult, path %r' %
                     trackResult.filename)
 
             path = self.program.getPath(self.program.outdir,
@@ -329,16 +457,26 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                 self.mbdiscid, number,
                 profile=profile, disambiguate=disambiguate) \
                 + '.' + profile.extension
-            self.debug('ripIfNotRipped: path %r' % path)
+            self.debug('getTrackResult: path %r' % path)
             trackResult.number = number
 
             assert type(path) is unicode, "%r is not unicode" % path
             trackResult.filename = path
-            if number > 0:
-                trackResult.pregap = self.itable.tracks[number - 1].getPregap()
+
+            return trackResult
+
+        # tracks ripped with --whole-disc, which need no verifying
+        ripped = []
+        # tracks ripped in this run
+        reported = []
+
+        def ripIfNotRipped(number):
+            self.debug('ripIfNotRipped for track %d' % number)
+            trackResult = getTrackResult(number)
+            path = trackResult.filename
 
             # FIXME: optionally allow overriding reripping
-            if os.path.exists(path):
+            if os.path.exists(path) and number not in ripped:
                 if path != trackResult.filename:
                     # the path is different (different name/template ?)
                     # but we can copy it
@@ -346,15 +484,24 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                         trackResult.filename, path))
 
                 self.stdout.write('Verifying track %d of %d: %s\n' % (
-                    number, len(self.itable.tracks),
+                    number, len(table.tracks),
                     os.path.basename(path).encode('utf-8')))
                 if not self.program.verifyTrack(self.runner, trackResult):
                     self.stdout.write('Verification failed, reripping...\n')
                     os.unlink(path)
 
+            # report on tracks that got ripped just now
+            report = number in ripped
+
             if not os.path.exists(path):
+                report = True
                 self.debug('path %r does not exist, ripping...' % path)
                 tries = 0
+                checksums = None
+                if self.options.single_read and responses and number > 0:
+                    checksums = self.program.getAccurateRipChecksums(
+                        responses, number,
+                        self.options.single_read_confidence)
                 # we reset durations for test and copy here
                 trackResult.testduration = 0.0
                 trackResult.copyduration = 0.0
@@ -364,7 +511,7 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                     if tries > 1:
                         extra = " (try %d)" % tries
                     self.stdout.write('Ripping track %d of %d%s: %s\n' % (
-                        number, len(self.itable.tracks), extra,
+                        number, len(table.tracks), extra,
                         os.path.basename(path).encode('utf-8')))
                     try:
                         self.debug('ripIfNotRipped: track %d, try %d',
@@ -375,7 +522,8 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                             profile=profile,
                             taglist=self.program.getTagList(number),
                             what='track %d of %d%s' % (
-                                number, len(self.itable.tracks), extra))
+                                number, len(table.tracks), extra),
+                            accurateRipChecksums=checksums)
                         break
                     except Exception, e:
                         self.debug('Got exception %r on try %d',
@@ -385,9 +533,19 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                 if tries == MAX_TRIES:
                     self.error('Giving up on track %d after %d times' % (
                         number, tries))
-                if trackResult.testcrc == trackResult.copycrc:
+
+            if report:
+                reported.append(number)
+                if trackResult.copySkipped:
+                    self.stdout.write('Track %d matches AccurateRip, '
+                        'skipped copy read\n' % number)
+                elif trackResult.testcrc == trackResult.copycrc:
                     self.stdout.write('Checksums match for track %d\n' %
                         number)
+                elif trackResult.repairedFrames:
+                    self.stdout.write('Settled %d frames by re-reading '
+                        'for track %d\n' % (
+                            trackResult.repairedFrames, number))
                 else:
                     self.stdout.write(
                         'ERROR: checksums did not match for track %d\n' %
@@ -399,22 +557,14 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
                 self.stdout.write('Rip quality: %.2f %%\n' % (
                     trackResult.quality * 100.0, ))
 
-            # overlay this rip onto the Table
-            if number == 0:
-                # HTOA goes on index 0 of track 1
-                self.itable.setFile(1, 0, trackResult.filename,
-                    self.ittoc.getTrackStart(1), number)
-            else:
-                self.itable.setFile(number, 1, trackResult.filename,
-                    self.ittoc.getTrackLength(number), number)
-
             self.program.saveRipResult()
 
+        def ripHTOA():
+            # check for hidden track one audio
+            htoa = self.program.getHTOA()
+            if not htoa:
+                return None
 
-        # check for hidden track one audio
-        htoapath = None
-        htoa = self.program.getHTOA()
-        if htoa:
             start, stop = htoa
             self.stdout.write(
                 'Found Hidden Track One Audio from frame %d to %d\n' % (
@@ -422,19 +572,118 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
 
             # rip it
             ripIfNotRipped(0)
-            htoapath = self.program.result.tracks[0].filename
+            return getTrackResult(0).filename
 
-        for i, track in enumerate(self.itable.tracks):
+        # with an overlapping scan, the pregap of track 1 is not known yet
+        htoapath = None
+        if not overlap:
+            htoapath = ripHTOA()
+
+        burst = self.options.burst
+        if burst and (not responses or table.hasDataTracks()):
+            self.stdout.write('Cannot verify a burst read against '
+                'AccurateRip, ripping securely\n')
+            burst = False
+
+        passes = []
+        if burst:
+            passes.append(True)
+        if self.options.whole_disc:
+            passes.append(False)
+
+        for burstPass in passes:
+            # rip runs of consecutive audio tracks that have no file yet
+            runs = []
+            for i, track in enumerate(table.tracks):
+                number = i + 1
+                if not track.audio or \
+                    os.path.exists(getTrackResult(number).filename):
+                    continue
+                if runs and runs[-1][-1] == number - 1 and \
+                    table.getTrackStart(number) == \
+                        table.getTrackEnd(number - 1) + 1:
+                    runs[-1].append(number)
+                else:
+                    runs.append([number, ])
+
+            for numbers in runs:
+                trackResults = [getTrackResult(n) for n in numbers]
+                if burstPass:
+                    self.stdout.write('Burst reading tracks %d to %d of %d\n'
+                        % (numbers[0], numbers[-1], len(table.tracks)))
+                else:
+                    self.stdout.write('Ripping tracks %d to %d of %d\n' % (
+                        numbers[0], numbers[-1], len(table.tracks)))
+                for trackResult in trackResults:
+                    trackResult.testduration = 0.0
+                    trackResult.copyduration = 0.0
+                accurateRipChecksums = None
+                if burstPass:
+                    accurateRipChecksums = [
+                        self.program.getAccurateRipChecksums(responses, n,
+                            self.options.burst_confidence)
+                        for n in numbers]
+                try:
+                    self.program.ripTracks(self.runner, trackResults,
+                        offset=int(self.options.offset),
+                        device=self.parentCommand.options.device,
+                        profile=profile,
+                        taglists=[self.program.getTagList(n)
+                            for n in numbers],
+                        what='tracks %d to %d of %d' % (
+                            numbers[0], numbers[-1],
+                            len(table.tracks)),
+                        burst=burstPass,
+                        accurateRipChecksums=accurateRipChecksums)
+                except Exception, e:
+                    self.debug('Got exception %r ripping tracks %r',
+                        e, numbers)
+
+                # the others get ripped again, securely
+                for trackResult in trackResults:
+                    if os.path.exists(trackResult.filename):
+                        ripped.append(trackResult.number)
+                    elif burstPass:
+                        self.stdout.write(
+                            'Track %d did not match AccurateRip, '
+                            'ripping it again\n' % trackResult.number)
+                    else:
+                        self.stdout.write(
+                            'Could not rip track %d in one go\n' %
+                                trackResult.number)
+
+        for i, track in enumerate(table.tracks):
             # FIXME: rip data tracks differently
             if not track.audio:
                 self.stdout.write(
                     'WARNING: skipping data track %d, not implemented\n' % (
                     i + 1, ))
+                continue
+
+            ripIfNotRipped(i + 1)
+
+        # from here on, the scan has to be done
+        if overlap:
+            table = self.itable
+            htoapath = ripHTOA()
+
+        # overlay the rip onto the Table
+        if htoapath:
+            # HTOA goes on index 0 of track 1
+            self.itable.setFile(1, 0, htoapath,
+                self.ittoc.getTrackStart(1), 0)
+        for i, track in enumerate(self.itable.tracks):
+            if not track.audio:
                 # FIXME: make it work for now
                 track.indexes[1].relative = 0
                 continue
 
-            ripIfNotRipped(i + 1)
+            trackResult = getTrackResult(i + 1)
+            trackResult.pregap = track.getPregap()
+            self.itable.setFile(i + 1, 1, trackResult.filename,
+                self.ittoc.getTrackLength(i + 1), i + 1)
+
+        self.program.saveRipResult()
 
         ### write disc files
         discName = self.program.getPath(self.program.outdir,
@@ -479,6 +728,25 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
         handle.close()
 
         # verify using accuraterip
+        if not self.options.single_read and not self.options.burst:
+            responses = self._getAccurateRipResponses()
+
+        self.program.verifyImage(self.runner, responses)
+
+        self.stdout.write("\n".join(
+            self.program.getAccurateRipResults()) + "\n")
+
+        frames = sum([self.itable.getTrackLength(n)
+            for n in reported if n > 0])
+        self.stdout.write(_RIPPED_TEMPLATE % (
+            frames / common.FRAMES_PER_SECOND, time.time() - startTime))
+
+        self.program.saveRipResult()
+
+        # write log file
+        self.program.writeLog(discName, self.logger)
+
+    def _getAccurateRipResponses(self):
         url = self.ittoc.getAccurateRipURL()
         self.stdout.write("AccurateRip URL %s\n" % url)
 
@@ -503,23 +771,12 @@ Install pycdio and run 'rip offset find' to detect your drive's offset.
             self.stdout.write('%d AccurateRip reponses found\n' %
                 len(responses))
 
-            if responses[0].cddbDiscId != self.itable.getCDDBDiscId():
+            if responses[0].cddbDiscId != self.ittoc.getCDDBDiscId():
                 self.stdout.write(
                     "AccurateRip response discid different: %s\n" %
                     responses[0].cddbDiscId)
 
-
-        self.program.verifyImage(self.runner, responses)
-
-        self.stdout.write("\n".join(
-            self.program.getAccurateRipResults()) + "\n")
-
-        self.program.saveRipResult()
-
-        # write log file
-        self.program.writeLog(discName, self.logger)
-
-        self.program.ejectDevice(self.device)
+        return responses
 
 
 class CD(logcommand.LogCommand):
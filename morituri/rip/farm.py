@@ -0,0 +1,168 @@
+# -*- Mode: Python -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# Morituri - for those about to RIP
+
+# Copyright (C) 2014 Thomas Vander Stichele
+
+# This file is part of morituri.
+#
+# morituri is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# morituri is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with morituri.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import multiprocessing
+
+from morituri.common import logcommand, drive
+from morituri.common import task as ctask
+from morituri.rip import cd
+
+from morituri.extern.task import task
+
+
+class RipTask(ctask.PopenTask):
+    """
+    I am a task that runs rip cd rip on one drive, and passes on what it
+    writes, prefixed with the drive.
+
+    @ivar device:   the drive ripped from
+    @ivar audio:    how many seconds of audio got ripped
+    @ivar duration: how many seconds ripping took
+    @ivar ripped:   whether rip cd rip succeeded
+    """
+
+    logCategory = 'RipTask'
+
+    audio = 0
+    duration = 0
+    ripped = False
+
+    def __init__(self, device, command, stdout):
+        """
+        @param device:  the drive to rip from
+        @type  device:  str
+        @param command: the rip cd rip command line to run
+        @type  command: list of str
+        """
+        self.device = device
+        self.command = command
+        self.description = 'Ripping %s' % device
+        self._stdout = stdout
+        self._buffers = {'stdout': '', 'stderr': ''}
+
+    def readbytesout(self, bytes):
+        self._readLines('stdout', bytes)
+
+    def readbyteserr(self, bytes):
+        self._readLines('stderr', bytes)
+
+    def _readLines(self, which, bytes):
+        lines = (self._buffers[which] + bytes).split('\n')
+        self._buffers[which] = lines.pop()
+        for line in lines:
+            # only keep the last update of progress lines
+            line = line.split('\r')[-1].rstrip()
+            if not line:
+                continue
+
+            m = cd.RIPPED_RE.search(line)
+            if m:
+                self.audio = int(m.group('audio'))
+                self.duration = int(m.group('duration'))
+
+            self._stdout.write('%s: %s\n' % (self.device, line))
+            self._stdout.flush()
+
+    def done(self):
+        self.ripped = True
+
+
+class Farm(logcommand.LogCommand):
+
+    summary = "rip the CDs in all drives at the same time"
+    usage = "[options] [-- rip cd rip options]"
+    description = """
+Farm runs rip cd rip on each drive at the same time, passing on the
+given rip cd rip options, and reports on all of them at the end.
+
+Encoding is limited to one rip per CPU at a time, so that the drives
+are not held up by an overloaded computer.
+"""
+
+    def addOptions(self):
+        self.parser.add_option('-d', '--device',
+            action="append", dest="devices",
+            help="CD-DA device to rip from; can be given more than once "
+                "(default: all drives)")
+        self.parser.add_option('', '--max-encodes',
+            action="store", dest="max_encodes", type="int",
+            help="how many drives can encode at the same time "
+                "(default: the number of CPUs)")
+
+    def handleOptions(self, options):
+        if not options.devices:
+            options.devices = drive.getAllDevicePaths()
+            if not options.devices:
+                self.error('No CD-DA drives found!')
+                return 3
+
+        # these can be symlinks to the same device
+        devices = []
+        for device in options.devices:
+            device = os.path.realpath(device)
+            if device not in devices:
+                devices.append(device)
+        options.devices = devices
+
+        if not options.max_encodes:
+            try:
+                options.max_encodes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                options.max_encodes = 1
+
+    def do(self, args):
+        farm = ctask.MultiParallelTask()
+        farm.description = 'Ripping %d drives' % len(self.options.devices)
+        for device in self.options.devices:
+            command = [sys.executable, os.path.abspath(sys.argv[0]),
+                'cd', '-d', device, 'rip',
+                '--max-encodes=%d' % self.options.max_encodes] + args
+            self.stdout.write('Ripping %s\n' % device)
+            farm.addTask(RipTask(device, command, self.stdout))
+
+        start = time.time()
+        runner = task.SyncRunner(verbose=False)
+        runner.run(farm)
+        duration = time.time() - start
+
+        audio = 0
+        for t in farm.tasks:
+            if not t.ripped:
+                self.stdout.write('%s: failed\n' % t.device)
+                continue
+
+            audio += t.audio
+            speed = t.duration and float(t.audio) / t.duration or 0.0
+            self.stdout.write(
+                '%s: ripped %d seconds of audio in %d seconds (%.1fx)\n' % (
+                    t.device, t.audio, t.duration, speed))
+
+        self.stdout.write(
+            'Ripped %d seconds of audio from %d drives in %d seconds '
+            '(%.1fx)\n' % (audio, len(farm.tasks), duration,
+                duration and audio / duration or 0.0))
+
+        if [t for t in farm.tasks if not t.ripped]:
+            return 1
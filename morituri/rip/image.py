@@ -158,8 +158,21 @@ class Verify(logcommand.LogCommand):
 
     description = '''
 Verifies the image from the given .cue files against the AccurateRip database.
+
+Tracks that do not match are also tried as if they had been ripped with
+a different read offset, for example because they come from another
+pressing or were ripped with the wrong read offset.
 '''
 
+    def addOptions(self):
+        default = 2940
+        self.parser.add_option('-w', '--offset-window',
+            action="store", dest="offset_window", type="int",
+            help="how many samples to try shifting each track by, in both "
+                "directions; 0 to only match tracks as they are "
+                "(defaults to %d)" % default,
+            default=default)
+
     def do(self, args):
         prog = program.Program(self.getRootCommand().config())
         runner = task.SyncRunner()
@@ -181,7 +194,8 @@ Verifies the image from the given .cue files against the AccurateRip database.
                 tr.number = track.number
                 prog.result.tracks.append(tr)
 
-            prog.verifyImage(runner, responses)
+            prog.verifyImage(runner, responses,
+                window=self.options.offset_window)
 
             print "\n".join(prog.getAccurateRipResults()) + "\n"
 
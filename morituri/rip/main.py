@@ -8,7 +8,7 @@ import pkg_resources
 from morituri.common import log, logcommand, common, config
 from morituri.configure import configure
 
-from morituri.rip import cd, offset, drive, image, accurip, debug
+from morituri.rip import cd, offset, drive, farm, image, accurip, debug
 
 from morituri.extern.command import command
 from morituri.extern.task import task
@@ -93,7 +93,8 @@ You can get help on subcommands by using the -h option to the subcommand.
 """
 
     subCommandClasses = [accurip.AccuRip,
-        cd.CD, debug.Debug, drive.Drive, offset.Offset, image.Image, ]
+        cd.CD, debug.Debug, drive.Drive, farm.Farm, offset.Offset,
+        image.Image, ]
 
     def addOptions(self):
         # FIXME: is this the right place ?
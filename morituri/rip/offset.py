@@ -27,6 +27,7 @@ import gobject
 gobject.threads_init()
 
 from morituri.common import logcommand, accurip, drive, program, common
+from morituri.common import wav
 from morituri.common import task as ctask
 from morituri.program import cdrdao, cdparanoia
 
@@ -139,76 +140,159 @@ CD in the AccurateRip database."""
         # now rip the first track at various offsets, calculating AccurateRip
         # CRC, and matching it against the retrieved ones
 
-        def match(archecksum, track, responses):
+        def match(archecksums, track, responses):
+            # match either the v1 or the v2 checksum
             for i, r in enumerate(responses):
-                if archecksum == r.checksums[track - 1]:
-                    return archecksum, i
+                if r.checksums[track - 1] in archecksums:
+                    return r.checksums[track - 1], i
 
             return None, None
 
-        for offset in self._offsets:
-            self.stdout.write('Trying read offset %d ...\n' % offset)
-            try:
-                archecksum = self._arcs(runner, table, 1, offset)
-            except task.TaskException, e:
-
-                # let MissingDependency fall through
-                if isinstance(e.exception,
-                    common.MissingDependencyException):
-                    raise e
-
-                if isinstance(e.exception, cdparanoia.FileSizeError):
+        # first try to rip the first track only once, for all offsets
+        offsets = self._offsets
+        swept = False
+        try:
+            offsets = self._sweep(runner, table, responses)
+            swept = True
+        except task.TaskException, e:
+            # let MissingDependency fall through
+            if isinstance(e.exception,
+                common.MissingDependencyException):
+                raise e
+
+            self.warning("Could not rip track 1 for all offsets: %r" % (
+                e, ))
+            self.stdout.write(
+                'WARNING: cannot rip track 1 for all offsets at once, '
+                'trying them one by one ...\n')
+
+        for offset in offsets:
+            if not swept:
+                self.stdout.write('Trying read offset %d ...\n' % offset)
+                try:
+                    archecksums = self._arcs(runner, table, 1, offset)
+                except task.TaskException, e:
+
+                    # let MissingDependency fall through
+                    if isinstance(e.exception,
+                        common.MissingDependencyException):
+                        raise e
+
+                    if isinstance(e.exception, cdparanoia.FileSizeError):
+                        self.stdout.write(
+                            'WARNING: cannot rip with offset %d...\n' %
+                            offset)
+                        continue
+
+                    self.warning(
+                        "Unknown task exception for offset %d: %r" % (
+                        offset, e))
                     self.stdout.write(
                         'WARNING: cannot rip with offset %d...\n' % offset)
                     continue
 
-                self.warning("Unknown task exception for offset %d: %r" % (
-                    offset, e))
-                self.stdout.write(
-                    'WARNING: cannot rip with offset %d...\n' % offset)
-                continue
-
-            self.debug('AR checksum calculated: %s' % archecksum)
+                self.debug('AR checksums calculated: %s' % (archecksums, ))
 
-            c, i = match(archecksum, 1, responses)
-            if c:
-                count = 1
+                c, i = match(archecksums, 1, responses)
+                if not c:
+                    continue
                 self.debug('MATCHED against response %d' % i)
-                self.stdout.write(
-                    'Offset of device is likely %d, confirming ...\n' %
-                        offset)
 
-                # now try and rip all other tracks as well, except for the
-                # last one (to avoid readers that can't do overread
-                for track in range(2, (len(table.tracks) + 1) - 1):
-                    try:
-                        archecksum = self._arcs(runner, table, track, offset)
-                    except task.TaskException, e:
-                        if isinstance(e.exception, cdparanoia.FileSizeError):
-                            self.stdout.write(
-                                'WARNING: cannot rip with offset %d...\n' %
-                                offset)
-                            continue
-
-                    c, i = match(archecksum, track, responses)
-                    if c:
-                        self.debug('MATCHED track %d against response %d' % (
-                            track, i))
-                        count += 1
-
-                if count == len(table.tracks) - 1:
-                    self._foundOffset(device, offset)
-                    return 0
-                else:
-                    self.stdout.write(
-                        'Only %d of %d tracks matched, continuing ...\n' % (
-                        count, len(table.tracks)))
+            count = 1
+            self.stdout.write(
+                'Offset of device is likely %d, confirming ...\n' %
+                    offset)
+
+            # now try and rip all other tracks as well, except for the
+            # last one (to avoid readers that can't do overread
+            for track in range(2, (len(table.tracks) + 1) - 1):
+                try:
+                    archecksums = self._arcs(runner, table, track,
+                        offset)
+                except task.TaskException, e:
+                    if isinstance(e.exception, cdparanoia.FileSizeError):
+                        self.stdout.write(
+                            'WARNING: cannot rip with offset %d...\n' %
+                            offset)
+                        continue
+
+                c, i = match(archecksums, track, responses)
+                if c:
+                    self.debug('MATCHED track %d against response %d' % (
+                        track, i))
+                    count += 1
+
+            if count == len(table.tracks) - 1:
+                self._foundOffset(device, offset)
+                return 0
+            else:
+                self.stdout.write(
+                    'Only %d of %d tracks matched, continuing ...\n' % (
+                    count, len(table.tracks)))
 
         self.stdout.write('No matching offset found.\n')
         self.stdout.write('Consider trying again with a different disc.\n')
 
+    def _sweep(self, runner, table, responses):
+        # rip the first track once, at the smallest offset and with enough
+        # extra frames for the biggest one, and return the offsets for which
+        # its checksum matches, in the order they should be tried
+        low = min(self._offsets)
+        high = max(self._offsets)
+        extra = (high - low + common.SAMPLES_PER_FRAME - 1) / \
+            common.SAMPLES_PER_FRAME
+
+        start = table.getTrackStart(1)
+        stop = table.getTrackEnd(1)
+        sampleLength = (stop - start + 1) * common.SAMPLES_PER_FRAME
+        trackCount = len(table.tracks)
+        self.debug('Ripping track 1 with offset %d and %d extra frames',
+            low, extra)
+
+        fd, path = tempfile.mkstemp(
+            suffix=u'.track01.offset%d-%d.morituri.wav' % (low, high))
+        os.close(fd)
+
+        try:
+            t = cdparanoia.ReadTrackTask(path, table, start, stop + extra,
+                offset=low, device=self.options.device)
+            t.description = 'Ripping track 1 with read offsets %d to %d' % (
+                low, high)
+            runner.run(t)
+
+            w = wav.WAVFile(path)
+            w.open()
+            data = w.read(0, w.samples)
+            w.close()
+        finally:
+            os.unlink(path)
+
+        self.stdout.write('Calculating checksums for %d offsets ...\n' %
+            len(self._offsets))
+        checksums = accurip.getOffsetChecksums(data, 1, trackCount,
+            sampleLength, [offset - low for offset in self._offsets])
+
+        expected = [r.checksums[0] for r in responses]
+        ret = [offset for offset in self._offsets
+            if "%08x" % checksums[offset - low] in expected]
+        if ret:
+            return ret
+
+        # the disc could be in the database with v2 checksums only, which
+        # cannot be calculated incrementally, so try them one by one
+        self.debug('No v1 checksum matched, trying v2')
+        for offset in self._offsets:
+            arcs = accurip.AccurateRipChecksum(1, trackCount, sampleLength)
+            d = offset - low
+            arcs.update(data[d * 4:(d + sampleLength) * 4])
+            if "%08x" % arcs.checksumV2 in expected:
+                ret.append(offset)
+
+        return ret
+
     def _arcs(self, runner, table, track, offset):
-        # rips the track with the given offset, return the arcs checksum
+        # rips the track with the given offset, return the v1 and v2 arcs
+        # checksums
         self.debug('Ripping track %r with offset %d ...', track, offset)
 
         fd, path = tempfile.mkstemp(
@@ -228,10 +312,11 @@ CD in the AccurateRip database."""
 
         t = checksum.AccurateRipChecksumTask(path, trackNumber=track,
             trackCount=len(table.tracks))
+        t.useCache = False
         runner.run(t)
 
         os.unlink(path)
-        return "%08x" % t.checksum
+        return ("%08x" % t.checksum, "%08x" % t.checksumV2)
 
     def _foundOffset(self, device, offset):
         self.stdout.write('\nRead offset of device is: %d.\n' %
@@ -2,8 +2,12 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import os
+import random
+import shutil
+import struct
+import tempfile
 
-from morituri.common import accurip
+from morituri.common import accurip, common
 
 from morituri.test import common as tcommon
 
@@ -30,3 +34,146 @@ class AccurateRipResponseTestCase(tcommon.TestCase):
             self.assertEquals(response.confidences[i], 35)
         self.assertEquals(response.checksums[0], "beea32c8")
         self.assertEquals(response.checksums[10], "acee98ca")
+
+
+class AccuCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix=u'.morituri.test')
+        self._cacheDir = accurip._CACHE_DIR
+        accurip._CACHE_DIR = os.path.join(self._dir, 'cache')
+
+    def tearDown(self):
+        accurip._CACHE_DIR = self._cacheDir
+        shutil.rmtree(self._dir)
+
+    def testCache(self):
+        url = 'http://www.accuraterip.com/accuraterip/4/8/2/' \
+            'dBAR-011-0010e284-009228a3-9809ff0b.bin'
+        cache = accurip.AccuCache()
+        # another rip already created the directory
+        accurip.AccuCache()
+
+        cache._cache(url, 'data')
+        self.assertEquals(cache._read(url), 'data')
+        cache._cache(url, 'other data')
+        self.assertEquals(cache._read(url), 'other data')
+
+        # with the permissions the umask allows, not just for us
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEquals(os.stat(cache._getPath(url)).st_mode & 0777,
+            0666 & ~umask)
+
+        # the download was renamed into place
+        self.assertEquals(os.listdir(os.path.dirname(cache._getPath(url))),
+            ['dBAR-011-0010e284-009228a3-9809ff0b.bin', ])
+
+
+def _frameChecksum(data, trackNumber, trackCount):
+    # the original frame by frame, sample by sample implementation,
+    # extended to calculate the v2 checksum too
+    checksum = 0
+    checksumV2 = 0
+    frames = len(data) / common.BYTES_PER_FRAME
+    for frame in range(1, frames + 1):
+        buf = data[(frame - 1) * common.BYTES_PER_FRAME:
+            frame * common.BYTES_PER_FRAME]
+        if trackNumber == 1:
+            if frame <= 4:
+                continue
+            elif frame == 5:
+                value = struct.unpack("<I", buf[-4:])[0]
+                product = common.SAMPLES_PER_FRAME * 5 * value
+                checksum += product
+                checksum &= 0xFFFFFFFF
+                checksumV2 += (product & 0xFFFFFFFF) + (product >> 32)
+                checksumV2 &= 0xFFFFFFFF
+                continue
+        if trackNumber == trackCount and frame > frames - 5:
+            continue
+        values = struct.unpack("<%dI" % (len(buf) / 4), buf)
+        for i, value in enumerate(values):
+            position = (frame - 1) * common.SAMPLES_PER_FRAME + i + 1
+            checksum += position * value
+            checksum &= 0xFFFFFFFF
+            product = position * value
+            checksumV2 += (product & 0xFFFFFFFF) + (product >> 32)
+            checksumV2 &= 0xFFFFFFFF
+
+    return checksum, checksumV2
+
+
+class AccurateRipChecksumTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self._data = "".join([chr(random.randint(0, 255))
+            for _ in range(common.BYTES_PER_FRAME * 12)])
+
+    def _check(self, trackNumber, trackCount, size):
+        expected, expectedV2 = _frameChecksum(self._data, trackNumber,
+            trackCount)
+        sampleLength = len(self._data) / 4
+
+        for update in ['_updatePython', '_updateNumPy']:
+            if update == '_updateNumPy' and not accurip.numpy:
+                continue
+
+            arcs = accurip.AccurateRipChecksum(trackNumber, trackCount,
+                sampleLength)
+            for i in range(0, len(self._data), size):
+                getattr(arcs, update)(self._data[i:i + size])
+            self.assertEquals(arcs.checksum, expected,
+                '%s: %08x != %08x' % (update, arcs.checksum, expected))
+            self.assertEquals(arcs.checksumV2, expectedV2,
+                '%s: v2 %08x != %08x' % (update, arcs.checksumV2, expectedV2))
+
+    def testFirstTrack(self):
+        self._check(1, 3, common.BYTES_PER_FRAME)
+        self._check(1, 3, common.BYTES_PER_FRAME * 5)
+
+    def testMiddleTrack(self):
+        self._check(2, 3, common.BYTES_PER_FRAME)
+        self._check(2, 3, len(self._data))
+
+    def testLastTrack(self):
+        self._check(3, 3, common.BYTES_PER_FRAME)
+        self._check(3, 3, common.BYTES_PER_FRAME * 7)
+
+    def testSingleTrack(self):
+        self._check(1, 1, common.BYTES_PER_FRAME)
+        self._check(1, 1, len(self._data))
+
+
+class OffsetChecksumsTestCase(tcommon.TestCase):
+
+    def _check(self, trackNumber, trackCount, frames):
+        sampleLength = frames * common.SAMPLES_PER_FRAME
+        shifts = [0, 1, 2, 587, 588, 1000, 1500]
+        data = os.urandom((sampleLength + max(shifts)) * 4)
+
+        checksums = accurip.getOffsetChecksums(data, trackNumber, trackCount,
+            sampleLength, shifts)
+
+        for d in shifts:
+            arcs = accurip.AccurateRipChecksum(trackNumber, trackCount,
+                sampleLength)
+            arcs.update(data[d * 4:(d + sampleLength) * 4])
+            self.assertEquals(checksums[d], arcs.checksum)
+
+    def testFirst(self):
+        self._check(1, 3, 20)
+
+    def testMiddle(self):
+        self._check(2, 3, 20)
+
+    def testLast(self):
+        self._check(3, 3, 20)
+
+    def testSingleShort(self):
+        self._check(1, 1, 7)
+
+    def testTooShort(self):
+        self.assertRaises(ValueError, accurip.getOffsetChecksums,
+            '\0' * 4 * 600, 2, 3, 588, [0, 100])
@@ -0,0 +1,154 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_analysis -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import struct
+import zlib
+
+from morituri.common import accurip, analysis, common
+
+from morituri.test import common as tcommon
+
+
+class AccumulatorTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        # a ramp of samples, with a loud left channel in frame 3
+        values = []
+        for i in range(common.SAMPLES_PER_FRAME * 10):
+            values.extend([i % 1000, -(i % 700)])
+        values[common.WORDS_PER_FRAME * 2 + 10] = -32768
+        self._data = struct.pack("<%dh" % len(values), *values)
+
+    def _feed(self, accumulators):
+        for accumulator in accumulators:
+            accumulator.setLength(len(self._data) / 4)
+        for i in range(0, len(self._data), common.BYTES_PER_FRAME * 3):
+            buf = self._data[i:i + common.BYTES_PER_FRAME * 3]
+            for accumulator in accumulators:
+                accumulator.update(buf)
+
+    def testAll(self):
+        crc = analysis.CRC32Accumulator()
+        arcs = analysis.AccurateRipAccumulator(2, 3)
+        peak = analysis.PeakAccumulator()
+        count = analysis.SampleCountAccumulator()
+        buf = analysis.BufferAccumulator()
+
+        self._feed([crc, arcs, peak, count, buf])
+
+        self.assertEquals(crc.checksum, zlib.crc32(self._data) % 2 ** 32)
+
+        reference = accurip.AccurateRipChecksum(2, 3, len(self._data) / 4)
+        reference.update(self._data)
+        self.assertEquals(arcs.checksum, reference.checksum)
+        self.assertEquals(arcs.checksumV2, reference.checksumV2)
+
+        self.assertEquals(peak.peak, 32768)
+        self.assertEquals(count.samples, common.SAMPLES_PER_FRAME * 10)
+        self.assertEquals(buf.data, self._data)
+
+
+class PeakAccumulatorTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        values = [0, 0] * 100
+        values[10] = 1000
+        values[11] = -32768
+        values[50] = 32767
+        values[51] = 32767
+        values[99] = -5000
+        self._data = struct.pack("<%dh" % len(values), *values)
+
+    def _check(self, peak):
+        peak.update(self._data[:300])
+        peak.update(self._data[300:])
+
+        self.assertEquals(peak.channelPeaks, (32767, 32768))
+        self.assertEquals(peak.peak, 32768)
+        self.assertEquals(peak.clipped, 3)
+
+    def testPeak(self):
+        self._check(analysis.PeakAccumulator())
+
+    def testPeakPython(self):
+        peak = analysis.PeakAccumulator()
+        peak.update = peak._updatePython
+        self._check(peak)
+
+
+class SplitAccumulatorTestCase(tcommon.TestCase):
+
+    def testSplit(self):
+        data = os.urandom(4 * 1000)
+        lengths = [300, 0, 500, 200]
+        buffers = [analysis.BufferAccumulator() for l in lengths]
+        counts = [analysis.SampleCountAccumulator() for l in lengths]
+        split = analysis.SplitAccumulator([(l, [b, c])
+            for l, b, c in zip(lengths, buffers, counts)])
+
+        split.setLength(1000)
+        # buffers that do not line up with the segments, and extra samples
+        for i in range(0, len(data), 4 * 170):
+            split.update(data[i:i + 4 * 170])
+        split.update(os.urandom(4 * 10))
+        split.finish()
+
+        start = 0
+        for length, buf, count in zip(lengths, buffers, counts):
+            self.assertEquals(buf.data, data[start * 4:(start + length) * 4])
+            self.assertEquals(count.samples, length)
+            start += length
+
+
+class BlockCompareAccumulatorTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._data = os.urandom(4 * 1000)
+        self._reference = analysis.BlockCRC32Accumulator(blockSamples=300)
+        self._reference.update(self._data)
+        self._reference.finish()
+
+    def testBlocks(self):
+        self.assertEquals(self._reference.checksums, [
+            zlib.crc32(self._data[i:i + 1200]) % 2 ** 32
+                for i in range(0, 4000, 1200)])
+
+    def testSame(self):
+        compare = analysis.BlockCompareAccumulator(self._reference)
+        for i in range(0, len(self._data), 4 * 170):
+            compare.update(self._data[i:i + 4 * 170])
+        compare.finish()
+
+    def testDifferent(self):
+        data = self._data[:2000] + '\0\0\0\0' + self._data[2004:]
+
+        compare = analysis.BlockCompareAccumulator(self._reference)
+        compare.update(data[:1200])
+        # the second block only gets compared once it is complete
+        compare.update(data[1200:2000])
+        e = self.assertRaises(analysis.MismatchError, compare.update,
+            data[2000:2400])
+        self.assertEquals(e.block, 1)
+
+    def testLastBlock(self):
+        data = self._data[:-4] + '\0\0\0\0'
+
+        compare = analysis.BlockCompareAccumulator(self._reference)
+        compare.update(data)
+        e = self.assertRaises(analysis.MismatchError, compare.finish)
+        self.assertEquals(e.block, 3)
+
+    def testMaxMismatches(self):
+        data = '\0' * 4 + self._data[4:2000] + '\0' * 4 + self._data[2004:]
+
+        compare = analysis.BlockCompareAccumulator(self._reference,
+            maxMismatches=2)
+        compare.update(data)
+        compare.finish()
+        self.assertEquals(compare.mismatches, [0, 1])
+
+        compare = analysis.BlockCompareAccumulator(self._reference,
+            maxMismatches=1)
+        e = self.assertRaises(analysis.MismatchError, compare.update, data)
+        self.assertEquals(e.block, 0)
@@ -2,8 +2,11 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import os
+import shutil
+import tempfile
+import time
 
-from morituri.common import cache
+from morituri.common import cache, mbngs
 
 from morituri.test import common as tcommon
 
@@ -21,3 +24,109 @@ class ResultCacheTestCase(tcommon.TestCase):
     def testGetIds(self):
         ids = self.cache.getIds()
         self.assertEquals(ids, ['fe105a11'])
+
+
+class ChecksumCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix='.morituri.test.cache')
+        self.cache = cache.ChecksumCache(os.path.join(self._dir, 'checksum'))
+        self._path = os.path.join(self._dir, u'track.flac')
+        self._write('audio')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, data):
+        handle = open(self._path, 'wb')
+        handle.write(data)
+        handle.close()
+
+    def testGetSet(self):
+        self.assertEquals(self.cache.get(self._path, 0, -1, 'crc32'), None)
+
+        self.cache.set(self._path, 0, -1, 'crc32', 0x12345678)
+        self.cache.set(self._path, 588, 588, 'crc32', 1)
+        self.assertEquals(self.cache.get(self._path, 0, -1, 'crc32'),
+            0x12345678)
+        self.assertEquals(self.cache.get(self._path, 588, 588, 'crc32'), 1)
+        self.assertEquals(self.cache.get(self._path, 0, -1, 'peak'), None)
+
+        # a new cache reads the same entries back
+        c = cache.ChecksumCache(os.path.join(self._dir, 'checksum'))
+        self.assertEquals(c.get(self._path, 0, -1, 'crc32'), 0x12345678)
+
+    def testChanged(self):
+        self.cache.set(self._path, 0, -1, 'crc32', 0x12345678)
+
+        self._write('other audio')
+        self.assertEquals(self.cache.get(self._path, 0, -1, 'crc32'), None)
+
+        # same size, but modified later
+        self.cache.set(self._path, 0, -1, 'crc32', 0x12345678)
+        mtime = os.stat(self._path).st_mtime
+        os.utime(self._path, (time.time(), mtime + 10))
+        self.assertEquals(self.cache.get(self._path, 0, -1, 'crc32'), None)
+
+
+class VersionCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix='.morituri.test.cache')
+        self.cache = cache.VersionCache(os.path.join(self._dir, 'version'))
+        self._path = os.path.join(self._dir, 'cdrdao')
+        handle = open(self._path, 'wb')
+        handle.write('program')
+        handle.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testGetSet(self):
+        self.assertEquals(self.cache.get(self._path, ['cdrdao']), None)
+
+        self.cache.set(self._path, ['cdrdao'], '1.2.3')
+        self.assertEquals(self.cache.get(self._path, ['cdrdao']), '1.2.3')
+        self.assertEquals(self.cache.get(self._path, ['cdrdao', '-V']), None)
+
+        # a new cache reads the same entries back
+        c = cache.VersionCache(os.path.join(self._dir, 'version'))
+        self.assertEquals(c.get(self._path, ['cdrdao']), '1.2.3')
+
+    def testChanged(self):
+        self.cache.set(self._path, ['cdrdao'], '1.2.3')
+
+        # an upgrade replaces the program
+        mtime = os.stat(self._path).st_mtime
+        os.utime(self._path, (time.time(), mtime + 10))
+        self.assertEquals(self.cache.get(self._path, ['cdrdao']), None)
+
+
+class MusicBrainzCacheTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix='.morituri.test.cache')
+        self._path = os.path.join(self._dir, 'musicbrainz')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def testGetSet(self):
+        c = cache.MusicBrainzCache(self._path)
+        self.assertEquals(c.get('KnpGsLhvH.lPrNc1PBL21lb9Bg4-'), None)
+
+        metadata = mbngs.DiscMetadata()
+        metadata.title = u'Ladyhawke'
+        c.set('KnpGsLhvH.lPrNc1PBL21lb9Bg4-', [metadata, ])
+
+        # another rip reads the same lookup back
+        c = cache.MusicBrainzCache(self._path)
+        metadatas = c.get('KnpGsLhvH.lPrNc1PBL21lb9Bg4-')
+        self.assertEquals(len(metadatas), 1)
+        self.assertEquals(metadatas[0].title, u'Ladyhawke')
+        self.assertEquals(c.get('other'), None)
+
+    def testOutdated(self):
+        c = cache.MusicBrainzCache(self._path, maxAge=-1)
+        c.set('KnpGsLhvH.lPrNc1PBL21lb9Bg4-', [mbngs.DiscMetadata(), ])
+        self.assertEquals(c.get('KnpGsLhvH.lPrNc1PBL21lb9Bg4-'), None)
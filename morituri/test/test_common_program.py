@@ -4,11 +4,15 @@
 
 import os
 import pickle
+import shutil
+import tempfile
 
 import unittest
 
 from morituri.result import result
-from morituri.common import program, accurip, mbngs, config
+from morituri.common import program, accurip, mbngs, config, wav, \
+    analysis
+from morituri.extern.task import task
 from morituri.rip import common as rcommon
 
 
@@ -69,6 +73,141 @@ class TrackImageVerifyTestCase(unittest.TestCase):
             "[16457a5a], DB [eb6e55b4]")
 
 
+    def testVerifyV2(self):
+        path = os.path.join(os.path.dirname(__file__),
+            'dBAR-020-002e5023-029d8e49-040eaa14.bin')
+        data = open(path, "rb").read()
+        responses = accurip.getAccurateRipResponses(data)
+
+        # pretend only the v2 checksum of track 10 is in the database
+        checksums = [0, ] * 20
+        checksumsV2 = [None, ] * 20
+        checksumsV2[10 - 1] = int(responses[0].checksums[10 - 1], 16)
+
+        prog = program.Program(config.Config())
+        prog.result = result.RipResult()
+        for i in range(20):
+            r = result.TrackResult()
+            r.number = i + 1
+            prog.result.tracks.append(r)
+
+        prog._verifyImageWithChecksums(responses, checksums, checksumsV2)
+
+        tr = prog.result.getTrackResult(10)
+        self.assertEquals(tr.accurip, True)
+        self.assertEquals(tr.ARDBVersion, 2)
+        self.assertEquals(tr.ARCRCV2, checksumsV2[10 - 1])
+
+        tr = prog.result.getTrackResult(2)
+        self.assertEquals(tr.accurip, False)
+        self.assertEquals(tr.ARDBVersion, None)
+
+        res = prog.getAccurateRipResults()
+        self.failUnless(res[10 - 1].startswith(
+            "Track 10: rip accurate "), res[10 - 1])
+        self.failUnless(res[10 - 1].endswith(" (v2)"), res[10 - 1])
+
+    def testVerifyOffset(self):
+        path = os.path.join(os.path.dirname(__file__),
+            'dBAR-020-002e5023-029d8e49-040eaa14.bin')
+        data = open(path, "rb").read()
+        responses = accurip.getAccurateRipResponses(data)
+
+        # pretend track 10 only matches the database when shifted
+        checksums = [0, ] * 20
+        offsetChecksums = [{-6: 0, 0: 0, 6: 0} for i in range(20)]
+        offsetChecksums[10 - 1][-6] = int(responses[0].checksums[10 - 1], 16)
+
+        prog = program.Program(config.Config())
+        prog.result = result.RipResult()
+        for i in range(20):
+            r = result.TrackResult()
+            r.number = i + 1
+            prog.result.tracks.append(r)
+
+        prog._verifyImageWithChecksums(responses, checksums,
+            offsetChecksums=offsetChecksums)
+
+        tr = prog.result.getTrackResult(10)
+        self.assertEquals(tr.accurip, True)
+        self.assertEquals(tr.ARDBOffset, -6)
+        self.assertEquals(tr.ARDBConfidence, responses[0].confidences[10 - 1])
+
+        tr = prog.result.getTrackResult(2)
+        self.assertEquals(tr.accurip, False)
+        self.assertEquals(tr.ARDBOffset, None)
+
+        res = prog.getAccurateRipResults()
+        self.failUnless(res[10 - 1].startswith(
+            "Track 10: rip accurate "), res[10 - 1])
+        self.failUnless(res[10 - 1].endswith(" (offset -6)"), res[10 - 1])
+
+
+class ConfidenceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__),
+            'dBAR-020-002e5023-029d8e49-040eaa14.bin')
+        data = open(path, "rb").read()
+        self._responses = accurip.getAccurateRipResponses(data)
+        self._prog = program.Program(config.Config())
+
+    def testConfidence(self):
+        # track 1 has confidence 0, track 2 confidence 2
+        get = self._prog.getAccurateRipChecksums
+        self.assertEquals(get(self._responses, 1, 1), [])
+        self.assertEquals(get(self._responses, 1, 0), [0, ])
+        self.assertEquals(get(self._responses, 2, 2), [0xaf8c44c5, ])
+        self.assertEquals(get(self._responses, 2, 3), [])
+
+    def testMissing(self):
+        get = self._prog.getAccurateRipChecksums
+        self.assertEquals(get(None, 2, 0), [])
+        # the response has 20 tracks
+        self.assertEquals(get(self._responses, 21, 0), [])
+
+
+class VerifyTrackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix=u'.morituri.test')
+        self._audio = ''.join([chr(i % 256) for i in range(588 * 4 * 10)])
+
+        self._prog = program.Program(config.Config())
+        self._prog.result = result.RipResult()
+        self._trackResult = result.TrackResult()
+        self._trackResult.number = 1
+        self._trackResult.filename = os.path.join(self._dir, u'01.wav')
+
+        writer = wav.WAVWriter(self._trackResult.filename)
+        writer.setLength(len(self._audio) / 4)
+        writer.update(self._audio)
+        writer.finish()
+
+        crc = analysis.CRC32Accumulator()
+        crc.update(self._audio)
+        self._crc = crc.checksum
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _verify(self, testcrc, copycrc, copySkipped):
+        self._trackResult.testcrc = testcrc
+        self._trackResult.copycrc = copycrc
+        self._trackResult.copySkipped = copySkipped
+        return self._prog.verifyTrack(task.SyncRunner(verbose=False),
+            self._trackResult)
+
+    def testVerify(self):
+        self.failUnless(self._verify(self._crc, self._crc, False))
+        self.failIf(self._verify(self._crc, self._crc ^ 1, False))
+
+    def testVerifyCopySkipped(self):
+        # without a copy read, the file is checked against the test read
+        self.failUnless(self._verify(self._crc, None, True))
+        self.failIf(self._verify(self._crc ^ 1, None, True))
+
+
 class HTOATestCase(unittest.TestCase):
 
     def setUp(self):
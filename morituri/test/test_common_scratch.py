@@ -0,0 +1,82 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_scratch -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import tempfile
+
+from morituri.common import scratch
+
+from morituri.test import common as tcommon
+
+
+class _StatVFS:
+    # what os.statvfs returns for a filesystem with 1 MiB free
+
+    f_bavail = 256
+    f_frsize = 4096
+
+
+class ScratchSpaceTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._scratch = tempfile.mkdtemp(suffix=u'.morituri.test')
+        self._out = tempfile.mkdtemp(suffix=u'.morituri.test')
+        self._path = os.path.join(self._out, u'01. Track.flac')
+
+        # do not depend on the free space of the filesystem we run on
+        self._statvfs = getattr(os, 'statvfs', None)
+        os.statvfs = lambda path: _StatVFS()
+
+    def tearDown(self):
+        if self._statvfs:
+            os.statvfs = self._statvfs
+        else:
+            del os.statvfs
+        shutil.rmtree(self._scratch)
+        shutil.rmtree(self._out)
+
+    def testWAVPath(self):
+        s = scratch.ScratchSpace(self._scratch)
+        path = s.getWAVPath(1024, self._path)
+        self.failUnless(isinstance(path, unicode))
+        self.assertEquals(os.path.dirname(path), self._scratch)
+        self.failUnless(path.endswith(u'.wav'))
+
+    def testWAVPathFull(self):
+        s = scratch.ScratchSpace(self._scratch)
+        free = s.getFreeBytes(self._scratch)
+        self.assertEquals(free, 1024 * 1024)
+
+        path = s.getWAVPath(free + 1, self._path)
+        self.assertEquals(os.path.dirname(path), self._out)
+
+    def testWAVPathReserved(self):
+        s = scratch.ScratchSpace(self._scratch)
+        free = s.getFreeBytes(self._scratch)
+
+        # the first file still has to grow, so there is no room left
+        first = s.getWAVPath(free / 2 + 1, self._path)
+        self.assertEquals(os.path.dirname(first), self._scratch)
+        second = s.getWAVPath(free / 2 + 1, self._path)
+        self.assertEquals(os.path.dirname(second), self._out)
+
+        # once it is gone there is
+        os.unlink(first)
+        third = s.getWAVPath(free / 2 + 1, self._path)
+        self.assertEquals(os.path.dirname(third), self._scratch)
+
+    def testStagingPath(self):
+        s = scratch.ScratchSpace(self._scratch)
+        path = s.getStagingPath(self._path, 'flac')
+        self.failUnless(isinstance(path, unicode))
+        self.assertEquals(os.path.dirname(path), self._out)
+        self.failUnless(os.path.basename(path).startswith(u'.'))
+        self.failUnless(path.endswith(u'.flac'))
+
+    def testPartialPath(self):
+        s = scratch.ScratchSpace(self._scratch)
+        path = s.getPartialPath(self._path, u'test.wav')
+        self.assertEquals(path, os.path.join(self._out,
+            u'.01. Track.flac.morituri.partial.test.wav'))
+        self.assertEquals(s.getPartialPath(self._path, u'test.wav'), path)
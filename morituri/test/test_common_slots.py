@@ -0,0 +1,55 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_slots -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import shutil
+import tempfile
+
+import gobject
+
+from morituri.common import slots
+
+from morituri.extern.task import task
+
+from morituri.test import common as tcommon
+
+
+class SlotPoolTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._path = tempfile.mkdtemp(suffix=u'.morituri.test')
+
+    def tearDown(self):
+        shutil.rmtree(self._path)
+
+    def testAcquire(self):
+        pool = slots.SlotPool(self._path, 2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.failUnless(first)
+        self.failUnless(second)
+        self.assertEquals(pool.acquire(), None)
+
+        # slots are shared with other pools on the same directory
+        other = slots.SlotPool(self._path, 2)
+        self.assertEquals(other.acquire(), None)
+
+        first.release()
+        third = other.acquire()
+        self.failUnless(third)
+        self.assertEquals(pool.acquire(), None)
+
+        second.release()
+        third.release()
+
+    def testAcquireTask(self):
+        pool = slots.SlotPool(self._path, 1)
+        slot = pool.acquire()
+
+        t = slots.AcquireSlotTask(pool)
+        gobject.timeout_add(100, slot.release)
+        runner = task.SyncRunner(verbose=False)
+        runner.run(t)
+
+        self.failUnless(t.slot)
+        self.assertEquals(pool.acquire(), None)
+        t.slot.release()
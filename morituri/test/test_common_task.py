@@ -0,0 +1,63 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_task -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+from morituri.common import task as ctask
+
+from morituri.extern.task import task
+
+from morituri.test import common as tcommon
+
+
+class FailingTask(ctask.LoggableTask):
+
+    description = 'Failing later'
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self.schedule(0.1, self._fail)
+
+    def _fail(self):
+        self.setProgress(0.5)
+        self.setException(KeyError('background'))
+        self.stop()
+
+
+class CountingTask(ctask.LoggableTask):
+
+    description = 'Counting'
+
+    count = 0
+
+    def start(self, runner):
+        task.Task.start(self, runner)
+        self._count()
+
+    def _count(self):
+        self.count += 1
+        if self.count < 5:
+            self.schedule(0.01, self._count)
+            return
+
+        self.stop()
+
+
+class BackgroundRunnerTestCase(tcommon.TestCase):
+
+    def testWait(self):
+        background = ctask.BackgroundRunner()
+        failing = FailingTask()
+        background.run(failing)
+        self.failIf(background.done)
+
+        # the background task keeps going while another task runs
+        runner = ctask.SyncRunner(verbose=False)
+        counting = CountingTask()
+        runner.run(counting)
+        self.assertEquals(counting.count, 5)
+
+        wait = ctask.WaitTask(background)
+        e = self.assertRaises(task.TaskException, runner.run, wait)
+        self.failUnless(background.done)
+        self.failUnless(isinstance(e.exception, KeyError))
+        self.assertEquals(wait.exception, failing.exception)
+        self.assertEquals(wait.progress, 0.5)
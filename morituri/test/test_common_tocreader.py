@@ -0,0 +1,94 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_tocreader -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import struct
+import tempfile
+
+from morituri.common import tocreader
+
+from morituri.test import common as tcommon
+
+
+class FileTocTestCase(tcommon.TestCase):
+
+    def testToc(self):
+        path = os.path.join(os.path.dirname(__file__), 'ladyhawke.toc')
+        table = tocreader.FileReadTOCTask(path).read()
+        self.failUnless(table.hasTOC())
+        self.assertEquals(table.getCDDBDiscId(), 'c60af50d')
+        self.assertEquals(table.getMusicBrainzDiscId(),
+            'KnpGsLhvH.lPrNc1PBL21lb9Bg4-')
+
+    def testUnknown(self):
+        self.assertRaises(ValueError,
+            tocreader.FileReadTOCTask('disc.iso').read)
+
+
+class FileCueTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix=u'.morituri.test')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, data):
+        handle = open(os.path.join(self._dir, name), 'wb')
+        handle.write(data)
+        handle.close()
+
+    def _writeWAV(self, name, frames):
+        size = frames * 2352
+        self._write(name, struct.pack('<4sI4s4sIHHIIHH4sI',
+            'RIFF', 36 + size, 'WAVE', 'fmt ', 16, 1, 2, 44100,
+            44100 * 4, 4, 16, 'data', size) + '\0' * size)
+
+    def testSingle(self):
+        self._write('disc.bin', '\0' * 2352 * 300)
+        self._write('disc.cue', '''FILE "disc.bin" BINARY
+  TRACK 01 AUDIO
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    INDEX 00 00:01:00
+    INDEX 01 00:02:00
+''')
+        table = tocreader.FileReadTOCTask(
+            os.path.join(self._dir, 'disc.cue')).read()
+        self.assertEquals(len(table.tracks), 2)
+        self.assertEquals(table.getTrackStart(2), 150)
+        self.assertEquals(table.tracks[1].getPregap(), 75)
+        self.assertEquals(table.leadout, 300)
+
+    def testSeparate(self):
+        self._writeWAV('01.wav', 100)
+        self._writeWAV('02.wav', 200)
+        self._write('disc.cue', '''FILE "01.wav" WAVE
+  TRACK 01 AUDIO
+    INDEX 01 00:00:00
+FILE "02.wav" WAVE
+  TRACK 02 AUDIO
+    INDEX 01 00:00:00
+''')
+        table = tocreader.FileReadTOCTask(
+            os.path.join(self._dir, 'disc.cue')).read()
+        self.assertEquals(table.getTrackStart(2), 100)
+        self.assertEquals(table.getTrackLength(2), 200)
+        self.assertEquals(table.leadout, 300)
+
+    def _writeCue(self, name):
+        self._write('disc.cue', '''FILE "%s" WAVE
+  TRACK 01 AUDIO
+    INDEX 01 00:00:00
+''' % name)
+        return tocreader.FileReadTOCTask(os.path.join(self._dir, 'disc.cue'))
+
+    def testCompressed(self):
+        self._write('01.flac', 'fLaC' + '\0' * 100)
+        self.assertRaises(ValueError, self._writeCue('01.flac').read)
+
+    def testNotWAV(self):
+        # a .wav file that is not CD audio is not taken for raw audio
+        self._write('01.wav', 'OggS' + '\0' * 2352 * 100)
+        self.assertRaises(ValueError, self._writeCue('01.wav').read)
@@ -0,0 +1,126 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_common_wav -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import tempfile
+import wave
+
+from morituri.common import wav
+
+from morituri.test import common as tcommon
+
+
+class WAVFileTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        fd, self._path = tempfile.mkstemp(suffix=u'.morituri.test.wav')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self._path)
+
+    def _write(self, data, channels=2, rate=44100):
+        handle = wave.open(self._path, 'wb')
+        handle.setnchannels(channels)
+        handle.setsampwidth(2)
+        handle.setframerate(rate)
+        handle.writeframes(data)
+        handle.close()
+
+    def testRead(self):
+        data = ''.join([chr(i % 256) for i in range(4 * 1000)])
+        self._write(data)
+
+        w = wav.WAVFile(self._path)
+        self.assertEquals(w.dataOffset, 44)
+        self.assertEquals(w.samples, 1000)
+
+        w.open()
+        self.assertEquals(w.read(0, 1000), data)
+        self.assertEquals(w.read(10, 5), data[40:60])
+        # reads are cut off at the end of the file
+        self.assertEquals(w.read(990, 20), data[3960:])
+        self.assertEquals(w.read(1000, 20), '')
+        w.close()
+
+    def testTruncated(self):
+        self._write('\0' * 4 * 1000)
+        handle = open(self._path, 'r+b')
+        handle.truncate(44 + 4 * 500 + 2)
+        handle.close()
+
+        w = wav.WAVFile(self._path)
+        self.assertEquals(w.samples, 500)
+
+    def testEmpty(self):
+        self._write('')
+
+        w = wav.WAVFile(self._path)
+        self.assertEquals(w.samples, 0)
+        w.open()
+        self.assertEquals(w.read(0, 10), '')
+        w.close()
+
+    def testMono(self):
+        self._write('\0' * 4 * 1000, channels=1)
+        self.assertRaises(wav.WAVError, wav.WAVFile, self._path)
+
+    def testNotWAV(self):
+        handle = open(self._path, 'wb')
+        handle.write('fLaC' + '\0' * 100)
+        handle.close()
+        self.assertRaises(wav.WAVError, wav.WAVFile, self._path)
+
+
+class WAVWriterTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        fd, self._path = tempfile.mkstemp(suffix=u'.morituri.test.wav')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self._path)
+
+    def testWrite(self):
+        data = os.urandom(4 * 1000)
+
+        writer = wav.WAVWriter(unicode(self._path))
+        writer.setLength(1000)
+        writer.update(data[:1000])
+        writer.update(data[1000:])
+        writer.finish()
+
+        w = wav.WAVFile(self._path)
+        self.assertEquals(w.samples, 1000)
+        w.open()
+        self.assertEquals(w.read(0, 1000), data)
+        w.close()
+
+    def testShort(self):
+        # the header gets fixed up for fewer samples than announced
+        writer = wav.WAVWriter(unicode(self._path))
+        writer.setLength(1000)
+        writer.update('\0' * 4 * 10)
+        writer.finish()
+
+        self.assertEquals(wave.open(self._path).getnframes(), 10)
+
+    def testKeepSamples(self):
+        data = os.urandom(4 * 1000)
+
+        writer = wav.WAVWriter(unicode(self._path))
+        writer.setLength(1000)
+        writer.update(data[:4 * 600])
+        writer.finish()
+
+        # continue after the first 500 samples, dropping the rest
+        writer = wav.WAVWriter(unicode(self._path), keepSamples=500)
+        writer.setLength(1000)
+        writer.update(data[4 * 500:])
+        writer.finish()
+
+        self.assertEquals(wave.open(self._path).getnframes(), 1000)
+        w = wav.WAVFile(self._path)
+        w.open()
+        self.assertEquals(w.read(0, 1000), data)
+        w.close()
@@ -2,8 +2,13 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import os
+import shutil
+import struct
+import tempfile
 
+from morituri.common import analysis, scratch, wav, common as mcommon
 from morituri.extern.task import task
+from morituri.image import table
 
 from morituri.program import cdparanoia
 
@@ -27,6 +32,15 @@ class ParseTestCase(common.TestCase):
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEquals(q, '99.6 %')
 
+        # frame 47175 and the 13 frames after it were read again
+        self.assertEquals(self._parser.getReadMap(), [
+            (45990, 46003, 1),
+            (46004, 47174, 2),
+            (47175, 47175, 3),
+            (47176, 47188, 4),
+            (47189, 47719, 2),
+        ])
+
 class Parse1FrameTestCase(common.TestCase):
 
     def setUp(self):
@@ -42,6 +56,7 @@ class Parse1FrameTestCase(common.TestCase):
 
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEquals(q, '100.0 %')
+        self.assertEquals(self._parser.getReadMap(), [(0, 0, 1), ])
 
 
 class ErrorTestCase(common.TestCase):
@@ -61,6 +76,464 @@ class ErrorTestCase(common.TestCase):
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEquals(q, '79.6 %')
 
+        # the read map accounts for all reads
+        readMap = self._parser.getReadMap()
+        self.assertEquals(readMap[0][0], 0)
+        self.assertEquals(readMap[-1][1], 10800)
+        self.assertEquals(sum([(last - first + 1) * reads
+            for first, last, reads in readMap]), self._parser.reads)
+
+
+class FrameRangesTestCase(common.TestCase):
+
+    def testRanges(self):
+        self.assertEquals(cdparanoia.getFrameRanges([]), [])
+        self.assertEquals(cdparanoia.getFrameRanges([3, 4, 5, 9, 20]),
+            [(3, 5), (9, 9), (20, 20)])
+        self.assertEquals(cdparanoia.getFrameRanges([3, 4, 5, 9, 20], gap=3),
+            [(3, 9), (20, 20)])
+
+
+_FRAMES = 100 # frames in the image
+
+
+def _getSamples(first, last):
+    # the audio of the image, with each sample holding its number, and
+    # silence outside of it
+    return "".join([struct.pack('<I',
+            0 <= i < _FRAMES * mcommon.SAMPLES_PER_FRAME and i or 0)
+        for i in range(first, last + 1)])
+
+
+def _getTable():
+    # a table for the image, with its second track on frames 10 to 69
+    t = table.Table()
+    for number, start in enumerate([0, 10, 70]):
+        track = table.Track(number + 1)
+        track.index(1, absolute=start)
+        t.tracks.append(track)
+    t.leadout = _FRAMES
+
+    return t
+
+
+class ImageReadTrackTask(cdparanoia.CdioReadTrackTask):
+    # reads from a string of sectors instead of a device
+
+    def __init__(self, image, failures, *args, **kwargs):
+        cdparanoia.CdioReadTrackTask.__init__(self, *args, **kwargs)
+        self._image = image
+        self._failures = failures # sector -> how many reads fail
+        self.reads = [] # (first sector, count) of each read
+
+    def _open(self):
+        pass
+
+    def _readDevice(self, lsn, count):
+        self.reads.append((lsn, count))
+        for sector in range(lsn, lsn + count):
+            if self._failures.get(sector):
+                if count == 1:
+                    self._failures[sector] -= 1
+                raise IOError('could not read sector %d' % sector)
+
+        return self._image[lsn * mcommon.BYTES_PER_FRAME:
+            (lsn + count) * mcommon.BYTES_PER_FRAME]
+
+
+class ImageTestCase(common.TestCase):
+    # reads from the image, with a temporary directory to write to
+
+    def setUp(self):
+        self.runner = task.SyncRunner(verbose=False)
+        self._image = _getSamples(0, _FRAMES * mcommon.SAMPLES_PER_FRAME - 1)
+        self._table = _getTable()
+        self._dir = tempfile.mkdtemp(suffix=u'.morituri.test')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _getChecksums(self, number):
+        # the AccurateRip v1 and v2 checksums of a track of the image
+        start = self._table.getTrackStart(number)
+        stop = self._table.getTrackEnd(number)
+        arcs = analysis.AccurateRipAccumulator(number, 3)
+        arcs.setLength((stop - start + 1) * mcommon.SAMPLES_PER_FRAME)
+        arcs.update(_getSamples(start * mcommon.SAMPLES_PER_FRAME,
+            (stop + 1) * mcommon.SAMPLES_PER_FRAME - 1))
+        return arcs.checksum, arcs.checksumV2
+
+
+class CdioReadTrackTestCase(ImageTestCase):
+
+    def _read(self, start, stop, offset=0, failures=None):
+        buf = analysis.BufferAccumulator()
+        t = ImageReadTrackTask(self._image, failures or {}, None,
+            self._table, start, stop, offset=offset, accumulators=[buf, ])
+        self.runner.run(t)
+        return t, buf.data
+
+    def testRead(self):
+        t, data = self._read(10, 69)
+        self.assertEquals(data, _getSamples(10 * 588, 70 * 588 - 1))
+        self.assertEquals(t.readMap, [(10, 69, 1), ])
+        self.assertEquals(t.quality, 1.0)
+
+    def testOffset(self):
+        t, data = self._read(10, 69, offset=6)
+        self.assertEquals(data, _getSamples(10 * 588 + 6, 70 * 588 + 5))
+
+        t, data = self._read(10, 69, offset=-600)
+        self.assertEquals(data, _getSamples(10 * 588 - 600, 70 * 588 - 601))
+
+    def testOutsideDisc(self):
+        t, data = self._read(0, 99, offset=-6)
+        self.assertEquals(data, _getSamples(-6, 100 * 588 - 7))
+
+        t, data = self._read(0, 99, offset=6)
+        self.assertEquals(data, _getSamples(6, 100 * 588 + 5))
+
+    def testRetry(self):
+        t, data = self._read(10, 69, failures={40: 2})
+        self.assertEquals(data, _getSamples(10 * 588, 70 * 588 - 1))
+        self.assertEquals(t.retries, 2)
+        self.assertEquals(t.readMap, [
+            (10, 39, 1),
+            (40, 40, 3),
+            (41, 69, 1),
+        ])
+
+    def testFail(self):
+        self.assertRaises(task.TaskException, self._read, 10, 69,
+            failures={40: cdparanoia.CdioReadTrackTask._MAXRETRIES + 1})
+
+
+class ResumeTestCase(ImageTestCase):
+
+    def setUp(self):
+        ImageTestCase.setUp(self)
+        self._path = os.path.join(self._dir, u'track.wav')
+        self._scratch = scratch.ScratchSpace(self._dir)
+        self._wavPath = self._scratch.getPartialPath(self._path, u'test.wav')
+        self._journalPath = self._scratch.getPartialPath(self._path,
+            u'journal')
+
+    def _seed(self, name, frames, noted, offset=0):
+        # leave what an interrupted read of track 2 would: a partial .wav
+        # with the given number of frames, and a journal that noted some
+        path = self._scratch.getPartialPath(self._path, u'%s.wav' % name)
+        writer = wav.WAVWriter(path)
+        writer.setLength(frames * mcommon.SAMPLES_PER_FRAME)
+        writer.update(_getSamples(10 * mcommon.SAMPLES_PER_FRAME,
+            (10 + frames) * mcommon.SAMPLES_PER_FRAME - 1))
+        writer.finish()
+
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, offset)
+        journal.setFrames(name, noted)
+        journal.save()
+
+    def testJournal(self):
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, 0)
+        self.assertEquals(journal.getFrames('test', self._wavPath), 0)
+
+        # the file has fewer frames than the journal noted
+        self._seed('test', 20, 30)
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, 0)
+        self.assertEquals(journal.getFrames('test', self._wavPath), 20)
+        self.assertEquals(journal.getFrames('copy', self._wavPath), 0)
+
+        # the journal noted fewer frames than the file has
+        self._seed('test', 40, 30)
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, 0)
+        self.assertEquals(journal.getFrames('test', self._wavPath), 30)
+
+    def testJournalChanged(self):
+        self._seed('test', 40, 30)
+
+        # reading the track differently starts over
+        for start, stop, offset in [(10, 69, 6), (11, 69, 0), (10, 68, 0)]:
+            journal = cdparanoia.ReadJournal(self._journalPath,
+                start, stop, offset)
+            self.assertEquals(journal.getFrames('test', self._wavPath), 0)
+
+    def testResume(self):
+        self._seed('test', 40, 30)
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, 0)
+        resume = journal.getFrames('test', self._wavPath)
+        self.assertEquals(resume, 30)
+
+        buf = analysis.BufferAccumulator()
+        t = ImageReadTrackTask(self._image, {}, self._wavPath, self._table,
+            10, 69, accumulators=[buf,
+                cdparanoia._JournalAccumulator(journal, 'test')],
+            resumeFrames=resume)
+        self.runner.run(t)
+
+        # the accumulators got all of the track, but only the frames after
+        # the resumed ones were read
+        audio = _getSamples(10 * mcommon.SAMPLES_PER_FRAME,
+            70 * mcommon.SAMPLES_PER_FRAME - 1)
+        self.assertEquals(buf.data, audio)
+        self.assertEquals(t.reads[0][0], 40)
+        self.assertEquals(t.readMap, [(40, 69, 1), ])
+
+        w = wav.WAVFile(self._wavPath)
+        w.open()
+        self.assertEquals(w.read(0, w.samples), audio)
+        w.close()
+
+        journal = cdparanoia.ReadJournal(self._journalPath, 10, 69, 0)
+        self.assertEquals(journal.getFrames('test', self._wavPath), 60)
+
+    def testResumeArguments(self):
+        buf = analysis.BufferAccumulator()
+        t = cdparanoia.ReadTrackTask(self._wavPath, self._table, 10, 69,
+            accumulators=[buf, ], resumeFrames=30)
+        # cdparanoia only reads the frames after the resumed ones
+        self.assertEquals(t._getArguments()[-2],
+            '2[00:00:00.30]-2[00:00:00.59]')
+
+        t = cdparanoia.ReadTrackTask(self._wavPath, self._table, 10, 69,
+            accumulators=[buf, ])
+        self.assertEquals(t._getArguments()[-2],
+            '2[00:00:00.00]-2[00:00:00.59]')
+
+    def _getTask(self, offset=0):
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        return cdparanoia.ReadVerifyTrackTask(self._path, self._table,
+            10, 69, offset=offset, profile=encode.WavProfile(),
+            scratch=self._scratch, resumable=True)
+
+    def testResumeTest(self):
+        self._seed('test', 40, 30)
+        self._seed('copy', 20, 20)
+
+        # the copy read is only kept once the test read is complete
+        t = self._getTask()
+        self.assertEquals(t._readtask._resumeFrames, 30)
+        self.assertEquals(t._verifytask._resumeFrames, 0)
+
+    def testResumeCopy(self):
+        self._seed('copy', 20, 20)
+        self._seed('test', 60, 60)
+
+        # the last frame always gets read again
+        t = self._getTask()
+        self.assertEquals(t._readtask._resumeFrames, 59)
+        self.assertEquals(t._verifytask._resumeFrames, 20)
+
+    def testResumeOffsetChanged(self):
+        self._seed('copy', 20, 20)
+        self._seed('test', 60, 60)
+
+        t = self._getTask(offset=6)
+        self.assertEquals(t._readtask._resumeFrames, 0)
+        self.assertEquals(t._verifytask._resumeFrames, 0)
+
+
+class SingleReadTestCase(ImageTestCase):
+
+    def _read(self, checksums):
+        # read track 2, with the given AccurateRip checksums
+        path = os.path.join(self._dir, u'02.wav')
+        readers = []
+
+        def reader(*args, **kwargs):
+            readers.append(ImageReadTrackTask(self._image, {}, *args,
+                **kwargs))
+            return readers[-1]
+
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        t = cdparanoia.ReadVerifyTrackTask(path, self._table, 10, 69,
+            profile=encode.WavProfile(), trackNumber=2, trackCount=3,
+            accurateRipChecksums=checksums,
+            scratch=scratch.ScratchSpace(self._dir), reader=reader)
+        verifytask = t._verifytask
+        self.runner.run(t)
+
+        w = wav.WAVFile(path)
+        w.open()
+        self.assertEquals(w.read(0, w.samples), _getSamples(
+            10 * mcommon.SAMPLES_PER_FRAME,
+            70 * mcommon.SAMPLES_PER_FRAME - 1))
+        w.close()
+        self.assertEquals(t.checksum, t.testchecksum)
+
+        return t, verifytask, readers
+
+    def _assertSkipped(self, checksums):
+        t, verifytask, readers = self._read(checksums)
+
+        self.failUnless(t.copyskipped)
+        self.failIf(verifytask in t.tasks)
+        # only the test read read anything
+        self.failUnless(readers[0].reads)
+        self.failIf(readers[1].reads)
+
+    def testMatchV1(self):
+        v1, v2 = self._getChecksums(2)
+        self._assertSkipped([0, v1])
+
+    def testMatchV2(self):
+        v1, v2 = self._getChecksums(2)
+        self._assertSkipped([v2, ])
+
+    def testNoMatch(self):
+        v1, v2 = self._getChecksums(2)
+        t, verifytask, readers = self._read([v1 ^ 1, v2 ^ 1])
+
+        self.failIf(t.copyskipped)
+        self.failUnless(verifytask in t.tasks)
+        self.failUnless(readers[1].reads)
+        self.assertEquals(t.copychecksum, t.testchecksum)
+
+
+class BurstTestCase(ImageTestCase):
+
+    def _burst(self, checksums):
+        # burst read tracks 2 and 3, with the given AccurateRip checksums
+        tracks = []
+        for number, trackChecksums in zip([2, 3], checksums):
+            tracks.append(cdparanoia.DiscTrack(
+                os.path.join(self._dir, u'%02d.wav' % number),
+                self._table.getTrackStart(number),
+                self._table.getTrackEnd(number),
+                trackNumber=number, accurateRipChecksums=trackChecksums))
+
+        def reader(*args, **kwargs):
+            return ImageReadTrackTask(self._image, {}, *args, **kwargs)
+
+        # here to avoid import gst eating our options
+        from morituri.common import encode
+
+        t = cdparanoia.ReadVerifyDiscTask(tracks, self._table,
+            profile=encode.WavProfile(), trackCount=3, burst=True,
+            scratch=scratch.ScratchSpace(self._dir), reader=reader)
+        self.runner.run(t)
+
+        return t
+
+    def _assertStored(self, track):
+        self.failIf(track.exception)
+        self.failUnless(track.copyskipped)
+        self.assertEquals(track.checksum, track.testchecksum)
+
+        w = wav.WAVFile(track.path)
+        w.open()
+        self.assertEquals(w.read(0, w.samples), _getSamples(
+            track.start * mcommon.SAMPLES_PER_FRAME,
+            (track.stop + 1) * mcommon.SAMPLES_PER_FRAME - 1))
+        w.close()
+
+    def _assertNotStored(self, t, i):
+        track = t.tracks[i]
+        self.failUnless(isinstance(track.exception,
+            cdparanoia.ChecksumException))
+        self.failIf(track.copyskipped)
+        self.failIf(track.checksum)
+        self.failIf(t._encodetasks[i] in t.tasks)
+        self.failIf(os.path.exists(track.path))
+
+    def testMatchV1(self):
+        v1, v2 = self._getChecksums(2)
+        t = self._burst([[v1, ], [0, ]])
+
+        self._assertStored(t.tracks[0])
+        self._assertNotStored(t, 1)
+        self.assertEquals(t.copyspeed, 0.0)
+        self.assertEquals(t.copyduration, 0.0)
+
+        # nothing but the stored track is left behind
+        self.assertEquals(os.listdir(self._dir), [u'02.wav', ])
+
+    def testMatchV2(self):
+        v1, v2 = self._getChecksums(3)
+        t = self._burst([None, [v2, ]])
+
+        self._assertNotStored(t, 0)
+        self._assertStored(t.tracks[1])
+        self.assertEquals(os.listdir(self._dir), [u'03.wav', ])
+
+
+class RepairTestCase(ImageTestCase):
+
+    def setUp(self):
+        ImageTestCase.setUp(self)
+        self._path = os.path.join(self._dir, u'track.wav')
+        self._audio = _getSamples(10 * mcommon.SAMPLES_PER_FRAME,
+            70 * mcommon.SAMPLES_PER_FRAME - 1)
+
+    def _corrupt(self, audio, frame):
+        # returns the audio of track 2 with the given frame zeroed
+        offset = frame * mcommon.BYTES_PER_FRAME
+        return audio[:offset] + '\0' * mcommon.BYTES_PER_FRAME + \
+            audio[offset + mcommon.BYTES_PER_FRAME:]
+
+    def _getChecksums(self, audio):
+        frames = analysis.BlockCRC32Accumulator(
+            blockSamples=mcommon.SAMPLES_PER_FRAME)
+        frames.update(audio)
+        frames.finish()
+        return frames.checksums
+
+    def _repair(self, test, copy, image):
+        # settle frame 5 of track 2 from the test and copy reads of it,
+        # re-reading frames 14 to 16 of the given image
+        writer = wav.WAVWriter(self._path)
+        writer.setLength(len(copy) / 4)
+        writer.update(copy)
+        writer.finish()
+
+        buf = analysis.BufferAccumulator()
+        self.runner.run(ImageReadTrackTask(image, {}, None, self._table,
+            14, 16, accumulators=[buf, ]))
+
+        crc = analysis.CRC32Accumulator()
+        t = cdparanoia.RepairTask(self._path, 10, self._getChecksums(test),
+            self._getChecksums(copy), [5, ], [(14, buf), ], [crc, ])
+        self.runner.run(t)
+        return t, crc
+
+    def _assertWAV(self, audio):
+        w = wav.WAVFile(self._path)
+        w.open()
+        self.assertEquals(w.read(0, w.samples), audio)
+        w.close()
+
+    def testRepairCopy(self):
+        t, crc = self._repair(self._audio, self._corrupt(self._audio, 5),
+            self._image)
+
+        self.assertEquals(t.repaired, [5, ])
+        self._assertWAV(self._audio)
+        reference = analysis.CRC32Accumulator()
+        reference.update(self._audio)
+        self.assertEquals(crc.checksum, reference.checksum)
+
+    def testKeepCopy(self):
+        t, crc = self._repair(self._corrupt(self._audio, 5), self._audio,
+            self._image)
+
+        self.assertEquals(t.repaired, [])
+        self._assertWAV(self._audio)
+
+    def testNoMajority(self):
+        # the re-read disagrees with both reads
+        image = self._image[:15 * mcommon.BYTES_PER_FRAME] + \
+            '\1' * mcommon.BYTES_PER_FRAME + \
+            self._image[16 * mcommon.BYTES_PER_FRAME:]
+        copy = self._corrupt(self._audio, 5)
+
+        e = self.assertRaises(task.TaskException, self._repair,
+            self._audio, copy, image)
+        self.failUnless(isinstance(e.exception,
+            cdparanoia.ChecksumException))
+        self._assertWAV(copy)
+
 
 class VersionTestCase(common.TestCase):
 
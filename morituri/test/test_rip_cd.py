@@ -0,0 +1,115 @@
+# -*- Mode: Python; test-case-name: morituri.test.test_rip_cd -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import StringIO
+import struct
+import tempfile
+
+from morituri.common import cache, directory, mbngs, tocreader, wav
+from morituri.rip import main
+
+from morituri.test import common as tcommon
+
+try:
+    import cdio
+except ImportError:
+    cdio = None
+
+
+class RipImageTestCase(tcommon.TestCase):
+    # rips a BIN/CUE image like a disc, without a drive
+
+    if not cdio:
+        skip = 'pycdio is needed to read tracks from an image'
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix=u'.morituri.test')
+        self._outdir = os.path.join(self._dir, u'out')
+
+        # keep the caches and the configuration of the test to itself
+        self._getCache = directory.Directory.getCache
+        self._getReadCaches = directory.Directory.getReadCaches
+        self._getConfig = directory.Directory.getConfig
+        cacheDir = os.path.join(self._dir, u'cache')
+
+        def getCache(d, name=None):
+            path = os.path.join(cacheDir, name or '')
+            if not os.path.exists(path):
+                os.makedirs(path)
+            return path
+
+        directory.Directory.getCache = getCache
+        directory.Directory.getReadCaches = lambda d, name=None: [
+            getCache(d, name), ]
+        directory.Directory.getConfig = lambda d: os.path.join(self._dir,
+            u'morituri.conf')
+
+        # two tracks of 4 seconds, the second one with a 1 second pregap
+        handle = open(os.path.join(self._dir, u'disc.bin'), 'wb')
+        handle.write(''.join([struct.pack('<I', i * 7919 % 2 ** 32)
+            for i in range(600 * 588)]))
+        handle.close()
+        self._cuePath = os.path.join(self._dir, u'disc.cue')
+        handle = open(self._cuePath, 'w')
+        handle.write('''FILE "disc.bin" BINARY
+  TRACK 01 AUDIO
+    INDEX 01 00:00:00
+  TRACK 02 AUDIO
+    INDEX 00 00:03:00
+    INDEX 01 00:04:00
+''')
+        handle.close()
+
+        # a MusicBrainz lookup of the disc that is already cached
+        table = tocreader.FileReadTOCTask(self._cuePath).read()
+        md = mbngs.DiscMetadata()
+        md.artist = md.sortName = u'Morituri'
+        md.title = md.releaseTitle = u'Image'
+        md.duration = table.duration()
+        md.url = u'https://musicbrainz.org/release/image'
+        md.tracks = []
+        for number in (1, 2):
+            track = mbngs.TrackMetadata()
+            track.artist = track.sortName = u'Morituri'
+            track.title = u'Track %d' % number
+            md.tracks.append(track)
+        cache.MusicBrainzCache().set(table.getMusicBrainzDiscId(), [md, ])
+
+    def tearDown(self):
+        directory.Directory.getCache = self._getCache
+        directory.Directory.getReadCaches = self._getReadCaches
+        directory.Directory.getConfig = self._getConfig
+        shutil.rmtree(self._dir)
+
+    def _getFiles(self, extension):
+        paths = []
+        for root, dirs, files in os.walk(self._outdir):
+            paths.extend([os.path.join(root, f) for f in files
+                if f.endswith(extension)])
+        return sorted(paths)
+
+    def testRip(self):
+        stdout = StringIO.StringIO()
+        c = main.Rip(stdout=stdout, stderr=stdout)
+        ret = c.parse(['cd', '--device', self._cuePath, 'rip',
+            '--output-directory', self._outdir, '--profile', 'wav'])
+        # cdrdao cannot scan an image, so this only gets here when the
+        # table came from the .cue file
+        self.failIf(ret, stdout.getvalue())
+
+        output = stdout.getvalue()
+        self.failUnless('Checksums match for track 1' in output, output)
+        self.failUnless('Checksums match for track 2' in output, output)
+
+        tracks = self._getFiles('.wav')
+        self.assertEquals(len(tracks), 2)
+        # the pregap of track 2 is ripped with track 1
+        self.assertEquals([wav.WAVFile(p).samples for p in tracks],
+            [300 * 588, 300 * 588])
+
+        cues = self._getFiles('.cue')
+        self.assertEquals(len(cues), 1)
+        self.failUnless('INDEX 00 00:03:00' in open(cues[0]).read())
+        self.assertEquals(len(self._getFiles('.log')), 1)